@@ -0,0 +1,22 @@
+"""
+Inference code shared by the LLM service and the edge LLM service
+
+Both services run their models through an InferenceBackend, decode with
+the same batched loop and sampler, and parse requests and stream results
+with the same helpers, so a change to any of them applies to every
+backend at once.
+"""
+
+from .backends import (
+    InferenceBackend,
+    OnnxBackend,
+    TFLiteBackend,
+    TorchBackend,
+    TritonBackend,
+    create_backend,
+)
+from .decoding import generate, generate_tokens, get_token_buffers, position_ids
+from .protocol import RequestError, StreamDecoder, parse_generate_request, sse_event
+from .sampling import Sampler
+from .startup import StartupLoader
+from .tokenization import PromptEncoder, load_tokenizer
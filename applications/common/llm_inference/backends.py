@@ -0,0 +1,430 @@
+"""
+Inference backends shared by the LLM services
+
+Every backend runs one forward pass of a causal LM over NumPy arrays and
+returns the logits plus, when it supports them, the updated past key/values.
+Past key/values are kept in the legacy layout, one (key, value) pair per
+layer shaped (batch, heads, sequence, head_dim), so the decoding loop can
+treat them the same way whatever runs the model.
+
+Runtimes are imported when a backend is created, so a service only needs
+the packages of the backend it actually uses.
+"""
+
+import os
+import glob
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ONNX Runtime graph optimization levels by configuration name
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# Sequence length buckets of TFLite models exported with a dynamic length
+DEFAULT_TFLITE_LENGTHS = (64, 128, 256)
+
+
+class InferenceBackend:
+    """Interface of a model runtime used by the decoding loop"""
+
+    #: Human readable name reported by the services
+    label = None
+    #: Whether forward accepts and returns past key/values
+    supports_past = False
+    #: Longest sequence forward accepts, or None when only the model limits it
+    max_sequence_length = None
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        """
+        Run the model over the given tokens
+
+        Args:
+            input_ids: int64 array shaped (batch, sequence), only the tokens
+                not yet covered by past
+            attention_mask: int64 array covering past and input_ids
+            position_ids: int64 array shaped like input_ids
+            past: Past key/values from the previous call, or None
+
+        Returns:
+            Tuple of (logits shaped (batch, positions, vocab) and ending at
+            the last input token, present key/values or None when the
+            backend does not support them). Backends may return the last
+            position only.
+        """
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """
+    Hugging Face PyTorch model
+
+    Args:
+        model: Causal LM, e.g. from AutoModelForCausalLM.from_pretrained
+    """
+
+    label = "PyTorch"
+    supports_past = True
+
+    def __init__(self, model):
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        import torch
+
+        with torch.no_grad():
+            if past is not None:
+                past = self._to_model_cache(tuple((torch.from_numpy(k), torch.from_numpy(v))
+                                                  for k, v in past))
+            outputs = self.model(
+                input_ids=torch.from_numpy(input_ids),
+                attention_mask=torch.from_numpy(attention_mask),
+                position_ids=torch.from_numpy(position_ids) if position_ids is not None else None,
+                past_key_values=past,
+                use_cache=True,
+            )
+        present = outputs.past_key_values
+        if hasattr(present, "to_legacy_cache"):
+            present = present.to_legacy_cache()
+        elif not isinstance(present, tuple):
+            present = tuple((layer.keys, layer.values) for layer in present.layers)
+        return (outputs.logits.float().numpy(),
+                tuple((k.float().numpy(), v.float().numpy()) for k, v in present))
+
+    @staticmethod
+    def _to_model_cache(past):
+        """Convert a legacy cache into whatever the installed transformers expects"""
+        try:
+            from transformers import DynamicCache
+        except ImportError:
+            # Older releases take the tuple layout directly
+            return past
+        if hasattr(DynamicCache, "from_legacy_cache"):
+            return DynamicCache.from_legacy_cache(past)
+        return DynamicCache(past)
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX Runtime session over a decoder exported by model_optimization.py
+
+    Sessions exported with --with-past take past_key_values.{i}.key/value
+    inputs and return present.{i}.key/value outputs, plain exports only
+    take input_ids and attention_mask.
+
+    With io_binding, outputs are written by the runtime straight into
+    buffers owned by the calling thread instead of freshly allocated arrays.
+    Logits and present key/values returned by forward are then only valid
+    until the thread's next-but-one call, which is all the decoding loop
+    needs. Callers that keep caches around, like the LLM service's
+    continuous batching engine, must leave it off.
+
+    Args:
+        session: onnxruntime.InferenceSession
+        io_binding: Bind outputs to reusable per-thread buffers
+    """
+
+    label = "ONNX"
+
+    def __init__(self, session, io_binding=False):
+        self.session = session
+        self.input_names = {i.name for i in session.get_inputs()}
+        self.output_names = [o.name for o in session.get_outputs()]
+        self.past_inputs = [i for i in session.get_inputs()
+                            if i.name.startswith("past_key_values.")]
+        self.supports_past = bool(self.past_inputs)
+        # Binding needs the vocabulary size up front to size the logits buffer
+        self.vocab_size = session.get_outputs()[0].shape[-1]
+        self.io_binding = io_binding and isinstance(self.vocab_size, int)
+        self._buffers = threading.local()
+
+    @classmethod
+    def from_file(cls, model_file, num_threads=None, inter_op_threads=None,
+                  graph_optimization="all", optimized_model_path=None, io_binding=False):
+        """
+        Create a CPU, or GPU when available, session for model_file
+
+        Args:
+            model_file: ONNX model to load
+            num_threads: Intra-op threads, or None for one per core
+            inter_op_threads: Threads running independent graph nodes in
+                parallel, or None to run nodes sequentially
+            graph_optimization: One of GRAPH_OPTIMIZATION_LEVELS
+            optimized_model_path: File caching the optimized graph. It is
+                written on the first start and loaded without optimizing
+                again afterwards, as long as it is newer than model_file
+            io_binding: Bind outputs to reusable buffers, see the class
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            if inter_op_threads > 1:
+                options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+        )
+
+        if optimized_model_path:
+            if (os.path.exists(optimized_model_path)
+                    and os.path.getmtime(optimized_model_path) >= os.path.getmtime(model_file)):
+                logger.info(f"Loading cached optimized ONNX model {optimized_model_path}")
+                model_file = optimized_model_path
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                options.optimized_model_filepath = optimized_model_path
+
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if ort.get_device() == 'GPU' else ['CPUExecutionProvider']
+        logger.info(f"Loading ONNX model from {model_file}")
+        return cls(ort.InferenceSession(model_file, options, providers=providers),
+                   io_binding=io_binding)
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "position_ids" in self.input_names:
+            feeds["position_ids"] = position_ids
+        if self.supports_past:
+            if past is None:
+                past = self.empty_past(input_ids.shape[0])
+            for i, (key, value) in enumerate(past):
+                feeds[f"past_key_values.{i}.key"] = key
+                feeds[f"past_key_values.{i}.value"] = value
+
+        if self.io_binding:
+            outputs = self._run_with_binding(feeds, input_ids.shape, past)
+        else:
+            outputs = self.session.run(self.output_names, feeds)
+        if not self.supports_past:
+            return outputs[0], None
+        present = tuple((outputs[1 + 2 * i], outputs[2 + 2 * i])
+                        for i in range(len(self.past_inputs) // 2))
+        return outputs[0], present
+
+    def _run_with_binding(self, feeds, input_shape, past):
+        batch_size, sequence_length = input_shape
+        shapes = [(batch_size, sequence_length, self.vocab_size)]
+        if self.supports_past:
+            _, num_heads, _, head_dim = self.past_inputs[0].shape
+            total_length = past[0][0].shape[2] + sequence_length
+            shapes += [(batch_size, num_heads, total_length, head_dim)] * (len(self.output_names) - 1)
+
+        # Two sets of buffers, used in turn, so the present written by this
+        # call never overwrites the past it reads
+        buffers = getattr(self._buffers, "arenas", None)
+        if buffers is None:
+            buffers = self._buffers.arenas = [[], []]
+            self._buffers.turn = 0
+        self._buffers.turn ^= 1
+        arenas = buffers[self._buffers.turn]
+
+        binding = self.session.io_binding()
+        for name, value in feeds.items():
+            binding.bind_cpu_input(name, np.ascontiguousarray(value))
+        outputs = []
+        for index, (name, shape) in enumerate(zip(self.output_names, shapes)):
+            size = int(np.prod(shape))
+            if index == len(arenas):
+                arenas.append(np.empty(0, dtype=np.float32))
+            if arenas[index].size < size:
+                # Grow with headroom so a decode doesn't reallocate every step
+                arenas[index] = np.empty(size * 2, dtype=np.float32)
+            output = arenas[index][:size].reshape(shape)
+            binding.bind_output(name, "cpu", 0, np.float32, list(shape), output.ctypes.data)
+            outputs.append(output)
+        self.session.run_with_iobinding(binding)
+        return outputs
+
+    def empty_past(self, batch_size):
+        """Zero-length cache: (batch, heads, 0, head_dim) for every layer"""
+        _, num_heads, _, head_dim = self.past_inputs[0].shape
+        empty = np.zeros((batch_size, num_heads, 0, head_dim), dtype=np.float32)
+        return tuple((empty, empty) for _ in range(len(self.past_inputs) // 2))
+
+
+class _TFLiteBucket:
+    """One interpreter allocated for a fixed (batch, length) input shape"""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.lock = threading.Lock()
+        details = interpreter.get_input_details()
+        self.batch_size, self.length = (int(d) for d in details[0]["shape"])
+
+        # Exported signatures name their inputs, older models are matched by position
+        self.inputs = {}
+        for position, detail in enumerate(details):
+            name = next((n for n in ("input_ids", "attention_mask", "position_ids")
+                         if n in detail["name"]), None)
+            name = name or ("input_ids", "attention_mask", "position_ids")[position]
+            self.inputs[name] = (detail["index"], np.zeros(detail["shape"], dtype=detail["dtype"]))
+        self.output_index = interpreter.get_output_details()[0]["index"]
+
+    def run(self, feeds, batch_size, length):
+        """Right pad the feeds into this bucket's inputs, return last position logits"""
+        with self.lock:
+            for name, (index, array) in self.inputs.items():
+                array.fill(0)
+                if feeds.get(name) is not None:
+                    array[:batch_size, :length] = feeds[name]
+                self.interpreter.set_tensor(index, array)
+            self.interpreter.invoke()
+            # Copy out only what the caller needs, the view into the
+            # interpreter must be released before the next invoke
+            return np.array(self.interpreter.tensor(self.output_index)()[:batch_size, length - 1:length])
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    TensorFlow Lite interpreters over models from create_tensorflow_lite_model
+
+    TFLite reallocates its tensors whenever an input shape changes, so every
+    interpreter is allocated once for a fixed (batch, length) input and
+    sequences are right padded to the smallest length bucket they fit.
+    Causal attention keeps the padding from affecting the real positions,
+    and only the logits of the last real position are copied out. An
+    interpreter runs one call at a time. The exported models take no past
+    key/values, so every decoding step runs over the whole sequence.
+
+    Args:
+        interpreters: Interpreters with tensors allocated for fixed input shapes
+    """
+
+    label = "TensorFlow Lite"
+
+    def __init__(self, interpreters):
+        self.buckets = sorted((_TFLiteBucket(i) for i in interpreters),
+                              key=lambda bucket: (bucket.length, bucket.batch_size))
+        self.max_sequence_length = max(bucket.length for bucket in self.buckets)
+
+    @classmethod
+    def from_file(cls, model_path, lengths=DEFAULT_TFLITE_LENGTHS, batch_size=1):
+        """
+        Load the interpreters of every length bucket
+
+        Args:
+            model_path: A .tflite file, or a directory holding one
+                model_{length}.tflite per bucket or a single model.tflite
+            lengths: Buckets for models exported with a dynamic sequence
+                length, one interpreter is resized for each
+            batch_size: Batch dimension for models exported with a dynamic one
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        model_files = [model_path]
+        if os.path.isdir(model_path):
+            model_files = sorted(glob.glob(os.path.join(model_path, "model_*.tflite"))) or [
+                os.path.join(model_path, "model.tflite")
+            ]
+
+        interpreters = []
+        for model_file in model_files:
+            logger.info(f"Loading TFLite model from {model_file}")
+            interpreter = Interpreter(model_path=model_file)
+            details = interpreter.get_input_details()
+            if -1 not in details[0].get("shape_signature", details[0]["shape"]):
+                interpreter.allocate_tensors()
+                interpreters.append(interpreter)
+                continue
+            # Dynamic shapes: resize once per bucket, never while decoding
+            for length in lengths:
+                interpreter = Interpreter(model_path=model_file)
+                for detail in interpreter.get_input_details():
+                    interpreter.resize_tensor_input(detail["index"], [batch_size, length])
+                interpreter.allocate_tensors()
+                interpreters.append(interpreter)
+        return cls(interpreters)
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        batch_size, length = input_ids.shape
+        bucket = next((b for b in self.buckets
+                       if b.length >= length and b.batch_size >= batch_size), None)
+        if bucket is None:
+            raise ValueError(f"No TFLite bucket fits a batch of {batch_size} x {length} tokens")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask,
+                 "position_ids": position_ids}
+        return bucket.run(feeds, batch_size, length), None
+
+
+class TritonBackend(InferenceBackend):
+    """
+    Model served by a remote Triton Inference Server over HTTP
+
+    Args:
+        url: Server address, e.g. triton-inference-server:8000
+        model_name: Name of the model in the Triton repository
+        output_name: Output holding the logits
+    """
+
+    label = "Triton"
+
+    def __init__(self, url, model_name="llm_model", output_name="logits"):
+        import tritonclient.http as httpclient
+
+        self._httpclient = httpclient
+        self.client = httpclient.InferenceServerClient(url=url)
+        self.model_name = model_name
+        self.output_name = output_name
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        inputs = []
+        for name, array in (("input_ids", input_ids), ("attention_mask", attention_mask)):
+            infer_input = self._httpclient.InferInput(name, list(array.shape), "INT64")
+            infer_input.set_data_from_numpy(np.ascontiguousarray(array, dtype=np.int64))
+            inputs.append(infer_input)
+        outputs = [self._httpclient.InferRequestedOutput(self.output_name)]
+        result = self.client.infer(self.model_name, inputs, outputs=outputs)
+        return result.as_numpy(self.output_name), None
+
+
+def create_backend(kind, model_path=None, use_past=True, num_threads=None,
+                   triton_url=None, triton_model="llm_model", **options):
+    """
+    Create the backend selected by configuration
+
+    Args:
+        kind: "torch", "onnx", "tflite" or "triton"
+        model_path: Model file, or a directory holding model.onnx,
+            model_with_past.onnx or model.tflite, or a Hugging Face model
+            name for torch
+        use_past: Prefer model_with_past.onnx when model_path is a directory
+        num_threads: Intra-op threads for the onnx backend
+        triton_url: Server address for the triton backend
+        triton_model: Model name for the triton backend
+        options: Further arguments of OnnxBackend.from_file, e.g.
+            io_binding, or TFLiteBackend.from_file, e.g. lengths
+
+    Returns:
+        An InferenceBackend
+    """
+    kind = (kind or "").lower()
+    if kind == "torch":
+        from transformers import AutoModelForCausalLM
+
+        return TorchBackend(AutoModelForCausalLM.from_pretrained(model_path))
+    if kind == "onnx":
+        model_file = model_path
+        if os.path.isdir(model_path):
+            model_file = os.path.join(model_path, "model.onnx")
+            cached_model_file = os.path.join(model_path, "model_with_past.onnx")
+            if use_past and os.path.exists(cached_model_file):
+                model_file = cached_model_file
+        return OnnxBackend.from_file(model_file, num_threads=num_threads, **options)
+    if kind == "tflite":
+        return TFLiteBackend.from_file(model_path, **options)
+    if kind == "triton":
+        return TritonBackend(triton_url, model_name=triton_model)
+    raise ValueError(f"Unknown inference backend: {kind}")
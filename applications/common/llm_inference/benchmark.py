@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Decoding Benchmark across inference backends
+Runs the shared decoding loop over every given backend with the same
+prompts, batch size and sampler, so a change to the loop, the sampler or a
+backend is measured the same way everywhere.
+
+Backends are given as kind:location, for example:
+    python -m llm_inference.benchmark --tokenizer optimized_models/tokenizer \\
+        --backend onnx:optimized_models/model.onnx \\
+        --backend onnx:optimized_models/model_with_past.onnx \\
+        --backend torch:distilgpt2 \\
+        --backend tflite:tflite_model/model.tflite \\
+        --backend triton:localhost:8000
+
+With --sweep-threads every onnx backend is run once per intra-op thread
+count, powers of two up to the host's cores, with and without IOBinding.
+"""
+
+import os
+import time
+import argparse
+import logging
+
+from .backends import GRAPH_OPTIMIZATION_LEVELS, create_backend
+from .decoding import generate
+from .sampling import Sampler
+from .tokenization import load_tokenizer
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+def benchmark(backend, tokenizer, prompt, max_length, runs, batch_size, sampler):
+    """
+    Time generation of a batch of copies of prompt
+
+    Returns:
+        Tuple of (tokens per second, mean seconds per batch)
+    """
+    inputs = tokenizer([prompt] * batch_size, return_tensors="np", padding=True)
+
+    def run():
+        rows = generate(backend, inputs["input_ids"], inputs["attention_mask"], max_length,
+                        sampler=sampler, eos_token_id=tokenizer.eos_token_id)
+        return sum(len(row) for row in rows)
+
+    # Warm up once before timing
+    run()
+
+    generated_tokens = 0
+    start_time = time.perf_counter()
+    for _ in range(runs):
+        generated_tokens += run()
+    elapsed = time.perf_counter() - start_time
+    return generated_tokens / elapsed, elapsed / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the shared decoding loop across backends")
+    parser.add_argument("--backend", type=str, action="append", required=True, help="Backend as kind:location, kind is torch, onnx, tflite or triton")
+    parser.add_argument("--tokenizer", type=str, default="distilgpt2", help="Tokenizer name or path")
+    parser.add_argument("--prompt", type=str, default="Explain the concept of attention in deep learning", help="Prompt to generate from")
+    parser.add_argument("--max-length", type=int, default=64, help="Total sequence length to generate up to")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed generations per backend")
+    parser.add_argument("--batch-size", type=int, default=1, help="Prompts decoded together")
+    parser.add_argument("--do-sample", action="store_true", help="Sample instead of decoding greedily")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Sampling temperature")
+    parser.add_argument("--top-k", type=int, default=50, help="Sample from the k most likely tokens, 0 to disable")
+    parser.add_argument("--top-p", type=float, default=1.0, help="Nucleus sampling threshold")
+    parser.add_argument("--no-repeat-ngram-size", type=int, default=0, help="Size of n-grams that may not repeat")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for the onnx backend")
+    parser.add_argument("--inter-op-threads", type=int, default=None, help="Inter-op threads for the onnx backend")
+    parser.add_argument("--graph-optimization", type=str, default="all", choices=sorted(GRAPH_OPTIMIZATION_LEVELS), help="ONNX Runtime graph optimization level")
+    parser.add_argument("--io-binding", action="store_true", help="Bind onnx outputs to preallocated buffers")
+    parser.add_argument("--sweep-threads", action="store_true", help="Sweep intra-op thread counts and IOBinding for onnx backends")
+    parser.add_argument("--triton-model", type=str, default="llm_model", help="Model name for triton backends")
+
+    args = parser.parse_args()
+
+    tokenizer = load_tokenizer(args.tokenizer)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+
+    # Backend configurations to run as (label, kind, location, onnx options)
+    runs = []
+    for spec in args.backend:
+        kind, _, location = spec.partition(":")
+        if kind != "onnx":
+            runs.append((spec, kind, location, {}))
+            continue
+        options = {"inter_op_threads": args.inter_op_threads,
+                   "graph_optimization": args.graph_optimization}
+        if args.sweep_threads:
+            cores = os.cpu_count() or 1
+            thread_counts = sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores})
+            for threads in thread_counts:
+                for io_binding in (False, True):
+                    label = f"{spec} threads={threads}{' iobinding' if io_binding else ''}"
+                    runs.append((label, kind, location,
+                                 dict(options, num_threads=threads, io_binding=io_binding)))
+        else:
+            runs.append((spec, kind, location,
+                         dict(options, num_threads=args.threads, io_binding=args.io_binding)))
+
+    results = {}
+    for label, kind, location, options in runs:
+        backend = create_backend(kind, location, triton_url=location,
+                                 triton_model=args.triton_model, **options)
+        logger.info(f"Benchmarking {label}")
+        # Same seed for every backend so sampled runs decode comparable lengths
+        sampler = Sampler(do_sample=args.do_sample, temperature=args.temperature, top_k=args.top_k,
+                          top_p=args.top_p, no_repeat_ngram_size=args.no_repeat_ngram_size, seed=0)
+        results[label] = benchmark(backend, tokenizer, args.prompt, args.max_length,
+                                   args.runs, args.batch_size, sampler)
+
+    width = max(len(spec) for spec in results) + 2
+    print(f"{'backend':<{width}}{'tokens/sec':>12}{'sec/batch':>12}")
+    for spec, (tokens_per_sec, latency) in results.items():
+        print(f"{spec:<{width}}{tokens_per_sec:>12.1f}{latency:>12.3f}")
@@ -0,0 +1,137 @@
+"""
+Batched decoding loop shared by every inference backend
+
+The loop tokenizes nothing and knows nothing about the runtime: it feeds
+NumPy arrays to an InferenceBackend, picks the next tokens with a Sampler
+and writes them into preallocated buffers. The sampler's per-request state
+(tokens seen, n-grams emitted) lives in the loop, so one Sampler can serve
+concurrent requests. Backends with past key/values
+are fed only the new token after the first step, the others are fed the
+whole sequence every step.
+"""
+
+import threading
+
+import numpy as np
+
+from .sampling import Sampler
+
+# Per-thread token buffers reused across requests
+token_buffers = threading.local()
+
+
+def get_token_buffers(input_ids, attention_mask, max_length):
+    """
+    Copy the prompts into this thread's preallocated token buffers
+
+    The buffers hold max_length columns so decoding can write each new
+    token in place and feed views to the runtime instead of allocating
+    new arrays every step. They are only reallocated when a request needs
+    a larger shape or a different dtype than the previous one.
+
+    Returns:
+        Tuple of (input_ids buffer, attention_mask buffer, prompt length)
+    """
+    batch_size, length = input_ids.shape
+    columns = max(max_length, length)
+    buffers = getattr(token_buffers, "arrays", None)
+    if (buffers is None
+            or buffers[0].shape[0] != batch_size
+            or buffers[0].shape[1] < columns
+            or buffers[0].dtype != input_ids.dtype):
+        buffers = (np.zeros((batch_size, columns), dtype=input_ids.dtype),
+                   np.zeros((batch_size, columns), dtype=attention_mask.dtype))
+        token_buffers.arrays = buffers
+
+    ids_buffer, mask_buffer = buffers
+    ids_buffer[:, :length] = input_ids
+    mask_buffer[:, :length] = attention_mask
+    return ids_buffer, mask_buffer, length
+
+
+def position_ids(attention_mask):
+    """Positions that skip left padding, as the Hugging Face models compute them"""
+    return np.maximum(np.cumsum(attention_mask, axis=-1) - 1, 0).astype(np.int64)
+
+
+def generate_tokens(backend, input_ids, attention_mask, max_length, sampler=None,
+                    eos_token_id=None):
+    """
+    Decode a batch of left padded prompts
+
+    Args:
+        backend: InferenceBackend running the model
+        input_ids: int64 array shaped (batch, prompt length)
+        attention_mask: Array shaped like input_ids, 0 over the padding
+        max_length: Total sequence length, prompt included, to decode up to,
+            capped at the backend's max_sequence_length
+        sampler: Sampler picking the next tokens, greedy by default
+        eos_token_id: Token that ends a row, rows that emitted it keep
+            receiving it until every row has finished
+
+    Yields:
+        int64 array shaped (batch,) with the next token of every row
+    """
+    sampler = sampler or Sampler()
+    if backend.max_sequence_length:
+        max_length = min(max_length, backend.max_sequence_length)
+    batch_size, prompt_length = input_ids.shape
+    ids_buffer, mask_buffer, length = get_token_buffers(input_ids.astype(np.int64),
+                                                        attention_mask.astype(np.int64),
+                                                        max_length)
+    finished = np.zeros(batch_size, dtype=bool)
+
+    # The first step feeds the whole prompt
+    step_ids = ids_buffer[:, :length]
+    step_positions = position_ids(mask_buffer[:, :length])
+    past = None
+    state = None
+
+    for _ in range(max_length - prompt_length):
+        logits, present = backend.forward(step_ids, mask_buffer[:, :length], step_positions, past)
+        if state is None:
+            # The vocabulary size is only known once the model has run
+            state = sampler.start(ids_buffer[:, :prompt_length], mask_buffer[:, :prompt_length],
+                                  vocab_size=logits.shape[-1])
+        next_tokens = sampler(logits[:, -1, :], state)
+        if eos_token_id is not None:
+            next_tokens[finished] = eos_token_id
+            finished |= next_tokens == eos_token_id
+        yield next_tokens
+
+        # Write the tokens and their attention mask entries in place
+        ids_buffer[:, length] = next_tokens
+        mask_buffer[:, length] = 1
+        length += 1
+
+        if finished.all():
+            break
+
+        if backend.supports_past:
+            # Only the new tokens are fed on the next step
+            past = present
+            step_ids = ids_buffer[:, length - 1:length]
+            step_positions = step_positions[:, -1:] + 1
+        else:
+            step_ids = ids_buffer[:, :length]
+            step_positions = position_ids(mask_buffer[:, :length])
+
+
+def generate(backend, input_ids, attention_mask, max_length, sampler=None,
+             eos_token_id=None):
+    """
+    Decode a batch of prompts to completion
+
+    Returns:
+        List with the generated token ids of every row, up to and including
+        its first eos_token_id
+    """
+    rows = [[] for _ in range(input_ids.shape[0])]
+    done = [False] * len(rows)
+    for next_tokens in generate_tokens(backend, input_ids, attention_mask, max_length,
+                                       sampler=sampler, eos_token_id=eos_token_id):
+        for row, token in enumerate(next_tokens.tolist()):
+            if not done[row]:
+                rows[row].append(token)
+                done[row] = token == eos_token_id
+    return rows
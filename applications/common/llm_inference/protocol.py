@@ -0,0 +1,122 @@
+"""
+Request parsing and streaming helpers shared by the service front ends
+"""
+
+import json
+
+
+class RequestError(ValueError):
+    """Raised when a /generate request body is invalid"""
+
+
+def parse_generate_request(data, default_max_length=50, max_length_limit=None, max_new_tokens_limit=None):
+    """
+    Validate the body of a /generate request
+
+    The length of the output is set either by max_length, the prompt plus
+    generated tokens, or by max_new_tokens, the generated tokens alone.
+
+    Args:
+        data: Decoded JSON body
+        default_max_length: max_length used when the request sets neither
+        max_length_limit: Largest max_length accepted, None for no limit
+        max_new_tokens_limit: Largest max_new_tokens accepted, None for no limit
+
+    Returns:
+        Dict with prompt, max_length, max_new_tokens, stream, seed, cache and
+        timeout. Exactly one of max_length and max_new_tokens is None
+
+    Raises:
+        RequestError: When a field is missing, has the wrong type or is over its limit
+    """
+    if not isinstance(data, dict) or "prompt" not in data:
+        raise RequestError("Missing prompt in request")
+    if not isinstance(data["prompt"], str):
+        raise RequestError("prompt must be a string")
+
+    if "max_length" in data and "max_new_tokens" in data:
+        raise RequestError("Set max_length or max_new_tokens, not both")
+    max_new_tokens = _positive_int(data, "max_new_tokens", None, max_new_tokens_limit)
+    max_length = None
+    if max_new_tokens is None:
+        max_length = _positive_int(data, "max_length", default_max_length, max_length_limit)
+
+    seed = data.get("seed")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+        raise RequestError("seed must be an integer")
+
+    # Seconds the client is willing to wait for the generation
+    timeout = data.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                or not timeout > 0):
+        raise RequestError("timeout must be a positive number of seconds")
+
+    return {
+        "prompt": data["prompt"],
+        "max_length": max_length,
+        "max_new_tokens": max_new_tokens,
+        "stream": bool(data.get("stream", False)),
+        "seed": seed,
+        "cache": bool(data.get("cache", False)),
+        "timeout": timeout,
+    }
+
+
+def _positive_int(data, field, default, limit):
+    value = data.get(field, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise RequestError(f"{field} must be a positive integer")
+    if limit is not None and value > limit:
+        raise RequestError(f"{field} must be at most {limit}")
+    return value
+
+
+def sse_event(payload):
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class StreamDecoder:
+    """
+    Turn streamed token ids into text deltas
+
+    Text is only released once it decodes cleanly, so a multi-byte
+    character split over several tokens is sent whole. Each push only
+    decodes the tokens since the last released text, plus the token before
+    them so spacing at the boundary comes out as in a full decode, so the
+    cost per token stays constant as the sequence grows.
+
+    Args:
+        tokenizer: Tokenizer that produced the token ids
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids = []
+        self.text = ""
+        # Tokens from prefix_offset to read_offset were released already and
+        # decode to prefix_text, later ones are still pending
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._prefix_text = ""
+
+    def push(self, token):
+        """Add a token, returns the new text it completes, possibly empty"""
+        self.token_ids.append(int(token))
+        if self._prefix_text is None:
+            self._prefix_text = self._decode(self._prefix_offset, self._read_offset)
+        text = self._decode(self._prefix_offset, len(self.token_ids))
+        if len(text) > len(self._prefix_text) and not text.endswith("\ufffd"):
+            delta = text[len(self._prefix_text):]
+            self.text += delta
+            self._prefix_offset, self._read_offset = self._read_offset, len(self.token_ids)
+            self._prefix_text = None
+            return delta
+        return ""
+
+    def _decode(self, start, end):
+        if start == end:
+            return ""
+        return self.tokenizer.decode(self.token_ids[start:end], skip_special_tokens=True)
@@ -0,0 +1,187 @@
+"""
+Token selection shared by the decoding loops
+
+The sampler works on the logits of the last position of every row at once:
+repetition penalty, n-gram blocking, temperature, top-k and top-p are NumPy
+operations over the whole batch, so the per-step Python work grows with the
+batch size and never with the vocabulary size. The edge service configures
+it like the main service's generate call: sampling at temperature 0.7 from
+the top 50 tokens without repeating any 2-gram.
+
+N-gram blocking keeps, per row, a table from the hash of the last n-1 tokens
+to the tokens that followed them. The hash is a polynomial over the window,
+updated in O(1) per step for every row at once as the window slides.
+Colliding hashes can block a token that did not repeat an n-gram, with
+64-bit hashes that is too rare to matter.
+"""
+
+import numpy as np
+
+# Odd multiplier of the rolling n-gram hash, arithmetic wraps modulo 2**64
+_HASH_BASE = np.uint64(1000003)
+
+
+class DecodeState:
+    """
+    Per-request state of a Sampler
+
+    Holds, for every row, the tokens seen so far for the repetition penalty,
+    the last n-1 tokens with their rolling hash and the table of n-grams
+    already emitted.
+    """
+
+    def __init__(self, batch_size, window_size, vocab_size=None):
+        self.seen = None if vocab_size is None else np.zeros((batch_size, vocab_size), dtype=bool)
+        self.window = np.zeros((batch_size, window_size), dtype=np.uint64)
+        self.hashes = np.zeros(batch_size, dtype=np.uint64)
+        self.counts = np.zeros(batch_size, dtype=np.int64)
+        self.ngrams = [{} for _ in range(batch_size)]
+
+
+class Sampler:
+    """
+    Pick the next token for every row of a batch
+
+    Args:
+        do_sample: Sample from the distribution instead of taking the argmax
+        temperature: Softmax temperature used when sampling
+        top_k: Only sample from the k most likely tokens, 0 to disable
+        top_p: Only sample from the smallest set of tokens whose probability
+            adds up to top_p, 1.0 to disable
+        repetition_penalty: Divide the logits of tokens already in the
+            sequence by this factor, 1.0 to disable
+        no_repeat_ngram_size: Size of n-grams that may not repeat, 0 to disable
+        seed: Seed of the random generator, for reproducible sampling
+    """
+
+    def __init__(self, do_sample=False, temperature=1.0, top_k=0, top_p=1.0,
+                 repetition_penalty=1.0, no_repeat_ngram_size=0, seed=None):
+        if do_sample and temperature <= 0:
+            raise ValueError("temperature must be positive when sampling")
+        if not 0 < top_p <= 1:
+            raise ValueError("top_p must be in (0, 1]")
+        if repetition_penalty <= 0:
+            raise ValueError("repetition_penalty must be positive")
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.rng = np.random.default_rng(seed)
+        # Weight of the oldest token in the hash of an n-1 token window
+        self._oldest_weight = np.uint64(pow(int(_HASH_BASE), max(no_repeat_ngram_size - 2, 0), 2 ** 64))
+
+    def start(self, input_ids, attention_mask, vocab_size=None):
+        """
+        Create the state of a new request from its left padded prompts
+
+        Args:
+            input_ids: int64 array shaped (batch, prompt length)
+            attention_mask: Array shaped like input_ids, 0 over the padding
+            vocab_size: Needed for the repetition penalty, which is skipped
+                when it is None
+
+        Returns:
+            DecodeState passed to every later call
+        """
+        if self.repetition_penalty == 1.0:
+            vocab_size = None
+        state = DecodeState(input_ids.shape[0], max(self.no_repeat_ngram_size - 1, 0), vocab_size)
+        if state.seen is None and self.no_repeat_ngram_size <= 0:
+            return state
+        for column in range(input_ids.shape[1]):
+            self.update(state, input_ids[:, column], attention_mask[:, column] == 1)
+        return state
+
+    def update(self, state, tokens, rows=None):
+        """
+        Record one new token per row
+
+        Args:
+            state: DecodeState from start
+            tokens: int64 array shaped (batch,)
+            rows: Boolean array selecting the rows the tokens apply to, or
+                None for all of them
+        """
+        tokens = np.asarray(tokens, dtype=np.int64)
+        if rows is None:
+            rows = np.ones(tokens.shape[0], dtype=bool)
+        if state.seen is not None:
+            state.seen[rows, tokens[rows]] = True
+
+        n = self.no_repeat_ngram_size
+        if n <= 0:
+            return
+        # Rows whose last n-1 tokens and this token form a complete n-gram
+        full = rows & (state.counts >= n - 1)
+        for row, prefix, token in zip(np.flatnonzero(full).tolist(),
+                                      state.hashes[full].tolist(), tokens[full].tolist()):
+            state.ngrams[row].setdefault(prefix, set()).add(token)
+
+        if n > 1:
+            # Drop the oldest token once the window is full, then shift in the new one
+            oldest = np.where(full, state.window[:, 0] * self._oldest_weight, np.uint64(0))
+            hashes = (state.hashes - oldest) * _HASH_BASE + tokens.astype(np.uint64)
+            state.hashes = np.where(rows, hashes, state.hashes)
+            shifted = np.concatenate([state.window[:, 1:], tokens.astype(np.uint64)[:, None]], axis=1)
+            state.window = np.where(rows[:, None], shifted, state.window)
+        state.counts += rows
+
+    def __call__(self, logits, state=None):
+        """
+        Args:
+            logits: Array shaped (batch, vocab) for the last position
+            state: DecodeState from start, updated with the chosen tokens.
+                Without it no repetition penalty or n-gram blocking applies
+
+        Returns:
+            int64 array shaped (batch,) with the chosen tokens
+        """
+        scores = logits.astype(np.float32, copy=True)
+        if state is not None:
+            self._penalize(scores, state)
+
+        if not self.do_sample:
+            next_tokens = np.argmax(scores, axis=-1).astype(np.int64)
+        else:
+            next_tokens = self._sample(scores / np.float32(self.temperature))
+
+        if state is not None:
+            self.update(state, next_tokens)
+        return next_tokens
+
+    def _penalize(self, scores, state):
+        if state.seen is not None:
+            penalized = np.where(scores > 0, scores / self.repetition_penalty,
+                                 scores * self.repetition_penalty)
+            np.copyto(scores, penalized, where=state.seen)
+        if self.no_repeat_ngram_size > 0:
+            full = state.counts >= self.no_repeat_ngram_size - 1
+            for row, prefix in zip(np.flatnonzero(full).tolist(), state.hashes[full].tolist()):
+                banned = state.ngrams[row].get(prefix)
+                if banned:
+                    scores[row, list(banned)] = -np.inf
+
+    def _sample(self, scores):
+        candidates = None
+        if self.top_k and self.top_k < scores.shape[-1]:
+            # Only the k best tokens of every row take part from here on
+            candidates = np.argpartition(scores, -self.top_k, axis=-1)[:, -self.top_k:]
+            scores = np.take_along_axis(scores, candidates, axis=-1)
+
+        if self.top_p < 1.0:
+            order = np.argsort(-scores, axis=-1)
+            ordered = np.take_along_axis(scores, order, axis=-1)
+            probs = np.exp(ordered - ordered[:, :1])
+            probs /= probs.sum(axis=-1, keepdims=True)
+            # Keep tokens until the ones before them cover top_p, always the first
+            drop = np.cumsum(probs, axis=-1) - probs >= self.top_p
+            np.put_along_axis(scores, order, np.where(drop, -np.inf, ordered), axis=-1)
+
+        # Gumbel-max: argmax(scores + Gumbel noise) is a draw from softmax(scores)
+        # without normalizing every row
+        choice = np.argmax(scores + self.rng.gumbel(size=scores.shape).astype(np.float32), axis=-1)
+        if candidates is not None:
+            choice = np.take_along_axis(candidates, choice[:, None], axis=-1)[:, 0]
+        return choice.astype(np.int64)
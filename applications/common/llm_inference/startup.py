@@ -0,0 +1,97 @@
+"""
+Startup loading shared by the LLM services
+
+A StartupLoader runs the steps that make a service able to serve, such as
+loading the tokenizer and model and warming up. It runs in the foreground
+or on a background thread so the server can answer liveness probes while
+loading. Readiness is only reported once every step has finished, and each
+step is timed as a named phase.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupLoader:
+    """
+    Run startup steps, in the foreground or on a background thread
+
+    Either pass target, a callable receiving the loader, or subclass and
+    override run. Steps are timed by wrapping them in phase(name); the whole
+    run is timed as the "total" phase.
+
+    Args:
+        target: Callable receiving the loader, run by the default run
+        phase_gauge: Optional labelled Gauge set to each phase's duration
+        ready_gauge: Optional Gauge set to 1 once the loader is ready
+    """
+
+    def __init__(self, target=None, phase_gauge=None, ready_gauge=None):
+        self.target = target
+        self.phase_gauge = phase_gauge
+        self.ready_gauge = ready_gauge
+        self.status = "starting"
+        self.error = None
+        self.timings = {}
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    @contextmanager
+    def phase(self, name):
+        """Time a startup phase and export its duration"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.timings[name] = elapsed
+            if self.phase_gauge is not None:
+                self.phase_gauge.labels(phase=name).set(elapsed)
+            logger.info(f"Startup phase {name} took {elapsed:.2f}s")
+
+    def run(self):
+        """Run the startup steps, called by load"""
+        if self.target is not None:
+            self.target(self)
+
+    def load(self):
+        """
+        Run the startup steps in the calling thread
+
+        Raises:
+            Exception: Whatever the steps raised, after marking the loader failed
+        """
+        try:
+            with self.phase("total"):
+                self.run()
+            self.status = "ready"
+            if self.ready_gauge is not None:
+                self.ready_gauge.set(1)
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            raise
+        finally:
+            self._ready.set()
+
+    def start(self):
+        """Load on a background thread and return immediately"""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Error loading model: {str(e)}")
+
+        threading.Thread(target=run, name="model-loader", daemon=True).start()
+
+    def wait(self, timeout=None):
+        """Block until loading finished, returns whether the service is ready"""
+        self._ready.wait(timeout)
+        return self.ready
@@ -0,0 +1,131 @@
+"""
+Tokenization shared by the service front ends
+
+Tokenizers are always loaded as the Rust backed "fast" implementation.
+PromptEncoder sits in front of a tokenizer: batches of prompts are encoded
+in one call, which the fast tokenizer spreads over its own threads, and the
+encodings of hot prompts are kept in a bounded LRU cache so repeated
+prompts skip the tokenizer entirely.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def load_tokenizer(path, **kwargs):
+    """
+    Load the fast tokenizer at path
+
+    Raises:
+        ValueError: When only a slow, pure Python tokenizer is available
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True, **kwargs)
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError(f"No fast tokenizer available for {path}, install the tokenizers package")
+    return tokenizer
+
+
+class PromptEncoder:
+    """
+    Encode prompts in batches, memoizing the encodings of recent prompts
+
+    Encodings are cached per (prompt, max_length), so a prompt truncated to
+    different lengths is encoded once per length.
+
+    Args:
+        tokenizer: Tokenizer called on lists of prompts
+        cache_size: Number of encodings kept, 0 disables the cache
+    """
+
+    def __init__(self, tokenizer, cache_size=1024):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, prompt, max_length=None):
+        """Token ids of one prompt, truncated to max_length, as a list"""
+        return self.encode_batch([prompt], max_length)[0]
+
+    def encode_batch(self, prompts, max_length=None):
+        """
+        Token ids of every prompt, truncated to max_length
+
+        Prompts missing from the cache are encoded together in one
+        tokenizer call.
+
+        Returns:
+            List with one new list of token ids per prompt
+        """
+        encoded = [None] * len(prompts)
+        missing = {}
+        with self._lock:
+            for index, prompt in enumerate(prompts):
+                ids = self._cache.get((prompt, max_length))
+                if ids is None:
+                    missing.setdefault(prompt, []).append(index)
+                else:
+                    self._cache.move_to_end((prompt, max_length))
+                    encoded[index] = ids
+            self.hits += len(prompts) - sum(len(indexes) for indexes in missing.values())
+            self.misses += len(missing)
+
+        if missing:
+            texts = list(missing)
+            if max_length is None:
+                batch = self.tokenizer(texts)["input_ids"]
+            else:
+                batch = self.tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+            with self._lock:
+                for text, ids in zip(texts, batch):
+                    ids = tuple(ids)
+                    for index in missing[text]:
+                        encoded[index] = ids
+                    self._store((text, max_length), ids)
+        return [list(ids) for ids in encoded]
+
+    def __call__(self, prompts, max_length=None, return_tensors="np"):
+        """
+        Encode and pad a batch of prompts on the tokenizer's padding side
+
+        Args:
+            prompts: List of prompts
+            max_length: Truncate each prompt to this many tokens
+            return_tensors: "np" for NumPy arrays or "pt" for PyTorch tensors
+
+        Returns:
+            Dict with int64 input_ids and attention_mask shaped (batch, longest prompt)
+        """
+        batch = self.encode_batch(prompts, max_length)
+        width = max((len(ids) for ids in batch), default=0)
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None and any(len(ids) < width for ids in batch):
+            raise ValueError("Padding prompts of different lengths needs a pad token")
+
+        input_ids = np.full((len(batch), width), pad_id or 0, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        left = getattr(self.tokenizer, "padding_side", "right") == "left"
+        for row, ids in enumerate(batch):
+            columns = slice(width - len(ids), width) if left else slice(0, len(ids))
+            input_ids[row, columns] = ids
+            attention_mask[row, columns] = 1
+
+        if return_tensors == "pt":
+            import torch
+
+            return {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def _store(self, key, ids):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = ids
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
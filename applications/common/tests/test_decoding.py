@@ -0,0 +1,67 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from llm_inference import InferenceBackend, TorchBackend, generate, generate_tokens, position_ids
+
+VOCAB_SIZE = 10
+
+class CountingBackend(InferenceBackend):
+    """Predicts the last token plus one, with or without past key/values"""
+
+    def __init__(self, supports_past):
+        self.supports_past = supports_past
+        self.fed_lengths = []
+
+    def forward(self, input_ids, attention_mask, position_ids=None, past=None):
+        self.fed_lengths.append(input_ids.shape[1])
+        logits = np.zeros(input_ids.shape + (VOCAB_SIZE,), dtype=np.float32)
+        logits[:, -1, :][np.arange(input_ids.shape[0]), (input_ids[:, -1] + 1) % VOCAB_SIZE] = 1.0
+        return logits, (() if self.supports_past else None)
+
+class TestDecoding(unittest.TestCase):
+    def test_position_ids_skip_left_padding(self):
+        """Test that positions start at zero on the first real token"""
+        mask = np.array([[0, 0, 1, 1], [1, 1, 1, 1]])
+        np.testing.assert_array_equal(position_ids(mask), [[0, 0, 0, 1], [0, 1, 2, 3]])
+
+    def test_feeds_only_new_tokens_with_past(self):
+        """Test that backends with past key/values get the prompt once, then one token per step"""
+        input_ids = np.array([[1, 2, 3]])
+        for supports_past, fed_lengths in ((True, [3, 1, 1]), (False, [3, 4, 5])):
+            backend = CountingBackend(supports_past)
+            steps = list(generate_tokens(backend, input_ids, np.ones_like(input_ids), 6))
+
+            self.assertEqual([int(step[0]) for step in steps], [4, 5, 6])
+            self.assertEqual(backend.fed_lengths, fed_lengths)
+
+    def test_finished_rows_keep_eos(self):
+        """Test that a row stops at EOS while the rest of the batch keeps decoding"""
+        input_ids = np.array([[7, 7], [1, 2]])
+        rows = generate(CountingBackend(True), input_ids, np.ones_like(input_ids), 8,
+                        eos_token_id=9)
+
+        self.assertEqual(rows, [[8, 9], [3, 4, 5, 6, 7, 8]])
+
+    def test_torch_batch_matches_single_prompts(self):
+        """Test that a left padded batch decodes each prompt as if it were alone"""
+        from transformers import AutoModelForCausalLM
+
+        backend = TorchBackend(AutoModelForCausalLM.from_pretrained("distilgpt2"))
+        prompts = [[5, 17, 42, 8, 99], [23, 4]]
+        singles = [generate(backend, np.array([p]), np.ones((1, len(p)), dtype=np.int64), len(p) + 6)[0]
+                   for p in prompts]
+
+        input_ids = np.array([prompts[0], [0, 0, 0] + prompts[1]])
+        attention_mask = np.array([[1] * 5, [0, 0, 0, 1, 1]])
+        rows = generate(backend, input_ids, attention_mask, 11)
+
+        self.assertEqual(rows[0], singles[0])
+        self.assertEqual(rows[1], singles[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from llm_inference import OnnxBackend, generate
+
+try:
+    import onnx
+    from onnx import TensorProto, helper
+except ImportError:
+    onnx = None
+
+VOCAB_SIZE = 10
+
+def build_counting_decoder(path):
+    """
+    One layer decoder with past key/values: the logits predict the input
+    token plus one and the present key stores every token seen so far
+    """
+    graph = helper.make_graph(
+        [
+            helper.make_node("Constant", [], ["one"], value=helper.make_tensor("one", TensorProto.INT64, [], [1])),
+            helper.make_node("Constant", [], ["depth"], value=helper.make_tensor("depth", TensorProto.INT64, [], [VOCAB_SIZE])),
+            helper.make_node("Constant", [], ["on_off"], value=helper.make_tensor("on_off", TensorProto.FLOAT, [2], [0.0, 1.0])),
+            helper.make_node("Constant", [], ["axes"], value=helper.make_tensor("axes", TensorProto.INT64, [2], [1, 3])),
+            helper.make_node("Add", ["input_ids", "one"], ["next"]),
+            helper.make_node("Mod", ["next", "depth"], ["next_mod"]),
+            helper.make_node("OneHot", ["next_mod", "depth", "on_off"], ["logits"]),
+            helper.make_node("Cast", ["input_ids"], ["ids_float"], to=TensorProto.FLOAT),
+            helper.make_node("Unsqueeze", ["ids_float", "axes"], ["new_key"]),
+            helper.make_node("Concat", ["past_key_values.0.key", "new_key"], ["present.0.key"], axis=2),
+            helper.make_node("Identity", ["present.0.key"], ["present.0.value"]),
+        ],
+        "counting_decoder",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "sequence"]),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch", "total"]),
+            helper.make_tensor_value_info("position_ids", TensorProto.INT64, ["batch", "sequence"]),
+            helper.make_tensor_value_info("past_key_values.0.key", TensorProto.FLOAT, ["batch", 1, "past", 1]),
+            helper.make_tensor_value_info("past_key_values.0.value", TensorProto.FLOAT, ["batch", 1, "past", 1]),
+        ],
+        [
+            helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", "sequence", VOCAB_SIZE]),
+            helper.make_tensor_value_info("present.0.key", TensorProto.FLOAT, ["batch", 1, "total", 1]),
+            helper.make_tensor_value_info("present.0.value", TensorProto.FLOAT, ["batch", 1, "total", 1]),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+    onnx.save(model, path)
+
+@unittest.skipUnless(onnx is not None, "onnx is not installed")
+class TestOnnxBackend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.model_file = os.path.join(cls.tmp_dir.name, "decoder.onnx")
+        build_counting_decoder(cls.model_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_io_binding_matches_run(self):
+        """Test that decoding into bound buffers gives the same tokens and cache as session.run"""
+        input_ids = np.array([[1, 2, 3], [4, 5, 6]])
+        results = []
+        for io_binding in (False, True):
+            backend = OnnxBackend.from_file(self.model_file, io_binding=io_binding)
+            self.assertEqual(backend.io_binding, io_binding)
+            results.append(generate(backend, input_ids, np.ones_like(input_ids), 8))
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[1], [[4, 5, 6, 7, 8], [7, 8, 9, 0, 1]])
+
+    def test_io_binding_keeps_past_intact(self):
+        """Test that writing the present never overwrites the past it is computed from"""
+        backend = OnnxBackend.from_file(self.model_file, io_binding=True)
+        mask = np.ones((1, 2), dtype=np.int64)
+        _, past = backend.forward(np.array([[1, 2]]), mask, np.array([[0, 1]]))
+        for step, token in enumerate([3, 4, 5]):
+            mask = np.ones((1, 3 + step), dtype=np.int64)
+            _, past = backend.forward(np.array([[token]]), mask, np.array([[2 + step]]), past)
+
+        self.assertEqual(past[0][0][0, 0, :, 0].tolist(), [1, 2, 3, 4, 5])
+
+    def test_optimized_model_cache(self):
+        """Test that the optimized graph is written once and loaded on the next start"""
+        optimized = os.path.join(self.tmp_dir.name, "decoder.optimized.onnx")
+        OnnxBackend.from_file(self.model_file, optimized_model_path=optimized)
+        self.assertTrue(os.path.exists(optimized))
+
+        backend = OnnxBackend.from_file(self.model_file, optimized_model_path=optimized,
+                                        num_threads=1, inter_op_threads=2)
+        input_ids = np.array([[1, 2]])
+        self.assertEqual(generate(backend, input_ids, np.ones_like(input_ids), 4), [[3, 4]])
+
+if __name__ == '__main__':
+    unittest.main()
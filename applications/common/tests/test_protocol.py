@@ -0,0 +1,68 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_inference import RequestError, StreamDecoder, parse_generate_request
+
+class ByteTokenizer:
+    """Tokens are UTF-8 bytes, so a multi-byte character spans several tokens"""
+
+    def __init__(self):
+        self.decoded_lengths = []
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        self.decoded_lengths.append(len(token_ids))
+        return bytes(token_ids).decode("utf-8", errors="replace")
+
+class TestProtocol(unittest.TestCase):
+    def test_parse_defaults(self):
+        """Test that optional fields get their defaults"""
+        parsed = parse_generate_request({"prompt": "Hello"})
+
+        self.assertEqual(parsed, {"prompt": "Hello", "max_length": 50, "max_new_tokens": None,
+                                  "stream": False, "seed": None, "cache": False,
+                                  "timeout": None})
+
+    def test_parse_max_new_tokens(self):
+        """Test that max_new_tokens replaces max_length and limits are enforced"""
+        parsed = parse_generate_request({"prompt": "Hi", "max_new_tokens": 20}, max_new_tokens_limit=20)
+
+        self.assertEqual((parsed["max_length"], parsed["max_new_tokens"]), (None, 20))
+        for data in ({"prompt": "Hi", "max_new_tokens": 21}, {"prompt": "Hi", "max_length": 101},
+                     {"prompt": "Hi", "max_length": 10, "max_new_tokens": 10},
+                     {"prompt": "Hi", "max_new_tokens": 0}):
+            with self.assertRaises(RequestError):
+                parse_generate_request(data, max_length_limit=100, max_new_tokens_limit=20)
+
+    def test_parse_rejects_invalid_fields(self):
+        """Test that missing or mistyped fields are rejected"""
+        for data in (None, [], {}, {"prompt": 1}, {"prompt": "Hi", "seed": "1"},
+                     {"prompt": "Hi", "seed": True}, {"prompt": "Hi", "max_length": 0},
+                     {"prompt": "Hi", "timeout": 0}, {"prompt": "Hi", "timeout": "5"}):
+            with self.assertRaises(RequestError):
+                parse_generate_request(data)
+
+    def test_stream_decoder_waits_for_whole_characters(self):
+        """Test that text is released only once a multi-byte character is complete"""
+        decoder = StreamDecoder(ByteTokenizer())
+        deltas = [decoder.push(token) for token in "né!".encode("utf-8")]
+
+        self.assertEqual(deltas, ["n", "", "é", "!"])
+        self.assertEqual(decoder.text, "né!")
+
+    def test_stream_decoder_only_decodes_recent_tokens(self):
+        """Test that each push decodes a window, not the whole sequence"""
+        tokenizer = ByteTokenizer()
+        text = "naïve café " * 50
+        decoder = StreamDecoder(tokenizer)
+        streamed = "".join(decoder.push(token) for token in text.encode("utf-8"))
+
+        self.assertEqual(streamed, text)
+        self.assertEqual(decoder.text, text)
+        self.assertLessEqual(max(tokenizer.decoded_lengths), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from llm_inference import Sampler
+
+VOCAB_SIZE = 8
+
+def banned_by_reference(sequence, n):
+    """Tokens that would repeat an n-gram of sequence, the straightforward way"""
+    prefix = tuple(sequence[len(sequence) - n + 1:])
+    return {sequence[i + n - 1] for i in range(len(sequence) - n + 1)
+            if tuple(sequence[i:i + n - 1]) == prefix}
+
+class TestSampler(unittest.TestCase):
+    def test_ngram_blocking_matches_reference(self):
+        """Test that the rolling hash bans exactly the tokens that repeat an n-gram"""
+        rng = np.random.default_rng(0)
+        for n in (1, 2, 3):
+            sampler = Sampler(no_repeat_ngram_size=n)
+            prompts = rng.integers(0, 3, size=(4, 6))
+            mask = np.ones_like(prompts)
+            mask[1, :2] = 0
+            state = sampler.start(prompts, mask)
+            sequences = [list(prompts[row][mask[row] == 1]) for row in range(4)]
+
+            for _ in range(10):
+                logits = np.zeros((4, VOCAB_SIZE), dtype=np.float32)
+                scores = logits.copy()
+                sampler._penalize(scores, state)
+                for row, sequence in enumerate(sequences):
+                    self.assertEqual(set(np.flatnonzero(np.isinf(scores[row]))),
+                                     banned_by_reference(sequence, n))
+                tokens = rng.integers(0, 3, size=4)
+                sampler.update(state, tokens)
+                for row, token in enumerate(tokens.tolist()):
+                    sequences[row].append(token)
+
+    def test_greedy_avoids_repeated_bigram(self):
+        """Test that greedy decoding takes the next best token instead of repeating a 2-gram"""
+        sampler = Sampler(no_repeat_ngram_size=2)
+        state = sampler.start(np.array([[3, 5, 3]]), np.ones((1, 3)), vocab_size=VOCAB_SIZE)
+        logits = np.arange(VOCAB_SIZE, dtype=np.float32)[::-1].copy()[None, :]
+        logits[0, 5] = 100.0
+
+        self.assertEqual(sampler(logits, state).tolist(), [0])
+
+    def test_repetition_penalty(self):
+        """Test that tokens already in the sequence lose probability mass"""
+        sampler = Sampler(repetition_penalty=2.0)
+        state = sampler.start(np.array([[1]]), np.ones((1, 1)), vocab_size=VOCAB_SIZE)
+        logits = np.zeros((1, VOCAB_SIZE), dtype=np.float32)
+        logits[0, 1], logits[0, 2] = 4.0, 3.0
+
+        self.assertEqual(sampler(logits, state).tolist(), [2])
+
+    def test_top_k_and_top_p_restrict_candidates(self):
+        """Test that samples only come from the top-k tokens and the top-p nucleus"""
+        logits = np.log(np.array([[0.5, 0.3, 0.1, 0.05, 0.05]] * 64, dtype=np.float32))
+        top_k = Sampler(do_sample=True, top_k=2, seed=0)(logits)
+        top_p = Sampler(do_sample=True, top_p=0.85, seed=0)(logits)
+
+        self.assertTrue(set(top_k.tolist()) <= {0, 1})
+        self.assertTrue(set(top_p.tolist()) <= {0, 1, 2})
+        self.assertIn(2, top_p.tolist())
+
+    def test_sampling_is_reproducible(self):
+        """Test that a seeded sampler draws the same tokens for every row of a batch"""
+        logits = np.zeros((4, VOCAB_SIZE), dtype=np.float32)
+        first = Sampler(do_sample=True, temperature=0.7, seed=3)(logits)
+        second = Sampler(do_sample=True, temperature=0.7, seed=3)(logits)
+
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(first.shape, (4,))
+
+if __name__ == '__main__':
+    unittest.main()
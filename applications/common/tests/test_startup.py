@@ -0,0 +1,65 @@
+import unittest
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_inference import StartupLoader
+
+class RecordingGauge:
+    """Stand-in for a prometheus Gauge, labelled or not"""
+
+    def __init__(self):
+        self.values = {}
+
+    def labels(self, phase):
+        gauge = RecordingGauge()
+        gauge.values = self.values
+        gauge.phase = phase
+        return gauge
+
+    def set(self, value):
+        self.values[getattr(self, "phase", None)] = value
+
+class TestStartupLoader(unittest.TestCase):
+    def test_background_load_reports_ready_when_done(self):
+        """Test that the loader is starting until the target returns, then ready"""
+        release = threading.Event()
+        phase_gauge, ready_gauge = RecordingGauge(), RecordingGauge()
+
+        def target(loader):
+            with loader.phase("model"):
+                release.wait(10)
+
+        loader = StartupLoader(target, phase_gauge=phase_gauge, ready_gauge=ready_gauge)
+        loader.start()
+
+        self.assertFalse(loader.wait(timeout=0.05))
+        self.assertEqual(loader.status, "starting")
+        self.assertEqual(ready_gauge.values, {})
+        release.set()
+
+        self.assertTrue(loader.wait(timeout=10))
+        self.assertEqual(set(loader.timings), {"model", "total"})
+        self.assertEqual(set(phase_gauge.values), {"model", "total"})
+        self.assertEqual(ready_gauge.values, {None: 1})
+
+    def test_failed_load(self):
+        """Test that an error in the target marks the loader failed"""
+        def target(loader):
+            with loader.phase("tokenizer"):
+                raise RuntimeError("boom")
+
+        loader = StartupLoader(target)
+        with self.assertRaises(RuntimeError):
+            loader.load()
+
+        self.assertFalse(loader.wait(timeout=0))
+        self.assertEqual(loader.status, "failed")
+        self.assertEqual(loader.error, "boom")
+        self.assertIn("tokenizer", loader.timings)
+
+if __name__ == '__main__':
+    unittest.main()
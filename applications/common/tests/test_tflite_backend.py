@@ -0,0 +1,100 @@
+import os
+import sys
+import types
+import unittest
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from llm_inference import TFLiteBackend, generate
+
+VOCAB_SIZE = 10
+
+class FakeInterpreter:
+    """
+    Mimics tf.lite.Interpreter for a model predicting each token plus one,
+    and records when tensors are (re)allocated
+    """
+
+    def __init__(self, model_path=None, shape=(1, -1)):
+        self.shape = list(shape)
+        self.allocations = 0
+        self.invocations = 0
+        self.tensors = {}
+
+    def get_input_details(self):
+        shape = np.array([d if d > 0 else 1 for d in self.shape])
+        return [{"name": f"serving_default_{name}:0", "index": index, "shape": shape,
+                 "shape_signature": np.array(self.shape), "dtype": np.int32}
+                for index, name in enumerate(("input_ids", "attention_mask", "position_ids"))]
+
+    def get_output_details(self):
+        return [{"name": "StatefulPartitionedCall:0", "index": 3}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+    def set_tensor(self, index, value):
+        assert list(value.shape) == self.shape, "input shape differs from the allocated one"
+        self.tensors[index] = value.copy()
+
+    def invoke(self):
+        self.invocations += 1
+        ids = self.tensors[0]
+        logits = np.zeros(ids.shape + (VOCAB_SIZE,), dtype=np.float32)
+        np.put_along_axis(logits, ((ids + 1) % VOCAB_SIZE)[..., None], 1.0, axis=-1)
+        self.tensors[3] = logits
+
+    def tensor(self, index):
+        return lambda: self.tensors[index]
+
+class TestTFLiteBackend(unittest.TestCase):
+    def test_grows_through_fixed_buckets(self):
+        """Test that decoding pads into fixed buckets and never reallocates"""
+        short, long = FakeInterpreter(shape=(1, 4)), FakeInterpreter(shape=(1, 8))
+        for interpreter in (short, long):
+            interpreter.allocate_tensors()
+        backend = TFLiteBackend([long, short])
+        input_ids = np.array([[1, 2, 3]])
+
+        rows = generate(backend, input_ids, np.ones_like(input_ids), 20)
+
+        # Capped at the longest bucket: 5 new tokens after a 3 token prompt
+        self.assertEqual(rows, [[4, 5, 6, 7, 8]])
+        self.assertEqual((short.invocations, long.invocations), (2, 3))
+        self.assertEqual((short.allocations, long.allocations), (1, 1))
+
+    def test_batch_padded_to_bucket_batch_size(self):
+        """Test that a smaller batch runs in a larger bucket"""
+        interpreter = FakeInterpreter(shape=(4, 8))
+        backend = TFLiteBackend([interpreter])
+        input_ids = np.array([[1, 2], [0, 5]])
+        attention_mask = np.array([[1, 1], [0, 1]])
+
+        self.assertEqual(generate(backend, input_ids, attention_mask, 4), [[3, 4], [6, 7]])
+
+    def test_dynamic_model_resized_once_per_bucket(self):
+        """Test that a model exported with dynamic shapes gets one interpreter per length"""
+        created = []
+
+        def make_interpreter(model_path):
+            created.append(FakeInterpreter(model_path))
+            return created[-1]
+
+        runtime = types.ModuleType("tflite_runtime.interpreter")
+        runtime.Interpreter = make_interpreter
+        with patch.dict(sys.modules, {"tflite_runtime": types.ModuleType("tflite_runtime"),
+                                      "tflite_runtime.interpreter": runtime}):
+            backend = TFLiteBackend.from_file("model.tflite", lengths=(16, 32), batch_size=2)
+
+        self.assertEqual([(b.batch_size, b.length) for b in backend.buckets], [(2, 16), (2, 32)])
+        self.assertEqual(backend.max_sequence_length, 32)
+        self.assertTrue(all(i.allocations == 1 for i in created[1:]))
+
+if __name__ == '__main__':
+    unittest.main()
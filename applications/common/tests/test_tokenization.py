@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_inference import PromptEncoder
+
+class WordTokenizer:
+    """Tokens are word lengths, records every call"""
+    pad_token_id = 0
+    padding_side = "left"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, truncation=False, max_length=None):
+        self.calls.append(list(texts))
+        ids = [[len(word) for word in text.split()] for text in texts]
+        if truncation:
+            ids = [row[:max_length] for row in ids]
+        return {"input_ids": ids}
+
+class TestPromptEncoder(unittest.TestCase):
+    def test_batch_is_encoded_in_one_call(self):
+        """Test that uncached prompts are encoded together, duplicates once"""
+        tokenizer = WordTokenizer()
+        encoder = PromptEncoder(tokenizer)
+
+        encoded = encoder.encode_batch(["a bb", "ccc", "a bb"])
+
+        self.assertEqual(encoded, [[1, 2], [3], [1, 2]])
+        self.assertEqual(tokenizer.calls, [["a bb", "ccc"]])
+
+    def test_cache_hits_and_eviction(self):
+        """Test that recent prompts skip the tokenizer and the oldest is evicted"""
+        tokenizer = WordTokenizer()
+        encoder = PromptEncoder(tokenizer, cache_size=2)
+        encoder.encode("a")
+        encoder.encode("bb")
+        encoder.encode("a")
+        encoder.encode("ccc")
+
+        self.assertEqual(encoder.encode("a"), [1])
+        self.assertEqual(encoder.encode("bb"), [2])
+        self.assertEqual(tokenizer.calls, [["a"], ["bb"], ["ccc"], ["bb"]])
+        self.assertEqual((encoder.hits, encoder.misses), (2, 4))
+
+    def test_truncated_encodings_are_cached_per_length(self):
+        """Test that a prompt truncated to another length is encoded again"""
+        encoder = PromptEncoder(WordTokenizer())
+
+        self.assertEqual(encoder.encode("a bb ccc", max_length=2), [1, 2])
+        self.assertEqual(encoder.encode("a bb ccc"), [1, 2, 3])
+
+    def test_padding(self):
+        """Test that prompts are padded on the tokenizer's padding side"""
+        tokenizer = WordTokenizer()
+        encoder = PromptEncoder(tokenizer)
+
+        inputs = encoder(["a bb ccc", "dddd"])
+        self.assertEqual(inputs["input_ids"].tolist(), [[1, 2, 3], [0, 0, 4]])
+        self.assertEqual(inputs["attention_mask"].tolist(), [[1, 1, 1], [0, 0, 1]])
+
+        tokenizer.padding_side = "right"
+        self.assertEqual(encoder(["dddd", "a bb"])["input_ids"].tolist(), [[4, 0], [1, 2]])
+
+if __name__ == '__main__':
+    unittest.main()
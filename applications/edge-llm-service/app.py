@@ -1,9 +1,16 @@
 import os
-import json
+import sys
 import logging
-import numpy as np
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer
+import time
+from flask import Flask, Response, request, jsonify
+from prometheus_client import Gauge, Histogram
+from prometheus_flask_exporter import PrometheusMetrics
+
+# Code shared with the LLM service, copied next to the app in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from llm_inference import (PromptEncoder, RequestError, Sampler, StartupLoader, StreamDecoder,
+                           create_backend, generate_tokens, load_tokenizer, parse_generate_request,
+                           sse_event)
 
 # Configure logging
 log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -15,218 +22,220 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+metrics = PrometheusMetrics(app)
+
+# Latency until a streaming client receives its first token
+time_to_first_token = Histogram("edge_llm_time_to_first_token_seconds",
+                                "Time from request arrival to the first streamed token")
+startup_phase_seconds = Gauge("edge_llm_startup_phase_seconds",
+                              "Time spent in each phase of loading the model at startup", ["phase"])
+model_ready = Gauge("edge_llm_model_ready", "1 once the model is loaded and can serve requests")
 
 # Load environment variables
-model_path = os.environ.get("MODEL_PATH", "/models/tflite_model")
-use_tflite = os.environ.get("USE_TFLITE", "true").lower() == "true"
-use_onnx = os.environ.get("USE_ONNX", "false").lower() == "true"
+model_path = os.environ.get("MODEL_PATH", "/models/onnx_model")
+use_tflite = os.environ.get("USE_TFLITE", "false").lower() == "true"
+use_onnx = os.environ.get("USE_ONNX", "true").lower() == "true"
+use_kv_cache = os.environ.get("USE_KV_CACHE", "true").lower() == "true"
 environment = os.environ.get("ENVIRONMENT", "edge")
 
-# Global variables for model and tokenizer
-model = None
+# "eager" loads the model at import, "background" starts serving right away
+# and reports ready once loading has finished
+model_load_mode = os.environ.get("MODEL_LOAD_MODE", "eager").lower()
+
+# Backend running the model: "tflite", "onnx" or "triton". When unset,
+# USE_TFLITE or USE_ONNX pick it. Only onnx decodes incrementally from cached
+# key/values, tflite recomputes the whole sequence at every step.
+inference_backend = (os.environ.get("INFERENCE_BACKEND") or (
+    "tflite" if use_tflite else "onnx" if use_onnx else ""
+)).lower()
+triton_url = os.environ.get("TRITON_URL", "triton-inference-server:8000")
+triton_model = os.environ.get("TRITON_MODEL", "llm_model")
+
+# ONNX Runtime session settings. Thread counts of 0 leave the choice to the
+# runtime, the optimized model cache is skipped when no path is set.
+onnx_options = {
+    "num_threads": int(os.environ.get("ONNX_INTRA_OP_THREADS", 0)) or None,
+    "inter_op_threads": int(os.environ.get("ONNX_INTER_OP_THREADS", 0)) or None,
+    "graph_optimization": os.environ.get("ONNX_GRAPH_OPTIMIZATION", "all").lower(),
+    "optimized_model_path": os.environ.get("ONNX_OPTIMIZED_MODEL_PATH") or None,
+    "io_binding": os.environ.get("ONNX_IO_BINDING", "true").lower() == "true",
+}
+
+# Sequence length buckets and batch size used for TFLite models exported
+# with dynamic shapes, each bucket gets an interpreter allocated once
+tflite_options = {
+    "lengths": sorted({int(v) for v in os.environ.get("TFLITE_BUCKETS", "64,128,256").split(",") if v.strip()}),
+    "batch_size": int(os.environ.get("TFLITE_BATCH_SIZE", 1)),
+}
+backend_options = {"onnx": onnx_options, "tflite": tflite_options}
+
+# Sampling settings, the defaults match the main service's generate call
+sampling_config = {
+    "do_sample": os.environ.get("DO_SAMPLE", "true").lower() == "true",
+    "temperature": float(os.environ.get("TEMPERATURE", 0.7)),
+    "top_k": int(os.environ.get("TOP_K", 50)),
+    "top_p": float(os.environ.get("TOP_P", 1.0)),
+    "repetition_penalty": float(os.environ.get("REPETITION_PENALTY", 1.0)),
+    "no_repeat_ngram_size": int(os.environ.get("NO_REPEAT_NGRAM_SIZE", 2)),
+}
+sampler = Sampler(**sampling_config)
+
+# Encodings of this many recent prompts are kept, 0 disables the cache
+tokenizer_cache_size = int(os.environ.get("TOKENIZER_CACHE_SIZE", 1024))
+
+# Global variables for the inference backend and tokenizer
+backend = None
 tokenizer = None
+prompt_encoder = None
 
-def load_tflite_model():
-    """Load TensorFlow Lite model"""
-    try:
-        import tensorflow as tf
-        
-        # Load TFLite model
-        model_file = os.path.join(model_path, "model.tflite")
-        logger.info(f"Loading TFLite model from {model_file}")
-        
-        interpreter = tf.lite.Interpreter(model_path=model_file)
-        interpreter.allocate_tensors()
-        
-        # Get input and output details
-        input_details = interpreter.get_input_details()
-        output_details = interpreter.get_output_details()
-        
-        logger.info(f"TFLite model loaded successfully")
-        logger.info(f"Input details: {input_details}")
-        logger.info(f"Output details: {output_details}")
-        
-        return interpreter, input_details, output_details
-    except Exception as e:
-        logger.error(f"Error loading TFLite model: {str(e)}")
-        raise
+def load_model(loader):
+    """Load the tokenizer and backend, then warm up with a short generation"""
+    global backend, tokenizer, prompt_encoder
 
-def load_onnx_model():
-    """Load ONNX model"""
-    try:
-        import onnxruntime as ort
-        
-        # Load ONNX model
-        model_file = os.path.join(model_path, "model.onnx")
-        logger.info(f"Loading ONNX model from {model_file}")
-        
-        # Check if GPU is available
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if ort.get_device() == 'GPU' else ['CPUExecutionProvider']
-        session = ort.InferenceSession(model_file, providers=providers)
-        
-        logger.info(f"ONNX model loaded successfully")
-        logger.info(f"Input names: {session.get_inputs()[0].name}")
-        logger.info(f"Output names: {session.get_outputs()[0].name}")
-        
-        return session
-    except Exception as e:
-        logger.error(f"Error loading ONNX model: {str(e)}")
-        raise
+    if not inference_backend:
+        raise ValueError("Set INFERENCE_BACKEND, or USE_TFLITE or USE_ONNX to true")
 
-@app.before_first_request
-def load_model():
-    """Load model and tokenizer before first request"""
-    global model, tokenizer
-    
-    try:
-        # Load tokenizer
+    with loader.phase("tokenizer"):
         tokenizer_path = os.path.join(model_path, "tokenizer")
         logger.info(f"Loading tokenizer from {tokenizer_path}")
-        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
-        
-        # Load model based on configuration
-        if use_tflite:
-            model = load_tflite_model()
-        elif use_onnx:
-            model = load_onnx_model()
-        else:
-            raise ValueError("Either USE_TFLITE or USE_ONNX must be set to true")
-            
-        logger.info("Model and tokenizer loaded successfully")
-    except Exception as e:
-        logger.error(f"Error loading model: {str(e)}")
-        raise
+        loaded_tokenizer = load_tokenizer(tokenizer_path)
+
+    with loader.phase("model"):
+        loaded_backend = create_backend(inference_backend, model_path, use_past=use_kv_cache,
+                                        triton_url=triton_url, triton_model=triton_model,
+                                        **backend_options.get(inference_backend, {}))
+
+    # The first forward passes allocate buffers and run the ONNX graph
+    # optimizations, pay for them before reporting ready
+    with loader.phase("warmup"):
+        inputs = loaded_tokenizer("Hello", return_tensors="np")
+        for _ in generate_tokens(loaded_backend, inputs["input_ids"], inputs["attention_mask"],
+                                 inputs["input_ids"].shape[1] + 4, eos_token_id=loaded_tokenizer.eos_token_id):
+            pass
+
+    backend, tokenizer = loaded_backend, loaded_tokenizer
+    prompt_encoder = PromptEncoder(tokenizer, cache_size=tokenizer_cache_size)
+    logger.info(f"{backend.label} model and tokenizer loaded successfully")
+
+model_loader = StartupLoader(load_model, phase_gauge=startup_phase_seconds, ready_gauge=model_ready)
+if model_load_mode == "background":
+    model_loader.start()
+else:
+    model_loader.load()
+
+def not_ready_response():
+    """Response for requests that need the model before it has loaded"""
+    return jsonify({"error": "Model is not loaded yet", "model_status": model_loader.status}), 503, {"Retry-After": "5"}
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Health check endpoint for Kubernetes probes"""
-    return jsonify({"status": "healthy", "environment": environment})
+    """Liveness probe, healthy while the model is still loading"""
+    if model_loader.status == "failed":
+        return jsonify({"status": "failed", "error": model_loader.error, "environment": environment}), 503
+    return jsonify({"status": "healthy" if model_loader.ready else "starting", "environment": environment})
+
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """Readiness probe, ready once requests can be served"""
+    return jsonify({
+        "status": model_loader.status,
+        "startup_phases": model_loader.timings,
+    }), 200 if model_loader.ready else 503
 
 @app.route("/info", methods=["GET"])
 def model_info():
     """Return information about the loaded model"""
-    model_type = "TensorFlow Lite" if use_tflite else "ONNX"
+    if not model_loader.ready:
+        return not_ready_response()
     return jsonify({
         "model_path": model_path,
-        "model_type": model_type,
+        "model_type": backend.label,
         "environment": environment,
     })
 
 @app.route("/generate", methods=["POST"])
 def generate_text():
     """Generate text based on the provided prompt"""
+    if not model_loader.ready:
+        return not_ready_response()
     try:
-        data = request.get_json()
-        
-        if not data or "prompt" not in data:
-            return jsonify({"error": "Missing prompt in request"}), 400
+        start_time = time.time()
+        try:
+            parsed = parse_generate_request(request.get_json())
+        except RequestError as e:
+            return jsonify({"error": str(e)}), 400
             
-        prompt = data["prompt"]
-        max_length = data.get("max_length", 50)
+        prompt = parsed["prompt"]
+        max_length = parsed["max_length"]
+        # A pinned seed gets its own generator so the output is reproducible
+        request_sampler = sampler if parsed["seed"] is None else Sampler(seed=parsed["seed"], **sampling_config)
         
         logger.info(f"Generating text for prompt: {prompt[:50]}...")
         
         # Tokenize the prompt
-        input_tokens = tokenizer(prompt, return_tensors="np")
+        input_tokens = prompt_encoder([prompt])
         input_ids = input_tokens["input_ids"]
         attention_mask = input_tokens["attention_mask"]
-        
-        # Generate text based on model type
-        if use_tflite:
-            generated_text = generate_with_tflite(input_ids, attention_mask, max_length)
-        elif use_onnx:
-            generated_text = generate_with_onnx(input_ids, attention_mask, max_length)
+        limit = backend.max_sequence_length
+        if limit is not None and input_ids.shape[1] >= limit:
+            return jsonify({"error": f"Prompt is {input_ids.shape[1]} tokens, the model supports {limit}"}), 413
+        # max_new_tokens counts from the end of the prompt
+        if max_length is None:
+            max_length = input_ids.shape[1] + parsed["max_new_tokens"]
+        
+        # Stream tokens as server-sent events while decoding progresses
+        if parsed["stream"]:
+            return Response(stream_text(prompt, input_ids, attention_mask, max_length, start_time,
+                                        request_sampler),
+                            mimetype="text/event-stream")
+        
+        # Generate text with whichever backend is loaded
+        token_ids = list(token_stream(input_ids, attention_mask, max_length, request_sampler))
+        generated_text = decode_tokens(input_ids, token_ids)
         
         logger.info(f"Generated text: {generated_text[:50]}...")
         
         return jsonify({
             "prompt": prompt,
             "generated_text": generated_text,
-            "model_type": "TensorFlow Lite" if use_tflite else "ONNX",
+            "model_type": backend.label,
         })
         
     except Exception as e:
         logger.error(f"Error generating text: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-def generate_with_tflite(input_ids, attention_mask, max_length):
-    """Generate text using TensorFlow Lite model"""
-    interpreter, input_details, output_details = model
-    
-    # Set input tensor
-    interpreter.set_tensor(input_details[0]['index'], input_ids)
-    interpreter.set_tensor(input_details[1]['index'], attention_mask)
-    
-    # Run inference
-    interpreter.invoke()
-    
-    # Get output tensor
-    logits = interpreter.get_tensor(output_details[0]['index'])
-    
-    # Simple greedy decoding
-    for _ in range(max_length - input_ids.shape[1]):
-        # Get the last token's logits
-        next_token_logits = logits[0, -1, :]
-        
-        # Get the token with the highest probability
-        next_token = np.argmax(next_token_logits)
-        
-        # Append the token to input_ids
-        input_ids = np.concatenate([input_ids, [[next_token]]], axis=1)
-        
-        # Update attention mask
-        attention_mask = np.concatenate([attention_mask, [[1]]], axis=1)
-        
-        # Set input tensor
-        interpreter.set_tensor(input_details[0]['index'], input_ids)
-        interpreter.set_tensor(input_details[1]['index'], attention_mask)
-        
-        # Run inference
-        interpreter.invoke()
-        
-        # Get output tensor
-        logits = interpreter.get_tensor(output_details[0]['index'])
-        
-        # Stop if we generate the EOS token
-        if next_token == tokenizer.eos_token_id:
-            break
+def stream_text(prompt, input_ids, attention_mask, max_length, start_time, sampler):
+    """Yield server-sent events with new text as each token is decoded"""
+    decoder = StreamDecoder(tokenizer)
+    try:
+        for token in token_stream(input_ids, attention_mask, max_length, sampler):
+            if not decoder.token_ids:
+                time_to_first_token.observe(time.time() - start_time)
+            text = decoder.push(token)
+            if text:
+                yield sse_event({"token": text})
+    except Exception as e:
+        logger.error(f"Error streaming text: {str(e)}")
+        yield sse_event({"error": str(e)})
+        return
     
-    # Decode the generated tokens
-    generated_text = tokenizer.decode(input_ids[0], skip_special_tokens=True)
-    return generated_text
+    yield sse_event({
+        "prompt": prompt,
+        "generated_text": decode_tokens(input_ids, decoder.token_ids),
+        "model_type": backend.label,
+        "done": True,
+    })
 
-def generate_with_onnx(input_ids, attention_mask, max_length):
-    """Generate text using ONNX model"""
-    session = model
-    
-    # Simple greedy decoding
-    for _ in range(max_length - input_ids.shape[1]):
-        # Run inference
-        ort_inputs = {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask
-        }
-        logits = session.run(None, ort_inputs)[0]
-        
-        # Get the last token's logits
-        next_token_logits = logits[0, -1, :]
-        
-        # Get the token with the highest probability
-        next_token = np.argmax(next_token_logits)
-        
-        # Append the token to input_ids
-        input_ids = np.concatenate([input_ids, [[next_token]]], axis=1)
-        
-        # Update attention mask
-        attention_mask = np.concatenate([attention_mask, [[1]]], axis=1)
-        
-        # Stop if we generate the EOS token
-        if next_token == tokenizer.eos_token_id:
-            break
-    
-    # Decode the generated tokens
-    generated_text = tokenizer.decode(input_ids[0], skip_special_tokens=True)
-    return generated_text
+def token_stream(input_ids, attention_mask, max_length, sampler):
+    """Decode a single prompt with the loaded backend, yielding each new token"""
+    for next_tokens in generate_tokens(backend, input_ids, attention_mask, max_length,
+                                       sampler=sampler, eos_token_id=tokenizer.eos_token_id):
+        yield int(next_tokens[0])
+
+def decode_tokens(input_ids, token_ids):
+    """Decode the prompt followed by the generated tokens"""
+    return tokenizer.decode(list(input_ids[0]) + list(token_ids), skip_special_tokens=True)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
@@ -0,0 +1,310 @@
+"""
+Token budget admission control for the LLM service
+
+Every generation is charged for what it can hold in the engine: its prompt
+tokens plus the new tokens it asked for. The replica admits requests while
+the tokens charged to those in flight fit a fixed budget. Requests beyond
+it wait their turn for a bounded time and are rejected when no budget
+frees up, and requests larger than the whole budget are rejected right away.
+
+Waiting requests are served in weighted fair order across tenants rather
+than in arrival order, so a burst from one tenant queues behind its own
+requests instead of everyone else's. The weight of a request comes from its
+priority class. On top of that, each tenant may be held to a token rate.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+TOKENS_IN_USE = Gauge(
+    "llm_admission_tokens_in_use",
+    "Tokens charged to admitted requests that have not finished",
+)
+WAITING_REQUESTS = Gauge(
+    "llm_admission_waiting_requests",
+    "Requests waiting for token budget",
+)
+ADMISSION_WAIT = Histogram(
+    "llm_admission_wait_seconds",
+    "Time a request waited for token budget before being admitted",
+    ["priority"],
+)
+REJECTED_REQUESTS = Counter(
+    "llm_admission_rejected",
+    "Requests rejected by admission control",
+    ["reason"],
+)
+
+
+class BudgetExceededError(Exception):
+    """Raised when no token budget frees up in time for a request"""
+
+
+class RequestTooLargeError(Exception):
+    """Raised when a request can never fit the token budget"""
+
+
+class RateLimitedError(Exception):
+    """Raised when a tenant has spent its token rate"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_priority_classes(value):
+    """
+    Parse comma separated name:weight pairs, e.g. "interactive:4,batch:1"
+
+    Returns:
+        Dict from class name to its weight, in the order given
+    """
+    classes = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(":")
+        weight = float(weight) if weight.strip() else 1.0
+        if not weight > 0:
+            raise ValueError(f"Weight of priority class {name.strip()} must be positive")
+        classes[name.strip()] = weight
+    return classes
+
+
+class TokenBudget:
+    """
+    Admit requests while their token cost fits a per-replica budget
+
+    Waiting requests take budget in order of their virtual finish time.
+    Each tenant's requests are spaced out by their cost divided by the
+    weight of their priority class, so tenants with requests waiting share
+    the budget in proportion to those weights however many each sends.
+
+    Args:
+        max_tokens: Tokens that admitted requests may hold at once
+        max_wait_seconds: Longest time a request waits for budget, 0 to
+            reject right away when the budget is used up
+        priority_classes: Dict from priority class name to its weight,
+            a single "standard" class by default
+        default_priority: Class of requests that name none
+    """
+
+    def __init__(self, max_tokens, max_wait_seconds=5.0, priority_classes=None,
+                 default_priority="standard"):
+        self.max_tokens = max(1, int(max_tokens))
+        self.max_wait = max(0.0, float(max_wait_seconds))
+        self.priority_classes = dict(priority_classes or {default_priority: 1.0})
+        if default_priority not in self.priority_classes:
+            raise ValueError(f"Default priority class {default_priority} is not configured")
+        self.default_priority = default_priority
+        self.in_use = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_times = {}
+        self._wakers = set()
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens, tenant=None, priority=None):
+        """
+        Charge tokens to the budget, waiting for the tenant's fair turn
+
+        Args:
+            tokens: Cost of the request
+            tenant: Key the request is queued fairly under
+            priority: Priority class, None for the default one
+
+        Raises:
+            ValueError: If priority is not a configured class
+            RequestTooLargeError: If tokens exceeds the whole budget
+            BudgetExceededError: If the budget did not free up within max_wait_seconds
+        """
+        priority = self._check(tokens, priority)
+        start_time = time.monotonic()
+        deadline = start_time + self.max_wait
+        with self._cond:
+            ticket = self._enqueue(tokens, tenant, priority)
+            admitted = False
+            try:
+                while not self._admit(ticket, tokens):
+                    self._cond.wait(self._remaining(deadline))
+                admitted = True
+            finally:
+                self._dequeue(ticket, admitted)
+        ADMISSION_WAIT.labels(priority=priority).observe(time.monotonic() - start_time)
+
+    async def acquire_async(self, tokens, tenant=None, priority=None):
+        """
+        Coroutine version of acquire for callers running on an event loop
+
+        The caller waits suspended on the loop instead of blocking a thread,
+        and is woken when budget is released.
+        """
+        priority = self._check(tokens, priority)
+        start_time = time.monotonic()
+        deadline = start_time + self.max_wait
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(woken.set)
+
+        with self._cond:
+            ticket = self._enqueue(tokens, tenant, priority)
+        admitted = False
+        try:
+            while True:
+                with self._cond:
+                    if self._admit(ticket, tokens):
+                        admitted = True
+                        break
+                    remaining = self._remaining(deadline)
+                    woken.clear()
+                    self._wakers.add(wake)
+                try:
+                    await asyncio.wait_for(woken.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        self._wakers.discard(wake)
+        finally:
+            with self._cond:
+                self._dequeue(ticket, admitted)
+        ADMISSION_WAIT.labels(priority=priority).observe(time.monotonic() - start_time)
+
+    def release(self, tokens):
+        """Return the tokens of a finished request to the budget"""
+        with self._cond:
+            self.in_use -= tokens
+            TOKENS_IN_USE.set(self.in_use)
+            self._notify()
+
+    def _check(self, tokens, priority):
+        """Priority class of a request, which has to fit the whole budget"""
+        priority = priority or self.default_priority
+        if priority not in self.priority_classes:
+            raise ValueError(f"Unknown priority class {priority}")
+        if tokens > self.max_tokens:
+            REJECTED_REQUESTS.labels(reason="too_large").inc()
+            raise RequestTooLargeError(
+                f"Request needs {tokens} tokens, the budget is {self.max_tokens}"
+            )
+        return priority
+
+    def _enqueue(self, tokens, tenant, priority):
+        previous = self._finish_times.get(tenant)
+        start_tag = max(self._virtual_time, previous or 0.0)
+        finish_tag = start_tag + tokens / self.priority_classes[priority]
+        self._finish_times[tenant] = finish_tag
+        # Unique order keeps heap comparisons from reaching tenant and previous
+        ticket = (finish_tag, next(self._order), start_tag, tenant, previous)
+        heapq.heappush(self._waiting, ticket)
+        WAITING_REQUESTS.set(len(self._waiting))
+        return ticket
+
+    def _admit(self, ticket, tokens):
+        """Charge tokens if the ticket's turn has come and they fit"""
+        # Only the first request in fair order may take budget, so a large
+        # request is not starved by a stream of small ones
+        if self._waiting[0] is not ticket or self.in_use + tokens > self.max_tokens:
+            return False
+        self.in_use += tokens
+        TOKENS_IN_USE.set(self.in_use)
+        self._virtual_time = max(self._virtual_time, ticket[2])
+        return True
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            REJECTED_REQUESTS.labels(reason="budget").inc()
+            raise BudgetExceededError("Token budget is exhausted")
+        return remaining
+
+    def _dequeue(self, ticket, admitted):
+        finish_tag, _, _, tenant, previous = ticket
+        if not admitted and self._finish_times.get(tenant) == finish_tag:
+            # A request that gave up was never served, so it must not push
+            # back the tenant's later requests. Once another request of the
+            # tenant has queued behind it, its tags stand.
+            if previous is None:
+                del self._finish_times[tenant]
+            else:
+                self._finish_times[tenant] = previous
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        WAITING_REQUESTS.set(len(self._waiting))
+        self._forget_idle_tenants()
+        self._notify()
+
+    def _notify(self):
+        # Wake threads waiting in acquire and coroutines in acquire_async
+        self._cond.notify_all()
+        for wake in self._wakers:
+            wake()
+
+    def _forget_idle_tenants(self):
+        # A tenant whose last finish time the virtual clock has passed would
+        # start from the clock anyway
+        if len(self._finish_times) > 1024:
+            self._finish_times = {tenant: finish for tenant, finish in self._finish_times.items()
+                                  if finish > self._virtual_time}
+
+
+class TenantRateLimiter:
+    """
+    Token bucket per tenant limiting the tokens it may spend per second
+
+    A request larger than the bucket is let through once the bucket is
+    full and leaves it in debt.
+
+    Args:
+        tokens_per_second: Rate at which each tenant's bucket refills
+        burst_tokens: Size of the bucket, ten seconds of refill by default
+        max_tenants: Full buckets are forgotten beyond this many tenants
+    """
+
+    def __init__(self, tokens_per_second, burst_tokens=None, max_tenants=10000):
+        self.rate = float(tokens_per_second)
+        self.burst = float(burst_tokens or 10 * self.rate)
+        self.max_tenants = max_tenants
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, tenant, tokens):
+        """
+        Spend tokens from the tenant's bucket
+
+        Raises:
+            RateLimitedError: If the bucket holds too few tokens, with the
+                seconds until it does
+        """
+        with self._lock:
+            now = time.monotonic()
+            level = self._level(tenant, now)
+            needed = min(tokens, self.burst)
+            if level < needed:
+                self._buckets[tenant] = (level, now)
+                REJECTED_REQUESTS.labels(reason="rate_limit").inc()
+                raise RateLimitedError("Token rate limit exceeded",
+                                       math.ceil((needed - level) / self.rate))
+            self._buckets[tenant] = (level - tokens, now)
+            if len(self._buckets) > self.max_tenants:
+                self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                                 if self._level(key, now) < self.burst}
+
+    def refund(self, tenant, tokens):
+        """Give back tokens spent by a request that was not served"""
+        with self._lock:
+            now = time.monotonic()
+            self._buckets[tenant] = (min(self.burst, self._level(tenant, now) + tokens), now)
+
+    def _level(self, tenant, now):
+        level, updated = self._buckets.get(tenant, (self.burst, now))
+        return min(self.burst, level + (now - updated) * self.rate)
@@ -1,32 +1,506 @@
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from flask import Flask, Response, request, jsonify
 import torch
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+from prometheus_client import Histogram
+import atexit
+import os
+import queue
+import sys
 import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from batching import BatchScheduler
+from cache import ResponseCache, TieredCache, create_shared_backend, make_cache_key
+from singleflight import SingleFlight
+from executor import InferenceExecutor, QueueFullError
+from admission import (BudgetExceededError, RateLimitedError, RequestTooLargeError, TenantRateLimiter,
+                       TokenBudget, parse_priority_classes)
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from deadlines import ClientCancelled, Deadline, RequestCancelled, deadline_stopping_criteria
+from continuous_batching import ContinuousBatchingEngine
+from prefix_cache import PrefixCache
+from model_loader import ModelLoader
+from backends import load_backend
+from warmup import compile_model, parse_buckets, warm_up
+
+# Code shared with the edge service, copied next to the app in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from llm_inference import PromptEncoder, RequestError, StreamDecoder, parse_generate_request, sse_event
 
 app = Flask(__name__)
-metrics = PrometheusMetrics(app)
+# Workers of a pre-fork server share their metrics through a directory
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 
-# Load model and tokenizer
+# Model, tokenizer and generation engine, set once the model loader has finished
 model_name = "distilgpt2"  # Using a smaller model for local testing
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name)
+tokenizer = None
+prompt_encoder = None
+model = None
+batch_scheduler = None
+
+# Encodings of this many recent prompts are kept, 0 disables the cache
+tokenizer_cache_size = int(os.environ.get("TOKENIZER_CACHE_SIZE", 1024))
+
+# "eager" loads the model at import, "background" starts serving right away
+# and reports ready once loading has finished
+model_load_mode = os.environ.get("MODEL_LOAD_MODE", "eager").lower()
+model_snapshot_dir = os.environ.get("MODEL_SNAPSHOT_DIR")
+
+# Prompt lengths in tokens warmed up before the service reports ready, and
+# whether the forward pass is compiled ("none" or "compile")
+warmup_buckets = parse_buckets(os.environ.get("WARMUP_BUCKETS", "16,64,256"))
+warmup_new_tokens = int(os.environ.get("WARMUP_NEW_TOKENS", 16))
+# Set by gunicorn.conf.py when the master preloads the model: warm-up runs
+# in each forked worker instead, see warm_up_worker
+warmup_in_workers = os.environ.get("WARMUP_IN_WORKERS", "false").lower() == "true"
+model_compile_mode = os.environ.get("MODEL_COMPILE", "none")
+
+# Backend serving the model: "torch" runs it in full precision, "torch-int8"
+# with dynamically quantized linear layers and "onnx" through ONNX Runtime
+model_backend = os.environ.get("MODEL_BACKEND", "torch").lower()
+onnx_model_path = os.environ.get("ONNX_MODEL_PATH", "optimized_models/model_with_past_quantized.onnx")
+onnx_num_threads = int(os.environ.get("ONNX_NUM_THREADS", 0)) or None
+
+# Batching configuration: "batch" coalesces whole requests into one generate
+# call, "continuous" schedules sequences token by token
+generation_engine = os.environ.get("GENERATION_ENGINE", "batch").lower()
+batch_max_size = int(os.environ.get("BATCH_MAX_SIZE", 8))
+batch_max_wait_ms = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+
+# Request size limits. Prompts over MAX_PROMPT_TOKENS are rejected rather
+# than truncated, and MAX_NEW_TOKENS caps the tokens a request may generate.
+max_prompt_tokens = int(os.environ.get("MAX_PROMPT_TOKENS", 768))
+max_new_tokens_limit = int(os.environ.get("MAX_NEW_TOKENS", 256))
+
+# Admission control: each request is charged for its prompt plus the tokens
+# it may generate, and waits up to ADMISSION_MAX_WAIT_SECONDS for the
+# replica's TOKEN_BUDGET to free up. Waiting requests are served fairly
+# across tenants, weighted by the PRIORITY_CLASSES they pick with the
+# X-Priority header.
+token_budget_size = int(os.environ.get("TOKEN_BUDGET", batch_max_size * (max_prompt_tokens + max_new_tokens_limit)))
+if token_budget_size < max_prompt_tokens + max_new_tokens_limit:
+    # Requests within the size limits would be refused as too large
+    raise ValueError(f"TOKEN_BUDGET of {token_budget_size} cannot admit a single request of "
+                     f"MAX_PROMPT_TOKENS + MAX_NEW_TOKENS = {max_prompt_tokens + max_new_tokens_limit}")
+token_budget = TokenBudget(
+    max_tokens=token_budget_size,
+    max_wait_seconds=float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", 5)),
+    priority_classes=parse_priority_classes(os.environ.get("PRIORITY_CLASSES", "interactive:4,standard:2,batch:1")),
+    default_priority=os.environ.get("DEFAULT_PRIORITY_CLASS", "standard")
+)
+
+# Tenants are told apart by their X-API-Key, else their X-Tenant-ID header,
+# else their address. TENANT_TOKENS_PER_SECOND of 0, the default, disables
+# rate limiting: behind a proxy all anonymous clients share its address.
+tenant_tokens_per_second = float(os.environ.get("TENANT_TOKENS_PER_SECOND", 0))
+tenant_rate_limiter = TenantRateLimiter(
+    tenant_tokens_per_second,
+    burst_tokens=int(os.environ.get("TENANT_BURST_TOKENS", 0)) or None
+) if tenant_tokens_per_second > 0 else None
+
+# Request deadlines. A client sets its own with the timeout field or the
+# X-Request-Timeout header, capped at MAX_REQUEST_TIMEOUT_SECONDS, and
+# generation stops as soon as it passes or the client disconnects.
+default_request_timeout = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", 60))
+max_request_timeout = float(os.environ.get("MAX_REQUEST_TIMEOUT_SECONDS", 300))
+
+# Latency until a streaming client receives its first token
+time_to_first_token = Histogram('llm_time_to_first_token_seconds',
+                                'Time from request arrival to the first streamed token')
+
+# Cache for storing recent responses, optionally shared between replicas
+response_cache = TieredCache(
+    ResponseCache(
+        max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", 1000)),
+        max_bytes=int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        ttl_seconds=float(os.environ.get("CACHE_TTL_SECONDS", 0))
+    ),
+    create_shared_backend(
+        os.environ.get("CACHE_BACKEND", "none"),
+        sqlite_path=os.environ.get("CACHE_SQLITE_PATH", "/tmp/llm-cache/responses.db"),
+        redis_url=os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    )
+)
+
+# Identical cacheable requests in flight share one generation
+inflight_requests = SingleFlight()
+
+# Circuit breaker around generation. It opens after consecutive failures or
+# when the p95 latency of recent generations exceeds the SLO, and lets a
+# probe through once the reset timeout has passed. A latency SLO of 0
+# disables latency tracking, an in-flight limit of 0 disables shedding.
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5)),
+    reset_timeout=float(os.environ.get("CIRCUIT_RESET_TIMEOUT_SECONDS", 30)),
+    latency_slo=float(os.environ.get("CIRCUIT_LATENCY_SLO_SECONDS", 10)) or None,
+    window_size=int(os.environ.get("CIRCUIT_LATENCY_WINDOW", 100)),
+    max_in_flight=int(os.environ.get("CIRCUIT_MAX_IN_FLIGHT", 0)) or None,
+    # Requests pushed back by a full queue, budget or rate limit, or too large
+    # to ever fit, say nothing about the model, and neither do disconnects or
+    # deadlines the client picked. Missing the server's default deadline does.
+    ignored_exceptions=(QueueFullError, BudgetExceededError, RateLimitedError, RequestTooLargeError,
+                        ClientCancelled)
+)
+
+def generate_batch(prompts, max_length=None, seed=None, streamer=None, max_new_tokens=None,
+                   deadlines=None):
+    """
+    Run one padded generate call over a batch of prompts
+
+    With max_new_tokens every whole prompt gets that many new tokens,
+    otherwise prompts are truncated to max_length, which bounds each prompt
+    plus its own continuation. Rows stop early once their deadline passes.
+    """
+    # Seeded requests are never batched, see setup_model
+    if seed is not None:
+        torch.manual_seed(seed)
+
+    if max_new_tokens is not None:
+        inputs = prompt_encoder(prompts, return_tensors="pt")
+        budgets = [max_new_tokens] * len(prompts)
+    else:
+        inputs = prompt_encoder(prompts, max_length=max_length, return_tensors="pt")
+        budgets = [max(0, max_length - int(inputs["attention_mask"][row].sum()))
+                   for row in range(len(prompts))]
+
+    # Left padding makes every row as long as the longest prompt. Generate
+    # enough tokens for the largest budget and cut every row back to its own.
+    width = int(inputs["input_ids"].shape[1])
+    if streamer is not None:
+        streamer.limit(budgets)
+
+    outputs = inputs["input_ids"]
+    if max(budgets) > 0:
+        outputs = model.generate(
+            inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_new_tokens=max(budgets),
+            num_return_sequences=1,
+            no_repeat_ngram_size=2,
+            pad_token_id=tokenizer.eos_token_id,
+            do_sample=True,
+            temperature=0.7,
+            streamer=streamer,
+            stopping_criteria=deadline_stopping_criteria(deadlines)
+        )
+
+    return [tokenizer.decode(output[:width + budget], skip_special_tokens=True)
+            for output, budget in zip(outputs, budgets)]
+
+def setup_model(loaded_tokenizer, loaded_model):
+    """
+    Configure a freshly loaded model and build the generation engine around it
+
+    Returns:
+        The model served by the configured backend
+    """
+    global tokenizer, prompt_encoder, model, batch_scheduler
+
+    # Fix: Set padding token
+    loaded_tokenizer.pad_token = loaded_tokenizer.eos_token
+    loaded_model.config.pad_token_id = loaded_tokenizer.eos_token_id
+
+    # Pad on the left so batched prompts all end where generation starts
+    loaded_tokenizer.padding_side = "left"
+    loaded_model = load_backend(model_backend, loaded_model,
+                                onnx_model_path=onnx_model_path,
+                                num_threads=onnx_num_threads)
+    if model_backend != "onnx":
+        compile_model(loaded_model, model_compile_mode)
+    tokenizer, model = loaded_tokenizer, loaded_model
+    prompt_encoder = PromptEncoder(tokenizer, cache_size=tokenizer_cache_size)
+
+    # Coalesces concurrent /generate calls into batches. The ONNX decoder has
+    # no generate(), so it is always driven by the continuous engine.
+    if generation_engine == "continuous" or model_backend == "onnx":
+        # Prompt prefixes are reused from a key/value cache, 0 bytes disables it
+        prefix_cache_max_bytes = int(os.environ.get("PREFIX_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+        prefix_cache = None
+        if prefix_cache_max_bytes > 0:
+            prefix_cache = PrefixCache(max_bytes=prefix_cache_max_bytes,
+                                       min_tokens=int(os.environ.get("PREFIX_CACHE_MIN_TOKENS", 8)))
+        batch_scheduler = ContinuousBatchingEngine(model, tokenizer,
+                                                   max_batch_size=batch_max_size,
+                                                   prefix_cache=prefix_cache,
+                                                   encoder=prompt_encoder)
+    else:
+        # A seed is set for the whole generate call, so seeded requests run
+        # alone to get the same text however requests arrive
+        batch_scheduler = BatchScheduler(generate_batch,
+                                         max_batch_size=batch_max_size,
+                                         max_wait_ms=batch_max_wait_ms,
+                                         eos_token_id=tokenizer.eos_token_id,
+                                         unbatched_params=("seed",))
+    return model
+
+# Worker pool running generation outside the request threads. Workers wait
+# while their request sits in a batch, so there should be enough of them
+# to fill several batches.
+inference_executor = InferenceExecutor(
+    max_workers=int(os.environ.get("INFERENCE_WORKERS", 2 * batch_max_size)),
+    max_queue_size=int(os.environ.get("INFERENCE_QUEUE_SIZE", 64))
+)
+
+def warm_up_model():
+    """Run the warm-up buckets through the generation engine"""
+    latencies = warm_up(lambda prompt, max_length: batch_scheduler.generate(prompt, max_length=max_length),
+                        tokenizer,
+                        warmup_buckets,
+                        new_tokens=warmup_new_tokens,
+                        max_positions=getattr(model.config, "max_position_embeddings", None))
+    # Don't leave generation threads behind in a master that forks workers,
+    # the engine starts again with the first request
+    batch_scheduler.stop()
+    return latencies
+
+def warm_up_worker():
+    """
+    Warm up a worker forked from a master that skipped warm-up
+
+    Generation in the master would start torch's OpenMP thread pool, which
+    forked workers inherit in a broken state and hang on.
+    """
+    with model_loader.phase("warmup"):
+        model_loader.warmup_latency = warm_up_model()
+
+def stop_generation():
+    if batch_scheduler is not None:
+        batch_scheduler.stop()
+
+# Let the generation threads finish their current step before the process exits
+atexit.register(stop_generation)
+atexit.register(inference_executor.shutdown)
+
+model_loader = ModelLoader(model_name, snapshot_dir=model_snapshot_dir,
+                           on_loaded=setup_model, warm_up=None if warmup_in_workers else warm_up_model)
+if model_load_mode == "background":
+    model_loader.start()
+else:
+    model_loader.load()
+
+def health_status():
+    """Liveness payload and status code, healthy while the model is still loading"""
+    if model_loader.status == "failed":
+        return {"status": "failed", "error": model_loader.error}, 503
+    return {"status": "healthy" if model_loader.ready else "starting"}, 200
+
+def readiness_status():
+    """Readiness payload and status code, ready once requests can be served"""
+    return {
+        "status": model_loader.status,
+        "startup_phases": model_loader.timings,
+        "warmup_latency": model_loader.warmup_latency
+    }, 200 if model_loader.ready else 503
+
+def not_ready_response():
+    """Payload for requests that need the model before it has loaded"""
+    return {
+        "error": "Model is not loaded yet",
+        "status": "error",
+        "model_status": model_loader.status
+    }
+
+def plan_generation(parsed):
+    """
+    Generation parameters and token cost of a parsed /generate request
+
+    The whole prompt is always used. A max_length from the request leaves
+    the new tokens that fit after the prompt, at most max_new_tokens_limit.
+
+    Raises:
+        RequestTooLargeError: If the prompt is longer than max_prompt_tokens
+    """
+    prompt_tokens = len(prompt_encoder.encode(parsed['prompt']))
+    if prompt_tokens > max_prompt_tokens:
+        raise RequestTooLargeError(f"Prompt is {prompt_tokens} tokens, the limit is {max_prompt_tokens}")
+
+    max_new_tokens = parsed['max_new_tokens']
+    if max_new_tokens is None:
+        max_new_tokens = min(max(0, parsed['max_length'] - prompt_tokens), max_new_tokens_limit)
+
+    # Generation parameters, requests are only batched when these match
+    params = {"max_new_tokens": max_new_tokens}
+    if parsed['seed'] is not None:
+        params["seed"] = parsed['seed']
+    return params, prompt_tokens + max_new_tokens
+
+def request_deadline(parsed, header=None):
+    """
+    Deadline of a parsed /generate request
+
+    The timeout field takes precedence over the X-Request-Timeout header,
+    without either the default timeout applies. Only the expiry of a timeout
+    the client picked is reported as ClientCancelled.
+
+    Raises:
+        RequestError: If the header is not a positive number of seconds
+    """
+    timeout = parsed['timeout']
+    if timeout is None and header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            timeout = 0
+        if not timeout > 0:
+            raise RequestError("X-Request-Timeout must be a positive number of seconds")
+    return Deadline(min(timeout or default_request_timeout, max_request_timeout), client=bool(timeout))
+
+def request_identity(get_header, remote_addr=None):
+    """
+    Tenant and priority class of a /generate request
+
+    Args:
+        get_header: Callable returning the value of a request header or None
+        remote_addr: Client address, the tenant of anonymous requests
+
+    Returns:
+        Tuple of (tenant, priority)
+
+    Raises:
+        RequestError: If X-Priority names no configured class
+    """
+    api_key = get_header("X-API-Key")
+    if api_key:
+        tenant = "key:" + api_key
+    elif get_header("X-Tenant-ID"):
+        tenant = "tenant:" + get_header("X-Tenant-ID")
+    else:
+        tenant = f"addr:{remote_addr}"
 
-# Fix: Set padding token
-tokenizer.pad_token = tokenizer.eos_token
-model.config.pad_token_id = tokenizer.eos_token_id
+    priority = get_header("X-Priority") or token_budget.default_priority
+    if priority not in token_budget.priority_classes:
+        raise RequestError(f"X-Priority must be one of {', '.join(token_budget.priority_classes)}")
+    return tenant, priority
 
-# Cache for storing recent responses
-response_cache = {}
+def submit_generation(cost, fn, *args, tenant=None, priority=None, **kwargs):
+    """
+    Charge cost tokens to the tenant's rate and the budget and run fn on
+    the inference workers
 
-# Circuit breaker state
-circuit_state = {
-    "failures": 0,
-    "threshold": 5,
-    "open": False,
-    "last_failure": 0,
-    "reset_timeout": 30  # seconds
-}
+    Returns:
+        A Future resolving to the return value of fn. The tokens go back to
+        the budget once it has resolved
+
+    Raises:
+        RateLimitedError: If the tenant has spent its token rate
+        BudgetExceededError: If no budget freed up in time
+    """
+    if tenant_rate_limiter is not None:
+        tenant_rate_limiter.acquire(tenant, cost)
+    try:
+        token_budget.acquire(cost, tenant=tenant, priority=priority)
+        return start_generation(cost, fn, *args, **kwargs)
+    except Exception:
+        # Requests turned away by the budget or the queue cost no rate
+        if tenant_rate_limiter is not None:
+            tenant_rate_limiter.refund(tenant, cost)
+        raise
+
+def start_generation(cost, fn, *args, **kwargs):
+    """
+    Run fn on the inference workers once cost tokens have been charged to
+    the budget, and return them to it when the Future resolves
+    """
+    try:
+        future = inference_executor.submit(fn, *args, **kwargs)
+    except Exception:
+        token_budget.release(cost)
+        raise
+    future.add_done_callback(lambda _: token_budget.release(cost))
+    return future
+
+def wait_for_generation(future, deadline):
+    """
+    Result of a generation future, waiting no longer than its deadline
+
+    Raises:
+        RequestCancelled: If the deadline passed first
+    """
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+        # Drop it from the queue if no worker has picked it up yet
+        future.cancel()
+        raise deadline.exception() from None
+
+def generate_coalesced(cache_key, deadline, fn):
+    """
+    Call fn unless an identical request is already generating, then wait
+    for that one no longer than this request's deadline
+
+    Another request's deadline or disconnect is not shared: when that
+    generation is cancelled, the waiting requests generate again.
+
+    Raises:
+        RequestCancelled: If the deadline passed first
+    """
+    try:
+        generated_text, _ = inflight_requests.do(cache_key, fn, timeout=deadline.remaining(),
+                                                 retry_on=(RequestCancelled,))
+    except FutureTimeoutError:
+        raise deadline.exception() from None
+    return generated_text
+
+def circuit_open_response(error):
+    """Payload and headers for requests refused by the circuit breaker"""
+    return {
+        "error": str(error),
+        "status": "error",
+        "circuit_open": True,
+        "circuit_state": circuit_breaker.state
+    }, {"Retry-After": str(error.retry_after)}
+
+def generate_and_cache(prompt, params, cache_key, deadline=None):
+    """Generate text through the batch scheduler and cache the result"""
+    generated_text = batch_scheduler.generate(prompt, deadline=deadline, **params)
+    response_cache.set(cache_key, generated_text)
+    return generated_text
+
+def stream_generation(prompt, future, tokens, cache_key, start_time, deadline):
+    """
+    Yield server-sent events with new text as tokens arrive on the tokens queue
+
+    The server closes the generator when the client disconnects, which
+    cancels the generation through its deadline.
+    """
+    future.add_done_callback(lambda _: tokens.put(None))
+
+    decoder = StreamDecoder(tokenizer)
+    try:
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            if not decoder.token_ids:
+                time_to_first_token.observe(time.time() - start_time)
+            text = decoder.push(token)
+            if text:
+                yield sse_event({"token": text})
+    finally:
+        if not future.done():
+            deadline.cancel()
+
+    try:
+        generated_text = future.result()
+    except Exception as e:
+        app.logger.error(f"Streaming generation failed: {str(e)}")
+        yield sse_event({"error": str(e), "status": "error"})
+        return
+
+    if cache_key is not None:
+        response_cache.set(cache_key, generated_text)
+    yield sse_event({
+        "prompt": prompt,
+        "generated_text": generated_text,
+        "model": model_name,
+        "status": "success",
+        "cached": False,
+        "generation_time": time.time() - start_time,
+        "done": True
+    })
 
 # Add a root endpoint to show the service is running
 @app.route('/', methods=['GET'])
@@ -38,6 +512,7 @@ def root():
         "endpoints": {
             "generate": "/generate (POST)",
             "health": "/health (GET)",
+            "ready": "/ready (GET)",
             "model-info": "/model-info (GET)",
             "metrics": "/metrics (GET)"
         }
@@ -45,87 +520,103 @@ def root():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    payload, status = health_status()
+    return jsonify(payload), status
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    payload, status = readiness_status()
+    return jsonify(payload), status
 
 @app.route('/model-info', methods=['GET'])
 def model_info():
+    if not model_loader.ready:
+        return jsonify(not_ready_response()), 503
     return jsonify({
         "model_name": model_name,
+        "backend": model_backend,
         "model_config": model.config.to_dict()
     })
 
 @app.route('/generate', methods=['POST'])
 @metrics.counter('llm_requests_total', 'Number of LLM requests')
 def generate():
-    # Check circuit breaker
-    if circuit_state["open"]:
-        # Check if we should reset the circuit breaker
-        if time.time() - circuit_state["last_failure"] > circuit_state["reset_timeout"]:
-            circuit_state["open"] = False
-            circuit_state["failures"] = 0
-        else:
-            return jsonify({
-                "error": "Service temporarily unavailable",
-                "status": "error",
-                "circuit_open": True
-            }), 503
+    if not model_loader.ready:
+        return jsonify(not_ready_response()), 503, {"Retry-After": "5"}
     
     try:
-        data = request.get_json()
-        
-        if not data or 'prompt' not in data:
+        try:
+            parsed = parse_generate_request(request.get_json(),
+                                            max_length_limit=max_prompt_tokens + max_new_tokens_limit,
+                                            max_new_tokens_limit=max_new_tokens_limit)
+            deadline = request_deadline(parsed, request.headers.get("X-Request-Timeout"))
+            tenant, priority = request_identity(request.headers.get, request.remote_addr)
+        except RequestError as e:
             return jsonify({
-                "error": "Missing prompt in request",
+                "error": str(e),
                 "status": "error"
             }), 400
 
-        prompt = data['prompt']
-        max_length = data.get('max_length', 50)
+        prompt = parsed['prompt']
+        stream = parsed['stream']
+        params, cost = plan_generation(parsed)
+        
+        # Sampled outputs are only cached when the client asks for it or pins a seed
+        cacheable = parsed['cache'] or parsed['seed'] is not None
+        cache_key = make_cache_key(model_name, prompt, params) if cacheable else None
         
         # Check cache first
-        cache_key = f"{prompt}_{max_length}"
-        if cache_key in response_cache:
+        cached_text = response_cache.get(cache_key) if cacheable else None
+        if cached_text is not None:
+            if stream:
+                return Response(sse_event({
+                    "prompt": prompt,
+                    "generated_text": cached_text,
+                    "model": model_name,
+                    "status": "success",
+                    "cached": True,
+                    "done": True
+                }), mimetype="text/event-stream")
             return jsonify({
                 "prompt": prompt,
-                "generated_text": response_cache[cache_key],
+                "generated_text": cached_text,
                 "model": model_name,
                 "status": "success",
                 "cached": True
             })
         
-        # Create inputs with padding
-        inputs = tokenizer(prompt, 
-                         return_tensors="pt", 
-                         padding=True, 
-                         truncation=True,
-                         max_length=max_length)
-        
-        # Generate text with timeout
         start_time = time.time()
-        outputs = model.generate(
-            inputs["input_ids"],
-            attention_mask=inputs["attention_mask"],
-            max_length=max_length,
-            num_return_sequences=1,
-            no_repeat_ngram_size=2,
-            pad_token_id=tokenizer.eos_token_id,
-            do_sample=True,
-            temperature=0.7
-        )
-        
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Cache the response
-        response_cache[cache_key] = generated_text
-        
-        # Limit cache size
-        if len(response_cache) > 1000:
-            # Remove oldest entries
-            for _ in range(100):
-                response_cache.pop(next(iter(response_cache)))
-        
-        # Reset circuit breaker failures on success
-        circuit_state["failures"] = 0
+        # The circuit breaker sees every generation, failures and latency
+        # count against it while cache hits and invalid requests never do
+        with circuit_breaker.call() as call:
+            # Stream tokens as server-sent events while decoding progresses
+            if stream:
+                tokens = queue.Queue()
+                future = submit_generation(cost, batch_scheduler.generate, prompt,
+                                           tenant=tenant, priority=priority,
+                                           on_token=tokens.put, deadline=deadline, **params)
+                call.track(future)
+                return Response(stream_generation(prompt, future, tokens, cache_key, start_time, deadline),
+                                mimetype="text/event-stream")
+            
+            # Generate text on the inference workers as part of a batch
+            if cacheable:
+                # Identical requests arriving while this one runs wait for its result
+                generated_text = generate_coalesced(
+                    cache_key,
+                    deadline,
+                    lambda: wait_for_generation(
+                        submit_generation(cost, generate_and_cache, prompt, params, cache_key, deadline,
+                                          tenant=tenant, priority=priority),
+                        deadline
+                    )
+                )
+            else:
+                generated_text = wait_for_generation(
+                    submit_generation(cost, batch_scheduler.generate, prompt, tenant=tenant,
+                                      priority=priority, deadline=deadline, **params),
+                    deadline
+                )
         
         return jsonify({
             "prompt": prompt,
@@ -135,15 +626,31 @@ def generate():
             "cached": False,
             "generation_time": time.time() - start_time
         })
+    except RequestTooLargeError as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 413
+    except CircuitOpenError as e:
+        payload, headers = circuit_open_response(e)
+        return jsonify(payload), 503, headers
+    except (QueueFullError, BudgetExceededError) as e:
+        # Push back on the client without counting against the circuit breaker
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 429, {"Retry-After": "1"}
+    except RateLimitedError as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 429, {"Retry-After": str(e.retry_after)}
+    except RequestCancelled as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 504
     except Exception as e:
-        # Update circuit breaker
-        circuit_state["failures"] += 1
-        circuit_state["last_failure"] = time.time()
-        
-        if circuit_state["failures"] >= circuit_state["threshold"]:
-            circuit_state["open"] = True
-            app.logger.warning("Circuit breaker opened due to repeated failures")
-        
         return jsonify({
             "error": str(e),
             "status": "error"
@@ -157,6 +664,8 @@ if __name__ == "__main__":
     print("  - GET / (Service status)")
     print("  - POST /generate")
     print("  - GET /health")
+    print("  - GET /ready")
     print("  - GET /model-info")
     print("  - GET /metrics")
-    app.run(host="0.0.0.0", port=8080) 
\ No newline at end of file
+    # Threaded so /health and /metrics never wait behind inference
+    app.run(host="0.0.0.0", port=8080, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,413 @@
+"""
+Asyncio entry point for the LLM service
+
+Serves the same routes as the Flask app from a plain ASGI application, so
+an event loop holds every connection instead of a server thread. Model
+loading, batching, caching and the inference worker pool are shared with
+app.py. Requests only wait on futures from the worker pool, and streamed
+tokens are handed to the loop as they arrive, so slow or streaming
+clients cost a coroutine rather than a thread.
+
+Run with:
+    python asgi_app.py
+or:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+import app as service
+from cache import make_cache_key
+from admission import BudgetExceededError, RateLimitedError, RequestTooLargeError
+from circuit_breaker import CircuitOpenError
+from deadlines import RequestCancelled
+from executor import QueueFullError
+from llm_inference import RequestError, StreamDecoder, parse_generate_request
+
+logger = logging.getLogger(__name__)
+
+request_latency = Histogram('llm_asgi_request_duration_seconds',
+                            'Latency of requests served by the ASGI entry point',
+                            ['method', 'path', 'status'])
+
+
+def get_header(scope, name):
+    """Value of a request header, or None when it is missing"""
+    name = name.lower().encode()
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def read_json(receive):
+    """Read the whole request body and parse it as JSON, or return None"""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def send_json(send, payload, status=200, headers=None):
+    """Send a complete JSON response"""
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())]
+                   + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+    return status
+
+
+async def send_events(send, events):
+    """Send an async iterable of server-sent events as a streamed response"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache")],
+    })
+    async for event in events:
+        await send({"type": "http.response.body", "body": event.encode("utf-8"),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+    return 200
+
+
+async def submit_generation(cost, fn, *args, tenant=None, priority=None, **kwargs):
+    """Wait for token budget on the event loop, then hand fn to the inference workers"""
+    if service.tenant_rate_limiter is not None:
+        service.tenant_rate_limiter.acquire(tenant, cost)
+    try:
+        await service.token_budget.acquire_async(cost, tenant=tenant, priority=priority)
+        return service.start_generation(cost, fn, *args, **kwargs)
+    except BaseException:
+        # Requests turned away by the budget or the queue, or cancelled
+        # while waiting, cost no rate
+        if service.tenant_rate_limiter is not None:
+            service.tenant_rate_limiter.refund(tenant, cost)
+        raise
+
+
+async def run_generation(cost, fn, *args, deadline, **kwargs):
+    """
+    Run fn with the request's deadline on the inference workers once
+    admitted and wait for its result
+
+    Raises:
+        RequestCancelled: If the deadline passed first
+    """
+    future = await submit_generation(cost, fn, *args, deadline=deadline, **kwargs)
+    try:
+        # Timing out cancels the future if no worker has picked it up yet
+        return await asyncio.wait_for(asyncio.wrap_future(future), deadline.remaining())
+    except asyncio.TimeoutError:
+        raise deadline.exception() from None
+
+
+async def watch_disconnect(receive, deadline):
+    """Cancel the generation behind deadline once the client disconnects"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    deadline.cancel()
+
+
+async def single_event(event):
+    yield event
+
+
+async def stream_generation(prompt, future, tokens, cache_key, start_time, deadline):
+    """Yield server-sent events with new text as tokens arrive on an asyncio queue"""
+    decoder = StreamDecoder(service.tokenizer)
+    try:
+        while True:
+            token = await tokens.get()
+            if token is None:
+                break
+            if not decoder.token_ids:
+                service.time_to_first_token.observe(time.time() - start_time)
+            text = decoder.push(token)
+            if text:
+                yield service.sse_event({"token": text})
+    finally:
+        # Sending failed before the generation finished
+        if not future.done():
+            deadline.cancel()
+
+    try:
+        generated_text = await asyncio.wrap_future(future)
+    except Exception as e:
+        logger.error(f"Streaming generation failed: {str(e)}")
+        yield service.sse_event({"error": str(e), "status": "error"})
+        return
+
+    if cache_key is not None:
+        service.response_cache.set(cache_key, generated_text)
+    yield service.sse_event({
+        "prompt": prompt,
+        "generated_text": generated_text,
+        "model": service.model_name,
+        "status": "success",
+        "cached": False,
+        "generation_time": time.time() - start_time,
+        "done": True
+    })
+
+
+async def root(scope, receive, send):
+    return await send_json(send, {
+        "status": "running",
+        "message": "LLM Service is up and running!",
+        "model": service.model_name,
+        "endpoints": {
+            "generate": "/generate (POST)",
+            "health": "/health (GET)",
+            "ready": "/ready (GET)",
+            "model-info": "/model-info (GET)",
+            "metrics": "/metrics (GET)"
+        }
+    })
+
+
+async def health_check(scope, receive, send):
+    payload, status = service.health_status()
+    return await send_json(send, payload, status=status)
+
+
+async def readiness_check(scope, receive, send):
+    payload, status = service.readiness_status()
+    return await send_json(send, payload, status=status)
+
+
+async def model_info(scope, receive, send):
+    if not service.model_loader.ready:
+        return await send_json(send, service.not_ready_response(), status=503)
+    return await send_json(send, {
+        "model_name": service.model_name,
+        "backend": service.model_backend,
+        "model_config": service.model.config.to_dict()
+    })
+
+
+async def metrics(scope, receive, send):
+    body = generate_latest()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", CONTENT_TYPE_LATEST.encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+    return 200
+
+
+async def generate(scope, receive, send):
+    if not service.model_loader.ready:
+        return await send_json(send, service.not_ready_response(), status=503,
+                               headers={"Retry-After": "5"})
+
+    try:
+        parsed = parse_generate_request(await read_json(receive),
+                                        max_length_limit=service.max_prompt_tokens + service.max_new_tokens_limit,
+                                        max_new_tokens_limit=service.max_new_tokens_limit)
+        deadline = service.request_deadline(parsed, get_header(scope, "X-Request-Timeout"))
+        tenant, priority = service.request_identity(lambda name: get_header(scope, name),
+                                                    (scope.get("client") or (None,))[0])
+    except RequestError as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=400)
+
+    prompt = parsed['prompt']
+    stream = parsed['stream']
+
+    try:
+        params, cost = service.plan_generation(parsed)
+    except RequestTooLargeError as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=413)
+
+    # Sampled outputs are only cached when the client asks for it or pins a seed
+    cacheable = parsed['cache'] or parsed['seed'] is not None
+    cache_key = make_cache_key(service.model_name, prompt, params) if cacheable else None
+
+    # With the body read, the next message only comes when the client disconnects
+    watcher = asyncio.create_task(watch_disconnect(receive, deadline))
+    try:
+        # Check cache first
+        cached_text = service.response_cache.get(cache_key) if cacheable else None
+        if cached_text is not None:
+            if stream:
+                return await send_events(send, single_event(service.sse_event({
+                    "prompt": prompt,
+                    "generated_text": cached_text,
+                    "model": service.model_name,
+                    "status": "success",
+                    "cached": True,
+                    "done": True
+                })))
+            return await send_json(send, {
+                "prompt": prompt,
+                "generated_text": cached_text,
+                "model": service.model_name,
+                "status": "success",
+                "cached": True
+            })
+
+        # Stream tokens as server-sent events while decoding progresses. Tokens
+        # are produced on generation threads and handed over to the loop.
+        start_time = time.time()
+        # The circuit breaker sees every generation, failures and latency
+        # count against it while cache hits and invalid requests never do
+        with service.circuit_breaker.call() as call:
+            if stream:
+                loop = asyncio.get_running_loop()
+                tokens = asyncio.Queue()
+
+                def on_token(token):
+                    loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+                future = await submit_generation(cost, service.batch_scheduler.generate, prompt,
+                                                 tenant=tenant, priority=priority,
+                                                 on_token=on_token, deadline=deadline, **params)
+                call.track(future)
+                future.add_done_callback(lambda _: on_token(None))
+                events = stream_generation(prompt, future, tokens, cache_key, start_time, deadline)
+                try:
+                    return await send_events(send, events)
+                finally:
+                    await events.aclose()
+
+            # Generate text on the inference workers as part of a batch
+            if cacheable:
+                # Identical requests arriving while this one runs wait for its
+                # result until their own deadline, and generate again if that
+                # request is cancelled
+                try:
+                    generated_text, _ = await service.inflight_requests.do_async(
+                        cache_key,
+                        lambda: run_generation(cost, service.generate_and_cache, prompt, params, cache_key,
+                                               deadline=deadline, tenant=tenant, priority=priority),
+                        timeout=deadline.remaining(),
+                        retry_on=(RequestCancelled,)
+                    )
+                except asyncio.TimeoutError:
+                    raise deadline.exception() from None
+            else:
+                generated_text = await run_generation(cost, service.batch_scheduler.generate, prompt,
+                                                      deadline=deadline, tenant=tenant, priority=priority,
+                                                      **params)
+
+        return await send_json(send, {
+            "prompt": prompt,
+            "generated_text": generated_text,
+            "model": service.model_name,
+            "status": "success",
+            "cached": False,
+            "generation_time": time.time() - start_time
+        })
+    except RequestTooLargeError as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=413)
+    except CircuitOpenError as e:
+        payload, headers = service.circuit_open_response(e)
+        return await send_json(send, payload, status=503, headers=headers)
+    except (QueueFullError, BudgetExceededError) as e:
+        # Push back on the client without counting against the circuit breaker
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=429, headers={"Retry-After": "1"})
+    except RateLimitedError as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=429, headers={"Retry-After": str(e.retry_after)})
+    except RequestCancelled as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=504)
+    except Exception as e:
+        return await send_json(send, {
+            "error": str(e),
+            "status": "error"
+        }, status=500)
+    finally:
+        watcher.cancel()
+
+
+routes = {
+    "/": {"GET": root},
+    "/health": {"GET": health_check},
+    "/ready": {"GET": readiness_check},
+    "/model-info": {"GET": model_info},
+    "/metrics": {"GET": metrics},
+    "/generate": {"POST": generate},
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Let the generation threads finish their current step
+            await asyncio.get_running_loop().run_in_executor(
+                None, service.inference_executor.shutdown)
+            service.stop_generation()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application serving the LLM service routes"""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    start_time = time.time()
+    methods = routes.get(scope["path"])
+    path = scope["path"] if methods is not None else "unmatched"
+    if methods is None:
+        status = await send_json(send, {"error": "Not found", "status": "error"}, status=404)
+    elif scope["method"] not in methods:
+        status = await send_json(send, {"error": "Method not allowed", "status": "error"},
+                                 status=405, headers={"Allow": ", ".join(methods)})
+    else:
+        status = await methods[scope["method"]](scope, receive, send)
+    request_latency.labels(method=scope["method"], path=path,
+                           status=str(status)).observe(time.time() - start_time)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("Starting LLM Service (asyncio)...")
+    print("Model loaded: distilgpt2")
+    print("Access the service at http://localhost:8080")
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)),
+                log_level=os.environ.get("LOG_LEVEL", "info"))
@@ -0,0 +1,130 @@
+"""
+Inference backends for the LLM service
+
+The service normally runs the full-precision PyTorch model. Two INT8 CPU
+backends can be selected instead:
+
+- "torch-int8" quantizes the weights of every linear projection with
+  PyTorch dynamic quantization, activations are quantized on the fly.
+- "onnx" runs an ONNX Runtime session over a decoder exported with past
+  key/values, typically model_with_past_quantized.onnx from
+  model_optimization.py --with-past --quantize.
+
+The ONNX session is the shared llm_inference OnnxBackend, wrapped so it is
+called like a Hugging Face model with past_key_values, which is all the
+continuous batching engine needs.
+"""
+
+import logging
+import os
+import sys
+
+import numpy as np
+import torch
+
+from kv_cache import to_legacy_cache
+
+# Code shared with the edge service, copied next to the app in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from llm_inference import OnnxBackend
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+def conv1d_to_linear(model):
+    """
+    Replace GPT-2 style Conv1D layers with equivalent nn.Linear layers
+
+    Conv1D is a linear layer with a transposed weight, but quantization only
+    recognizes nn.Linear, so the projections would stay in full precision.
+    """
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        from transformers.modeling_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+    return model
+
+
+def quantize_dynamic_int8(model):
+    """Quantize the linear layers of a model to INT8 weights, in place"""
+    conv1d_to_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear},
+                                                  dtype=torch.qint8, inplace=True)
+
+
+class _OnnxOutput:
+    __slots__ = ("logits", "past_key_values")
+
+    def __init__(self, logits, past_key_values):
+        self.logits = logits
+        self.past_key_values = past_key_values
+
+
+class OnnxCausalLM:
+    """
+    ONNX Runtime decoder called like a Hugging Face causal LM
+
+    Args:
+        model_path: ONNX decoder taking and returning past key/values
+        config: Hugging Face config of the exported model
+        num_threads: Intra-op threads for the session, or None for the default
+    """
+
+    def __init__(self, model_path, config, num_threads=None):
+        self.backend = OnnxBackend.from_file(model_path, num_threads=num_threads)
+        self.config = config
+        self.device = torch.device("cpu")
+
+    def __call__(self, input_ids, attention_mask, position_ids=None,
+                 past_key_values=None, use_cache=True):
+        past = to_legacy_cache(past_key_values)
+        if past is not None:
+            past = tuple((np.asarray(key, dtype=np.float32), np.asarray(value, dtype=np.float32))
+                         for key, value in past)
+        if position_ids is None:
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+
+        logits, present = self.backend.forward(
+            input_ids.numpy().astype(np.int64),
+            attention_mask.numpy().astype(np.int64),
+            position_ids.numpy().astype(np.int64),
+            past,
+        )
+        present = tuple((torch.from_numpy(key), torch.from_numpy(value)) for key, value in present)
+        return _OnnxOutput(torch.from_numpy(logits), present)
+
+
+def load_backend(kind, model, onnx_model_path=None, num_threads=None):
+    """
+    Turn a loaded PyTorch model into the model served by the given backend
+
+    Args:
+        kind: One of BACKENDS
+        model: Full-precision Hugging Face model
+        onnx_model_path: Decoder with past key/values used by the onnx backend
+        num_threads: Intra-op threads for the onnx backend
+
+    Returns:
+        The model to serve
+    """
+    kind = (kind or "torch").lower()
+    if kind == "torch":
+        return model
+    if kind == "torch-int8":
+        logger.info("Quantizing model linear layers to INT8")
+        return quantize_dynamic_int8(model)
+    if kind == "onnx":
+        logger.info(f"Serving ONNX Runtime decoder {onnx_model_path}")
+        return OnnxCausalLM(onnx_model_path, model.config, num_threads=num_threads)
+    raise ValueError(f"Unknown model backend: {kind}")
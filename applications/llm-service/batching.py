@@ -0,0 +1,237 @@
+"""
+Dynamic micro-batching for the LLM service
+
+Concurrent /generate calls are queued and coalesced into padded batches so
+that one model.generate call serves several requests at once. A batch is
+dispatched as soon as it reaches max_batch_size or the oldest request has
+waited max_wait_ms, whichever comes first. Requests whose deadline has
+passed by then are failed without being run.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = Histogram(
+    "llm_batch_size",
+    "Number of requests served by one batched generate call",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+BATCH_WAIT = Histogram(
+    "llm_batch_wait_seconds",
+    "Time a request spent queued before its batch was dispatched",
+)
+
+
+class _PendingRequest:
+    __slots__ = ("prompt", "params", "key", "future", "enqueued_at", "on_token", "deadline")
+
+    def __init__(self, prompt, params, on_token=None, deadline=None):
+        self.prompt = prompt
+        self.params = params
+        self.on_token = on_token
+        self.deadline = deadline
+        self.key = tuple(sorted(params.items()))
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _BatchStreamer:
+    """
+    Fan the tokens of a batched generate call out to per-request callbacks
+
+    Implements the put/end interface model.generate expects from a streamer.
+    The first put carries the prompts, every later one holds the next token
+    of each row. Rows stop receiving tokens once they have produced EOS or
+    used up the token budget set through limit().
+    """
+
+    def __init__(self, callbacks, eos_token_id):
+        self.callbacks = callbacks
+        self.eos_token_id = eos_token_id
+        self.finished = [False] * len(callbacks)
+        self.remaining = [None] * len(callbacks)
+        self.prompt_seen = False
+
+    def limit(self, max_new_tokens):
+        """Cap the number of tokens forwarded for each row"""
+        self.remaining = list(max_new_tokens)
+        self.finished = [f or n <= 0 for f, n in zip(self.finished, self.remaining)]
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(len(self.callbacks), -1)[:, -1].tolist()):
+            if self.finished[row]:
+                continue
+            if self.callbacks[row] is not None:
+                self.callbacks[row](token)
+            if self.remaining[row] is not None:
+                self.remaining[row] -= 1
+            if token == self.eos_token_id or self.remaining[row] == 0:
+                self.finished[row] = True
+
+    def end(self):
+        pass
+
+
+class BatchScheduler:
+    """
+    Coalesce concurrent generation requests into batches
+
+    Args:
+        run_batch: Callable taking a list of prompts plus generation keyword
+            arguments and returning one generated text per prompt. When any
+            request in a batch streams, it also receives a streamer keyword
+            to pass on to model.generate, after capping each row with
+            streamer.limit. When any request has a deadline, it receives a
+            deadlines keyword with one Deadline or None per prompt, and
+            should stop rows whose deadline has passed
+        max_batch_size: Maximum number of prompts per generate call
+        max_wait_ms: Longest time the first queued request waits for others
+        eos_token_id: Token after which a streamed row stops being forwarded
+        unbatched_params: Parameters whose requests always run alone when
+            set, e.g. a sampling seed, whose text would otherwise depend on
+            the other rows drawing from the same random stream
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, eos_token_id=None,
+                 unbatched_params=()):
+        self.run_batch = run_batch
+        self.eos_token_id = eos_token_id
+        self.unbatched_params = tuple(unbatched_params)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._running = False
+
+    def start(self):
+        """Start the dispatch thread if it is not already running"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._worker = threading.Thread(
+                target=self._dispatch_loop, name="batch-scheduler", daemon=True
+            )
+            self._worker.start()
+
+    def stop(self):
+        """Stop the dispatch thread, failing any requests still queued"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        while self._pending:
+            self._pending.popleft().future.set_exception(
+                RuntimeError("Batch scheduler stopped")
+            )
+
+    def submit(self, prompt, on_token=None, deadline=None, **params):
+        """
+        Queue a prompt for generation
+
+        Requests are only batched with others that use identical generation
+        parameters, since a single generate call applies one set to all rows.
+
+        Args:
+            prompt: Text to generate from
+            on_token: Optional callable receiving each new token id as soon
+                as it has been generated
+            deadline: Optional Deadline, the future fails with its
+                exception once it has passed
+
+        Returns:
+            A Future resolving to the generated text
+        """
+        self.start()
+        request = _PendingRequest(prompt, params, on_token, deadline)
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify_all()
+        return request.future
+
+    def generate(self, prompt, timeout=None, **params):
+        """Submit a prompt and block until its text has been generated"""
+        return self.submit(prompt, **params).result(timeout=timeout)
+
+    def _next_batch(self):
+        """Wait for a batch to fill up or time out, then take it off the queue"""
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._running:
+                return None
+
+            head = self._pending[0]
+            max_size = self.max_batch_size
+            if any(head.params.get(name) is not None for name in self.unbatched_params):
+                max_size = 1
+            dispatch_at = head.enqueued_at + self.max_wait
+            while self._running:
+                matching = sum(1 for r in self._pending if r.key == head.key)
+                remaining = dispatch_at - time.monotonic()
+                if matching >= max_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rest = [], deque()
+            for r in self._pending:
+                if r.deadline is not None and r.deadline.expired:
+                    r.future.set_exception(r.deadline.exception())
+                elif r.key == head.key and len(batch) < max_size:
+                    batch.append(r)
+                else:
+                    rest.append(r)
+            self._pending = rest
+            return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        now = time.monotonic()
+        for r in batch:
+            BATCH_WAIT.observe(now - r.enqueued_at)
+        BATCH_SIZE.observe(len(batch))
+
+        params = dict(batch[0].params)
+        if any(r.on_token is not None for r in batch):
+            params["streamer"] = _BatchStreamer([r.on_token for r in batch],
+                                                self.eos_token_id)
+        if any(r.deadline is not None for r in batch):
+            params["deadlines"] = [r.deadline for r in batch]
+
+        try:
+            texts = self.run_batch([r.prompt for r in batch], **params)
+            if len(texts) != len(batch):
+                raise RuntimeError(
+                    f"Batch returned {len(texts)} results for {len(batch)} prompts"
+                )
+        except Exception as e:
+            logger.error(f"Batched generation failed: {str(e)}")
+            for r in batch:
+                r.future.set_exception(e)
+            return
+
+        for r, text in zip(batch, texts):
+            if r.deadline is not None and r.deadline.expired:
+                r.future.set_exception(r.deadline.exception())
+            else:
+                r.future.set_result(text)
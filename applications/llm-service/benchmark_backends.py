@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmark for the LLM Service
+Compares the INT8 backends against the full-precision PyTorch model: perplexity
+on a small fixed corpus as an accuracy check, plus single request latency and
+batched throughput through the continuous batching engine.
+
+Exits with status 1 when a backend's perplexity is worse than FP32 by more
+than --max-ppl-increase, so it can gate a rollout.
+"""
+
+import sys
+import copy
+import math
+import time
+import argparse
+import logging
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from backends import load_backend
+from continuous_batching import ContinuousBatchingEngine
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+CORPUS = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Machine learning models are trained on large amounts of data to recognize patterns.",
+    "Kubernetes schedules containers across a cluster of machines and restarts them when they fail.",
+    "The weather today is sunny with a light breeze coming in from the west.",
+    "Attention lets a transformer weigh every earlier token when predicting the next one.",
+    "She opened the door, looked outside, and decided to take an umbrella after all.",
+    "Continuous integration runs the test suite on every change before it is merged.",
+    "The museum will be closed on Monday while the new exhibition is being installed.",
+]
+
+@torch.no_grad()
+def perplexity(model, tokenizer):
+    """Perplexity of the model over the fixed corpus"""
+    total_nll, total_tokens = 0.0, 0
+    for text in CORPUS:
+        input_ids = torch.tensor([tokenizer(text)["input_ids"]])
+        attention_mask = torch.ones_like(input_ids)
+        logits = model(input_ids=input_ids, attention_mask=attention_mask).logits
+        total_nll += F.cross_entropy(logits[0, :-1], input_ids[0, 1:], reduction="sum").item()
+        total_tokens += input_ids.shape[1] - 1
+    return math.exp(total_nll / total_tokens)
+
+def speed(model, tokenizer, prompt, max_length, runs, batch_size):
+    """
+    Time greedy generation through the continuous batching engine
+
+    Returns:
+        Tuple of (mean seconds per single request, tokens per second with
+        batch_size concurrent requests)
+    """
+    engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size=batch_size, do_sample=False)
+    counted = []
+    try:
+        # Warm up once before timing
+        engine.generate(prompt, max_length=max_length)
+
+        start_time = time.perf_counter()
+        for _ in range(runs):
+            engine.generate(prompt, max_length=max_length)
+        latency = (time.perf_counter() - start_time) / runs
+
+        start_time = time.perf_counter()
+        futures = [engine.submit(prompt, max_length=max_length, on_token=counted.append)
+                   for _ in range(batch_size * runs)]
+        for future in futures:
+            future.result()
+        throughput = len(counted) / (time.perf_counter() - start_time)
+    finally:
+        engine.stop()
+    return latency, throughput
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare INT8 inference backends against FP32")
+    parser.add_argument("--model", type=str, default="distilgpt2", help="Hugging Face model name or path")
+    parser.add_argument("--backends", type=str, nargs="+", default=["torch", "torch-int8", "onnx"], help="Backends to compare, torch is the FP32 baseline")
+    parser.add_argument("--onnx-model", type=str, default="optimized_models/model_with_past_quantized.onnx", help="Decoder with past key values for the onnx backend")
+    parser.add_argument("--prompt", type=str, default="Explain the concept of attention in deep learning", help="Prompt to generate from")
+    parser.add_argument("--max-length", type=int, default=64, help="Total sequence length to generate up to")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed generations")
+    parser.add_argument("--batch-size", type=int, default=8, help="Concurrent requests in the throughput run")
+    parser.add_argument("--max-ppl-increase", type=float, default=0.05, help="Largest allowed relative perplexity increase over FP32")
+
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    tokenizer.pad_token = tokenizer.eos_token
+    base_model = AutoModelForCausalLM.from_pretrained(args.model)
+    base_model.config.pad_token_id = tokenizer.eos_token_id
+
+    results = {}
+    for backend in args.backends:
+        # Quantization modifies the model in place, keep the baseline intact
+        model = load_backend(backend, copy.deepcopy(base_model), onnx_model_path=args.onnx_model)
+        logger.info(f"Benchmarking {backend} backend")
+        results[backend] = (perplexity(model, tokenizer),) + speed(
+            model, tokenizer, args.prompt, args.max_length, args.runs, args.batch_size
+        )
+
+    baseline = results.get("torch")
+    failed = False
+    print(f"{'backend':<12}{'perplexity':>12}{'ppl change':>12}{'sec/request':>14}{'tokens/sec':>12}")
+    for backend, (ppl, latency, throughput) in results.items():
+        change = ppl / baseline[0] - 1 if baseline else 0.0
+        print(f"{backend:<12}{ppl:>12.2f}{change:>+12.1%}{latency:>14.3f}{throughput:>12.1f}")
+        if change > args.max_ppl_increase:
+            logger.error(f"{backend} perplexity is {change:.1%} worse than FP32")
+            failed = True
+
+    sys.exit(1 if failed else 0)
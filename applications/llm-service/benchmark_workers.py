@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Worker Scaling Benchmark for the LLM Service
+Starts gunicorn with a growing number of workers, with and without the model
+preloaded in the master, and reports memory per worker and requests/sec.
+
+RSS counts shared pages in every process that maps them. PSS splits shared
+pages between the processes mapping them, so its total across the workers
+shows the real cost of adding one. Reading PSS needs Linux.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def memory_kib(pid):
+    """Return (rss, pss) of a process in KiB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1])
+    return values["Rss:"], values["Pss:"]
+
+def worker_pids(master_pid):
+    """Return the pids of the processes forked by the gunicorn master"""
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+def wait_until_ready(url, workers, master_pid, timeout):
+    """Wait for /health to answer and for every worker to be forked"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/health", timeout=1)
+            if len(worker_pids(master_pid)) >= workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server did not become ready within {timeout}s")
+
+def post_generate(url, prompt, max_length):
+    request = urllib.request.Request(
+        f"{url}/generate",
+        data=json.dumps({"prompt": prompt, "max_length": max_length}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=300) as response:
+        return response.status
+
+def run(workers, preload, args):
+    """
+    Serve with the given number of workers and load it with requests
+
+    Returns:
+        Tuple of (mean RSS MiB per worker, mean PSS MiB per worker,
+        total PSS MiB of master and workers, requests per second)
+    """
+    env = dict(os.environ,
+               WEB_WORKERS=str(workers),
+               PRELOAD_MODEL="true" if preload else "false",
+               PORT=str(args.port))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=SERVICE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(url, workers, server.pid, args.startup_timeout)
+
+        # Warm up every worker before measuring
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda _: post_generate(url, args.prompt, args.max_length),
+                          range(args.concurrency)))
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            statuses = list(pool.map(lambda _: post_generate(url, args.prompt, args.max_length),
+                                     range(args.requests)))
+        elapsed = time.perf_counter() - start_time
+        failed = sum(1 for status in statuses if status != 200)
+        if failed:
+            logger.warning(f"{failed} of {args.requests} requests failed")
+
+        pids = worker_pids(server.pid)
+        usage = [memory_kib(pid) for pid in pids]
+        total_pss = memory_kib(server.pid)[1] + sum(pss for _, pss in usage)
+        return (sum(rss for rss, _ in usage) / len(usage) / 1024,
+                sum(pss for _, pss in usage) / len(usage) / 1024,
+                total_pss / 1024,
+                args.requests / elapsed)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LLM service memory and throughput per worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to measure")
+    parser.add_argument("--requests", type=int, default=64, help="Number of timed requests per run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--prompt", type=str, default="Explain the concept of attention in deep learning", help="Prompt to generate from")
+    parser.add_argument("--max-length", type=int, default=50, help="Total sequence length to generate up to")
+    parser.add_argument("--port", type=int, default=8090, help="Port to serve the benchmark on")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="Seconds to wait for the workers to start")
+
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'preload':>9}{'rss/worker MiB':>16}{'pss/worker MiB':>16}{'total pss MiB':>15}{'req/s':>9}")
+    for workers in args.workers:
+        for preload in (False, True):
+            rss, pss, total_pss, throughput = run(workers, preload, args)
+            print(f"{workers:>8}{str(preload):>9}{rss:>16.1f}{pss:>16.1f}{total_pss:>15.1f}{throughput:>9.1f}")
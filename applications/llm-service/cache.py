@@ -0,0 +1,307 @@
+"""
+Response cache for the LLM service
+
+The in-process tier is a thread-safe LRU cache bounded by entry count and by
+the approximate number of bytes held in keys and values, with optional
+expiry of entries after a fixed time to live. It can be backed by a shared
+tier that every replica reads and writes, so the hit rate does not drop as
+the deployment scales out.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CACHE_HITS = Counter("llm_cache_hits", "Response cache lookups that found an entry")
+CACHE_MISSES = Counter("llm_cache_misses", "Response cache lookups that found no entry")
+CACHE_EVICTIONS = Counter(
+    "llm_cache_evictions",
+    "Entries removed from the response cache",
+    ["reason"],
+)
+CACHE_BYTES = Gauge("llm_cache_bytes", "Approximate bytes held by the response cache")
+CACHE_ENTRIES = Gauge("llm_cache_entries", "Entries held by the response cache")
+SHARED_CACHE_REQUESTS = Counter(
+    "llm_shared_cache_requests",
+    "Lookups against the shared response cache tier",
+    ["result"],
+)
+
+
+def make_cache_key(model_name, prompt, params):
+    """
+    Build a stable cache key for a prompt and its generation parameters
+
+    The prompt is Unicode-normalized so equivalent encodings share an entry,
+    and the model name is included so replicas serving different models
+    never read each other's outputs.
+    """
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "prompt": unicodedata.normalize("NFC", prompt),
+            "params": params,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_size(key, value):
+    return len(key.encode("utf-8")) + len(value.encode("utf-8"))
+
+
+class ResponseCache:
+    """
+    LRU cache of generated texts
+
+    Args:
+        max_entries: Maximum number of entries kept
+        max_bytes: Maximum approximate size of all keys and values
+        ttl_seconds: Seconds after which an entry expires, or None to keep
+            entries until they are evicted
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds or None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key, "expired")
+                entry = None
+            if entry is None:
+                CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+            CACHE_HITS.inc()
+            return entry[0]
+
+    def set(self, key, value):
+        """Store value under key, evicting least recently used entries as needed"""
+        size = _entry_size(key, value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, None)
+            if size > self.max_bytes:
+                CACHE_EVICTIONS.labels(reason="too_large").inc()
+                return
+            self._entries[key] = (value, time.monotonic(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)), "capacity")
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)), "bytes")
+            self._update_gauges()
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, entry):
+        return (self.ttl_seconds is not None
+                and time.monotonic() - entry[1] > self.ttl_seconds)
+
+    def _remove(self, key, reason):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        if reason is not None:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        CACHE_BYTES.set(self._bytes)
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+class CacheBackend:
+    """Interface for a response cache tier shared between replicas"""
+
+    def get(self, key):
+        """Return the value stored under key, or None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store value under key, expiring after ttl_seconds if given"""
+        raise NotImplementedError
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Shared cache tier kept in a SQLite file
+
+    Suitable for replicas on one host sharing a volume, and as a stand-in
+    for a network cache in tests. The connection is opened on first use in
+    each process, since a SQLite connection must not be used across fork.
+
+    Args:
+        path: Location of the database file
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Connection owned by the current process, opened on first use"""
+        if self._pid != os.getpid():
+            # A forked worker inherits the parent's connection and maybe a
+            # held lock, and replaces both rather than touching them
+            self._lock = threading.Lock()
+            self._conn = None
+            self._pid = os.getpid()
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                with conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+                    )
+                self._conn = conn
+            return self._conn
+
+    def get(self, key):
+        conn = self._connection()
+        with self._lock:
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        conn = self._connection()
+        with self._lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Shared cache tier kept in Redis
+
+    Args:
+        url: Redis connection URL, e.g. redis://redis:6379/0
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl_seconds=None):
+        self._client.set(key, value, ex=int(ttl_seconds) if ttl_seconds else None)
+
+
+def create_shared_backend(kind, sqlite_path=None, redis_url=None):
+    """
+    Create the shared cache tier selected by configuration
+
+    Args:
+        kind: "none", "sqlite" or "redis"
+        sqlite_path: Database file used by the sqlite backend
+        redis_url: Connection URL used by the redis backend
+
+    Returns:
+        A CacheBackend, or None when no shared tier is configured
+    """
+    kind = (kind or "none").lower()
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        return SQLiteCacheBackend(sqlite_path)
+    if kind == "redis":
+        try:
+            return RedisCacheBackend(redis_url)
+        except ImportError:
+            logger.error("redis is required for the redis cache backend. Install with: pip install redis")
+            return None
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+class TieredCache:
+    """
+    In-process LRU cache in front of an optional shared tier
+
+    Lookups that miss locally fall through to the shared tier, and shared
+    hits are copied into the local tier. Failures of the shared tier are
+    logged and treated as misses so they never fail a request.
+
+    Args:
+        local: ResponseCache used as the first tier
+        shared: Optional CacheBackend used as the second tier
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception as e:
+            logger.warning(f"Shared cache lookup failed: {str(e)}")
+            SHARED_CACHE_REQUESTS.labels(result="error").inc()
+            return None
+        SHARED_CACHE_REQUESTS.labels(result="hit" if value is not None else "miss").inc()
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(key, value, self.local.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def clear(self):
+        """Clear the local tier, the shared tier is left to expire on its own"""
+        self.local.clear()
+
+    def __len__(self):
+        return len(self.local)
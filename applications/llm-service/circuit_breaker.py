@@ -0,0 +1,253 @@
+"""
+Circuit breaker for the LLM service
+
+Generation calls pass through a breaker that opens after consecutive
+failures or when the p95 latency of recent calls exceeds its SLO. While
+open, calls are refused right away with a Retry-After hint instead of
+piling up behind a struggling model. Once the reset timeout has passed the
+breaker is half-open: a few probe calls go through, and it closes again if
+they succeed within the SLO or reopens if they don't. Calls beyond an
+in-flight limit are shed without opening the breaker.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+CIRCUIT_STATE = Gauge(
+    "llm_circuit_breaker_state",
+    "1 for the state the circuit breaker is in, 0 for the others",
+    ["state"],
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "llm_circuit_breaker_transitions",
+    "Circuit breaker state changes, by the state entered",
+    ["state"],
+)
+CIRCUIT_REJECTED = Counter(
+    "llm_circuit_breaker_rejected",
+    "Calls refused by the circuit breaker",
+    ["reason"],
+)
+CIRCUIT_IN_FLIGHT = Gauge(
+    "llm_circuit_breaker_in_flight",
+    "Calls admitted by the circuit breaker that have not finished",
+)
+CIRCUIT_P95_LATENCY = Gauge(
+    "llm_circuit_breaker_p95_latency_seconds",
+    "p95 latency of the recent calls the circuit breaker has seen",
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker refuses a call"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Call:
+    """One call admitted by a CircuitBreaker, ends with exactly one outcome"""
+
+    def __init__(self, breaker, probe):
+        self.breaker = breaker
+        self.probe = probe
+        self.started_at = time.monotonic()
+        self.tracking = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def track(self, future):
+        """Take the outcome from future once it resolves instead of on exit"""
+        self.tracking = True
+        future.add_done_callback(self._resolved)
+
+    def _resolved(self, future):
+        if future.cancelled():
+            self.failure()
+        elif future.exception() is None:
+            self.success()
+        elif isinstance(future.exception(), self.breaker.ignored_exceptions):
+            self.release()
+        else:
+            self.failure()
+
+    def success(self):
+        self._finish(True)
+
+    def failure(self):
+        self._finish(False)
+
+    def release(self):
+        """End the call without counting it as a success or a failure"""
+        self._finish(None)
+
+    def _finish(self, succeeded):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self.breaker._record(self, succeeded, time.monotonic() - self.started_at)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker tracking failures, latency and in-flight calls
+
+    Args:
+        failure_threshold: Consecutive failures that open the breaker
+        reset_timeout: Seconds the breaker stays open before probing
+        latency_slo: p95 latency in seconds above which the breaker opens,
+            None to ignore latency
+        window_size: Number of recent call latencies the p95 is taken over
+        min_samples: Calls needed in the window before latency can open it
+        max_in_flight: Calls admitted at once, None for no limit
+        half_open_max_calls: Probe calls let through while half-open
+        ignored_exceptions: Exceptions that end a call without counting it
+            as a failure, e.g. rejections by a full queue
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, latency_slo=None,
+                 window_size=100, min_samples=20, max_in_flight=None,
+                 half_open_max_calls=1, ignored_exceptions=()):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.latency_slo = latency_slo
+        self.min_samples = max(1, int(min_samples))
+        self.max_in_flight = max_in_flight
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self.ignored_exceptions = tuple(ignored_exceptions)
+
+        self.state = CLOSED
+        self.failures = 0
+        self.in_flight = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._latencies = deque(maxlen=max(1, int(window_size)))
+        self._lock = threading.Lock()
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            CIRCUIT_STATE.labels(state=state).set(1 if state == CLOSED else 0)
+
+    @contextmanager
+    def call(self):
+        """
+        Admit a call for the duration of the block
+
+        The call succeeds when the block exits normally and fails when it
+        raises anything but an ignored exception. Once the call tracks a
+        future, the future alone decides.
+
+        Raises:
+            CircuitOpenError: If the breaker refuses the call
+        """
+        call = self.allow()
+        try:
+            yield call
+        except self.ignored_exceptions:
+            if not call.tracking:
+                call.release()
+            raise
+        except Exception:
+            if not call.tracking:
+                call.failure()
+            raise
+        if not call.tracking:
+            call.success()
+
+    def allow(self):
+        """
+        Admit a call, which must then be ended through the returned object
+
+        Raises:
+            CircuitOpenError: If the breaker refuses the call
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    CIRCUIT_REJECTED.labels(reason="open").inc()
+                    raise CircuitOpenError("Service temporarily unavailable", math.ceil(remaining))
+                self._transition(HALF_OPEN)
+
+            probe = self.state == HALF_OPEN
+            if probe and self._probes >= self.half_open_max_calls:
+                CIRCUIT_REJECTED.labels(reason="half_open").inc()
+                raise CircuitOpenError("Service is recovering, retry shortly", 1)
+            if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                CIRCUIT_REJECTED.labels(reason="in_flight").inc()
+                raise CircuitOpenError("Too many requests in flight", 1)
+
+            if probe:
+                self._probes += 1
+            self.in_flight += 1
+            CIRCUIT_IN_FLIGHT.set(self.in_flight)
+        return _Call(self, probe)
+
+    def p95_latency(self):
+        """p95 of the latencies in the window, None when it is empty"""
+        with self._lock:
+            return self._p95()
+
+    def _record(self, call, succeeded, latency):
+        with self._lock:
+            self.in_flight -= 1
+            CIRCUIT_IN_FLIGHT.set(self.in_flight)
+            if call.probe:
+                self._probes -= 1
+            if succeeded is None:
+                return
+
+            slow = self.latency_slo is not None and latency > self.latency_slo
+            if succeeded:
+                self._latencies.append(latency)
+                p95 = self._p95()
+                CIRCUIT_P95_LATENCY.set(p95)
+                self.failures = 0
+            else:
+                self.failures += 1
+
+            if call.probe:
+                # A probe decides for the half-open breaker, unless another
+                # call has already reopened or closed it
+                if self.state == HALF_OPEN:
+                    self._transition(CLOSED if succeeded and not slow else OPEN)
+            elif self.state == CLOSED:
+                over_slo = (succeeded and self.latency_slo is not None
+                            and len(self._latencies) >= self.min_samples and p95 > self.latency_slo)
+                if self.failures >= self.failure_threshold or over_slo:
+                    self._transition(OPEN)
+
+    def _p95(self):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        CIRCUIT_STATE.labels(state=self.state).set(0)
+        CIRCUIT_STATE.labels(state=state).set(1)
+        CIRCUIT_TRANSITIONS.labels(state=state).inc()
+        logger.warning(f"Circuit breaker {self.state} -> {state}, "
+                       f"{self.failures} consecutive failures, p95 latency {self._p95()}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            # Start over, the latencies that opened the breaker are stale
+            self.failures = 0
+            self._latencies.clear()
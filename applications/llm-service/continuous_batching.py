@@ -0,0 +1,422 @@
+"""
+Continuous (iteration-level) batching for the LLM service
+
+Instead of running a whole batch to completion, the engine advances every
+active sequence by one token per step. Sequences are retired as soon as they
+emit EOS or reach their length limit, and queued requests are admitted into the
+freed slots before the next step, so short requests never wait behind long
+ones. Sequences whose deadline passes are dropped the same way, after the
+step that noticed it. All active sequences share one left-padded key/value
+cache.
+
+With a PrefixCache attached, prompts resume from the longest prefix whose
+keys and values were stored by an earlier prefill, and only the remaining
+tokens are run through the model.
+"""
+
+import os
+import sys
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+from prometheus_client import Gauge, Histogram
+
+from kv_cache import (
+    concat_rows,
+    from_legacy_cache,
+    pad_left,
+    select_rows,
+    to_legacy_cache,
+    trim_left,
+)
+
+# Code shared with the edge service, copied next to the app in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from llm_inference import PromptEncoder
+
+logger = logging.getLogger(__name__)
+
+ENGINE_OCCUPANCY = Histogram(
+    "llm_engine_batch_occupancy",
+    "Fraction of decode slots occupied at each engine step",
+    buckets=(0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0),
+)
+ENGINE_ACTIVE = Gauge(
+    "llm_engine_active_sequences",
+    "Sequences currently being decoded by the engine",
+)
+ENGINE_QUEUED = Gauge(
+    "llm_engine_queued_requests",
+    "Requests waiting for a free decode slot",
+)
+
+
+class _Sequence:
+    """Decoding state for one request"""
+
+    def __init__(self, prompt, max_length, seed=None, on_token=None, max_new_tokens=None,
+                 deadline=None):
+        self.prompt = prompt
+        self.deadline = deadline
+        self.max_length = max_length
+        self.max_new_tokens = max_new_tokens
+        # Prompts are only truncated when max_length bounds the whole sequence
+        self.truncate_to = max_length if max_new_tokens is None else None
+        self.seed = seed
+        self.generator = None
+        self.on_token = on_token
+        self.future = Future()
+        self.token_ids = []
+        self.ngrams = {}
+
+    def start(self, prompt_ids, ngram_size):
+        self.token_ids = list(prompt_ids)
+        if ngram_size > 0:
+            for end in range(ngram_size, len(self.token_ids) + 1):
+                self._record_ngram(end, ngram_size)
+
+    def append(self, token_id, ngram_size):
+        self.token_ids.append(token_id)
+        if ngram_size > 0 and len(self.token_ids) >= ngram_size:
+            self._record_ngram(len(self.token_ids), ngram_size)
+
+    def banned_tokens(self, ngram_size):
+        """Tokens that would repeat an n-gram already in the sequence"""
+        if ngram_size <= 0 or len(self.token_ids) < ngram_size - 1:
+            return ()
+        prefix = tuple(self.token_ids[len(self.token_ids) - ngram_size + 1:])
+        return self.ngrams.get(prefix, ())
+
+    def _record_ngram(self, end, ngram_size):
+        ngram = self.token_ids[end - ngram_size:end]
+        self.ngrams.setdefault(tuple(ngram[:-1]), set()).add(ngram[-1])
+
+
+class ContinuousBatchingEngine:
+    """
+    Token-by-token decode loop with per-step admission of new requests
+
+    Args:
+        model: Causal language model used for prefill and decode steps
+        tokenizer: Tokenizer matching the model
+        max_batch_size: Number of sequences decoded concurrently
+        temperature: Sampling temperature
+        no_repeat_ngram_size: Size of n-grams that may not repeat
+        do_sample: Sample from the distribution instead of taking the argmax
+        prefix_cache: Optional PrefixCache used to skip prefill of known prefixes
+        encoder: PromptEncoder for the tokenizer, shared with other users of
+            the tokenizer so they share its cache. One is created when None
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, temperature=0.7,
+                 no_repeat_ngram_size=2, do_sample=True, prefix_cache=None, encoder=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.encoder = encoder or PromptEncoder(tokenizer)
+        self.prefix_cache = prefix_cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.temperature = temperature
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.do_sample = do_sample
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._running = False
+
+        # Shared state of the sequences being decoded
+        self._active = []
+        self._past = None
+        self._mask = None
+
+    def start(self):
+        """Start the decode thread if it is not already running"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._worker = threading.Thread(
+                target=self._decode_loop, name="continuous-batching", daemon=True
+            )
+            self._worker.start()
+
+    def stop(self):
+        """Stop the decode thread, failing any unfinished requests"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        error = RuntimeError("Generation engine stopped")
+        for seq in list(self._pending) + self._active:
+            seq.future.set_exception(error)
+        self._pending.clear()
+        self._reset()
+
+    def submit(self, prompt, max_length=50, seed=None, on_token=None, max_new_tokens=None,
+               deadline=None):
+        """
+        Queue a prompt for generation
+
+        Args:
+            prompt: Text to generate from
+            max_length: Total length of prompt plus generated tokens, the
+                prompt is truncated to it. Ignored with max_new_tokens
+            seed: Optional seed making this request's samples reproducible
+                regardless of which other sequences share its batch
+            on_token: Optional callable receiving each new token id as soon
+                as it has been sampled
+            max_new_tokens: Number of tokens to generate after the whole,
+                untruncated prompt
+            deadline: Optional Deadline, the future fails with its
+                exception once it has passed
+
+        Returns:
+            A Future resolving to the generated text
+        """
+        self.start()
+        seq = _Sequence(prompt, max_length, seed, on_token, max_new_tokens, deadline)
+        with self._cond:
+            self._pending.append(seq)
+            ENGINE_QUEUED.set(len(self._pending))
+            self._cond.notify_all()
+        return seq.future
+
+    def generate(self, prompt, timeout=None, **params):
+        """Submit a prompt and block until its text has been generated"""
+        return self.submit(prompt, **params).result(timeout=timeout)
+
+    def _decode_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending and not self._active:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                admitted = []
+                while self._pending and len(self._active) + len(admitted) < self.max_batch_size:
+                    admitted.append(self._pending.popleft())
+                ENGINE_QUEUED.set(len(self._pending))
+
+            if admitted:
+                try:
+                    self._admit(admitted)
+                except Exception as e:
+                    self._fail_admission(admitted, e)
+            if self._active:
+                self._step()
+            ENGINE_ACTIVE.set(len(self._active))
+
+    @torch.no_grad()
+    def _admit(self, sequences):
+        """Prefill newly admitted prompts and merge them into the active batch"""
+        # Requests that ran out of time while queued are never prefilled
+        live = []
+        for seq in sequences:
+            if seq.deadline is not None and seq.deadline.expired:
+                seq.future.set_exception(seq.deadline.exception())
+            else:
+                live.append(seq)
+        sequences = live
+
+        # Prompts admitted together are encoded in one call per truncation length
+        encoded = [None] * len(sequences)
+        for truncate_to in {seq.truncate_to for seq in sequences}:
+            rows = [row for row, seq in enumerate(sequences) if seq.truncate_to == truncate_to]
+            prompts = [sequences[row].prompt for row in rows]
+            for row, prompt_ids in zip(rows, self.encoder.encode_batch(prompts, truncate_to)):
+                encoded[row] = prompt_ids
+
+        ready = []
+        for seq, prompt_ids in zip(sequences, encoded):
+            if not prompt_ids:
+                seq.future.set_exception(ValueError("Prompt produced no tokens"))
+                continue
+            seq.start(prompt_ids, self.no_repeat_ngram_size)
+            if seq.max_new_tokens is not None:
+                seq.max_length = len(prompt_ids) + seq.max_new_tokens
+            if seq.seed is not None:
+                seq.generator = torch.Generator(device=self.model.device)
+                seq.generator.manual_seed(seq.seed)
+            if len(seq.token_ids) >= seq.max_length:
+                self._finish(seq)
+            else:
+                ready.append(seq)
+        if not ready:
+            return
+
+        try:
+            # Prompts are laid out as [padding, cached prefix, padding, new tokens]
+            prefixes = [self._lookup_prefix(seq) for seq in ready]
+            prefix_width = max(length for length, _ in prefixes)
+            width = max(len(seq.token_ids) - length for seq, (length, _) in zip(ready, prefixes))
+            pad_id = self.tokenizer.pad_token_id
+            input_ids, mask = [], []
+            for seq, (length, _) in zip(ready, prefixes):
+                suffix = seq.token_ids[length:]
+                input_ids.append([pad_id] * (width - len(suffix)) + suffix)
+                mask.append([0] * (prefix_width - length) + [1] * length
+                            + [0] * (width - len(suffix)) + [1] * len(suffix))
+            input_ids = torch.tensor(input_ids, device=self.model.device)
+            mask = torch.tensor(mask, device=self.model.device)
+            position_ids = (mask.cumsum(-1) - 1).clamp(min=0)[:, prefix_width:]
+
+            outputs = self.model(input_ids=input_ids,
+                                 attention_mask=mask,
+                                 position_ids=position_ids,
+                                 past_key_values=from_legacy_cache(
+                                     self._stack_prefixes(prefixes, prefix_width)),
+                                 use_cache=True)
+            next_tokens = self._sample(outputs.logits[:, -1, :], ready)
+        except Exception as e:
+            logger.error(f"Prefill failed: {str(e)}")
+            for seq in ready:
+                seq.future.set_exception(e)
+            return
+
+        past = to_legacy_cache(outputs.past_key_values)
+        if self.prefix_cache is not None:
+            self._store_prefixes(ready, past, mask)
+
+        first_row = len(self._active)
+        self._merge(ready, past, mask)
+        self._advance(next_tokens, first_row)
+
+    def _lookup_prefix(self, seq):
+        """Longest cached prefix of a prompt as (length, legacy cache)"""
+        if self.prefix_cache is None:
+            return 0, None
+        return self.prefix_cache.lookup(seq.token_ids)
+
+    def _stack_prefixes(self, prefixes, width):
+        """Left-pad cached prefixes to a common width and stack them into a batch"""
+        if width == 0:
+            return None
+        reference = next(past for _, past in prefixes if past is not None)
+        empty = tuple((key[:, :, :0], value[:, :, :0]) for key, value in reference)
+        return concat_rows([pad_left(past if past is not None else empty, width - length)
+                            for length, past in prefixes])
+
+    def _store_prefixes(self, sequences, past, mask):
+        """Store each prompt's keys and values, dropping padding positions"""
+        for row, seq in enumerate(sequences):
+            columns = mask[row].nonzero().squeeze(1)
+            self.prefix_cache.insert(
+                seq.token_ids,
+                tuple((key[row:row + 1].index_select(2, columns),
+                       value[row:row + 1].index_select(2, columns))
+                      for key, value in past),
+            )
+
+    @torch.no_grad()
+    def _step(self):
+        """Decode one token for every active sequence"""
+        ENGINE_OCCUPANCY.observe(len(self._active) / self.max_batch_size)
+        try:
+            input_ids = torch.tensor([[seq.token_ids[-1]] for seq in self._active],
+                                     device=self._mask.device)
+            attention_mask = F.pad(self._mask, (0, 1), value=1)
+            position_ids = self._mask.sum(-1, keepdim=True)
+
+            outputs = self.model(input_ids=input_ids,
+                                 attention_mask=attention_mask,
+                                 position_ids=position_ids,
+                                 past_key_values=from_legacy_cache(self._past),
+                                 use_cache=True)
+            next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        except Exception as e:
+            logger.error(f"Decode step failed: {str(e)}")
+            for seq in self._active:
+                seq.future.set_exception(e)
+            self._reset()
+            return
+
+        self._past = to_legacy_cache(outputs.past_key_values)
+        self._mask = attention_mask
+        self._advance(next_tokens)
+
+    def _sample(self, logits, sequences):
+        logits = logits.float()
+        for row, seq in enumerate(sequences):
+            banned = seq.banned_tokens(self.no_repeat_ngram_size)
+            if banned:
+                logits[row, list(banned)] = -float("inf")
+        if not self.do_sample:
+            return logits.argmax(-1).tolist()
+        probs = torch.softmax(logits / self.temperature, dim=-1)
+        next_tokens = torch.multinomial(probs, 1).squeeze(1).tolist()
+        for row, seq in enumerate(sequences):
+            if seq.generator is not None:
+                next_tokens[row] = int(torch.multinomial(probs[row], 1, generator=seq.generator))
+        return next_tokens
+
+    def _advance(self, next_tokens, first_row=0):
+        """Append sampled tokens to rows from first_row on and retire finished ones"""
+        eos_id = self.tokenizer.eos_token_id
+        keep = list(range(first_row))
+        for row, token in enumerate(next_tokens, start=first_row):
+            seq = self._active[row]
+            seq.append(token, self.no_repeat_ngram_size)
+            if seq.on_token is not None:
+                seq.on_token(token)
+            if token == eos_id or len(seq.token_ids) >= seq.max_length:
+                self._finish(seq)
+            elif seq.deadline is not None and seq.deadline.expired:
+                seq.future.set_exception(seq.deadline.exception())
+            else:
+                keep.append(row)
+        if len(keep) < len(self._active):
+            self._retain(keep)
+
+    def _merge(self, sequences, past, mask):
+        """Add prefilled sequences to the shared left-padded cache"""
+        if not self._active:
+            self._active, self._past, self._mask = list(sequences), past, mask
+            return
+        current, incoming = self._mask.shape[1], mask.shape[1]
+        width = max(current, incoming)
+        # Build both before assigning, a failure leaves the batch as it was
+        merged_past = concat_rows([pad_left(self._past, width - current),
+                                   pad_left(past, width - incoming)])
+        merged_mask = torch.cat([F.pad(self._mask, (width - current, 0)),
+                                 F.pad(mask, (width - incoming, 0))])
+        self._past, self._mask = merged_past, merged_mask
+        self._active.extend(sequences)
+
+    def _retain(self, rows):
+        """Drop retired rows and any padding columns no row needs anymore"""
+        if not rows:
+            self._reset()
+            return
+        self._active = [self._active[row] for row in rows]
+        self._past = select_rows(self._past, rows)
+        self._mask = self._mask[rows]
+        unused = int(self._mask.any(0).long().argmax())
+        if unused:
+            self._past = trim_left(self._past, unused)
+            self._mask = self._mask[:, unused:]
+
+    def _fail_admission(self, sequences, error):
+        """Fail the sequences of an admission that raised and keep decoding the others"""
+        logger.error(f"Admission failed: {str(error)}")
+        failed = list(sequences)
+        if any(seq in self._active for seq in sequences):
+            # They already joined the shared cache, which can't be trusted anymore
+            failed += [seq for seq in self._active if seq not in sequences]
+            self._reset()
+        for seq in failed:
+            if not seq.future.done():
+                seq.future.set_exception(error)
+
+    def _reset(self):
+        self._active, self._past, self._mask = [], None, None
+
+    def _finish(self, seq):
+        seq.future.set_result(
+            self.tokenizer.decode(seq.token_ids, skip_special_tokens=True)
+        )
@@ -0,0 +1,123 @@
+"""
+Request deadlines for the LLM service
+
+A Deadline travels with a request from the handler to the generation
+engines. The engines check it before every decoding step and drop the
+request as soon as its time is up or the handler cancels it, for example
+because the client disconnected, so its slot and worker are freed instead
+of generating text nobody will read.
+"""
+
+import threading
+import time
+
+import torch
+from prometheus_client import Counter
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+CANCELLED_REQUESTS = Counter(
+    "llm_cancelled_requests",
+    "Generations abandoned before they finished",
+    ["reason"],
+)
+
+
+class RequestCancelled(Exception):
+    """Raised for a request whose deadline passed or that was cancelled"""
+
+    def __init__(self, reason):
+        super().__init__(
+            "Request deadline exceeded" if reason == "deadline" else f"Request cancelled: {reason}"
+        )
+        self.reason = reason
+
+
+class ClientCancelled(RequestCancelled):
+    """
+    Raised for a request its client stopped, by going away or through the
+    timeout it picked, which says nothing about the health of the service
+    """
+
+
+class ClientDisconnected(ClientCancelled):
+    """Raised for a request cancelled because its client went away"""
+
+    def __init__(self):
+        super().__init__("disconnect")
+
+
+class Deadline:
+    """
+    Time limit and cancellation flag of one request
+
+    Args:
+        timeout: Seconds the request may take from now, None for no limit
+        client: Whether the client picked the timeout rather than the
+            server applying its default
+    """
+
+    def __init__(self, timeout=None, client=False):
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+        self.client = client
+        self.cancel_reason = None
+        self._lock = threading.Lock()
+        self._counted = False
+
+    def cancel(self, reason="disconnect"):
+        """Stop the request at the next step, the first reason given is kept"""
+        with self._lock:
+            if self.cancel_reason is None:
+                self.cancel_reason = reason
+
+    @property
+    def reason(self):
+        """Why the request has to stop, or None while it may continue"""
+        if self.cancel_reason is not None:
+            return self.cancel_reason
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            return "deadline"
+        return None
+
+    @property
+    def expired(self):
+        return self.reason is not None
+
+    def remaining(self):
+        """Seconds left, None without a time limit"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def exception(self):
+        """Count the cancellation once and return the error to fail its request with"""
+        reason = self.reason or "deadline"
+        with self._lock:
+            if not self._counted:
+                self._counted = True
+                CANCELLED_REQUESTS.labels(reason=reason).inc()
+        if reason == "disconnect":
+            return ClientDisconnected()
+        return ClientCancelled(reason) if self.client else RequestCancelled(reason)
+
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """
+    Stop the rows of a generate call whose deadline has passed
+
+    Args:
+        deadlines: One Deadline or None per row
+    """
+
+    def __init__(self, deadlines):
+        self.deadlines = deadlines
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([deadline is not None and deadline.expired for deadline in self.deadlines],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+def deadline_stopping_criteria(deadlines):
+    """Stopping criteria for model.generate from one Deadline or None per row, None without any"""
+    if not deadlines or all(deadline is None for deadline in deadlines):
+        return None
+    return StoppingCriteriaList([DeadlineStoppingCriteria(deadlines)])
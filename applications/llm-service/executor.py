@@ -0,0 +1,121 @@
+"""
+Inference worker pool for the LLM service
+
+Request handlers hand generation work to a fixed set of worker threads
+through a bounded queue instead of running it inline. A full queue is
+reported immediately so the handler can push back on the client, and
+request concurrency of the web server is no longer tied to inference.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Gauge, Histogram
+
+QUEUE_DEPTH = Gauge(
+    "llm_inference_queue_depth",
+    "Inference tasks waiting for a worker",
+)
+QUEUE_WAIT = Histogram(
+    "llm_inference_queue_wait_seconds",
+    "Time an inference task waited before a worker picked it up",
+)
+BUSY_WORKERS = Gauge(
+    "llm_inference_busy_workers",
+    "Inference workers currently running a task",
+)
+REJECTED_TASKS = Counter(
+    "llm_inference_rejected",
+    "Inference tasks rejected because the queue was full",
+)
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot accept more work"""
+
+
+class InferenceExecutor:
+    """
+    Fixed pool of inference threads fed by a bounded queue
+
+    Args:
+        max_workers: Number of tasks run concurrently
+        max_queue_size: Number of tasks allowed to wait for a worker
+    """
+
+    def __init__(self, max_workers=4, max_queue_size=64):
+        self.max_workers = max(1, int(max_workers))
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._workers = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) for a worker
+
+        Returns:
+            A Future resolving to the return value of fn
+
+        Raises:
+            QueueFullError: If the queue is full or the pool is shut down
+        """
+        self._start()
+        if self._shutdown:
+            raise QueueFullError("Inference executor is shut down")
+        future = Future()
+        try:
+            self._queue.put_nowait((future, fn, args, kwargs, time.monotonic()))
+        except queue.Full:
+            REJECTED_TASKS.inc()
+            raise QueueFullError("Inference queue is full")
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return future
+
+    def queue_depth(self):
+        """Number of tasks waiting for a worker"""
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """Stop the workers once the tasks already queued have run"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _start(self):
+        with self._lock:
+            if self._workers or self._shutdown:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(
+                    target=self._work, name=f"inference-worker-{i}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs, enqueued_at = item
+            QUEUE_DEPTH.set(self._queue.qsize())
+            QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            BUSY_WORKERS.inc()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                BUSY_WORKERS.dec()
@@ -0,0 +1,67 @@
+"""
+Gunicorn configuration for serving the LLM service from several processes
+
+With preload_app the app module, and with it the model weights, is imported
+once in the master before the workers are forked. The workers then share
+those pages copy-on-write instead of each loading its own copy, so adding
+a worker costs little more than its own activations and caches.
+
+Run with:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import gc
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get("WEB_WORKERS", 2))
+# Streaming responses hold a thread for their whole duration
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 16))
+timeout = int(os.environ.get("WEB_TIMEOUT", 120))
+preload_app = os.environ.get("PRELOAD_MODEL", "true").lower() == "true"
+
+# Workers only share the weights if the master has loaded them before forking.
+# The master must not run torch with several threads: forked workers inherit
+# its OpenMP thread pool broken and hang on their first parallel op. It
+# loads single threaded and leaves warm-up to the workers.
+if preload_app:
+    import torch
+
+    os.environ["MODEL_LOAD_MODE"] = "eager"
+    os.environ["WARMUP_IN_WORKERS"] = "true"
+    torch.set_num_threads(1)
+
+# Workers write their metrics to a shared directory so /metrics on any
+# worker reports the whole server. It has to be set, and emptied of a
+# previous run, before the app imports prometheus_client.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/llm-service-metrics")
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # Objects loaded so far are never freed, keep the collector from
+    # touching them so the shared pages are not copied into every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+
+    # Split the cores between workers instead of oversubscribing them
+    torch.set_num_threads(int(os.environ.get("TORCH_THREADS_PER_WORKER",
+                                             max(1, (os.cpu_count() or 1) // workers))))
+
+    if preload_app:
+        import app
+
+        # Warm up with this worker's threads before it accepts requests
+        app.warm_up_worker()
+
+
+def child_exit(server, worker):
+    from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+
+    GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
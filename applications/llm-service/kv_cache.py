@@ -0,0 +1,74 @@
+"""
+Helpers for manipulating past_key_values outside of model.generate
+
+Caches are handled in the legacy layout, a tuple with one (key, value) pair
+per layer where each tensor is shaped (batch, heads, sequence, head_dim).
+Newer transformers releases return Cache objects instead, so conversion
+helpers are provided for both directions.
+"""
+
+import torch
+
+
+def to_legacy_cache(past_key_values):
+    """Return past_key_values as a tuple of (key, value) pairs per layer"""
+    if past_key_values is None or isinstance(past_key_values, tuple):
+        return past_key_values
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+
+
+def from_legacy_cache(past):
+    """Convert a legacy cache into whatever the installed transformers expects"""
+    if past is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        # Older releases take the tuple layout directly
+        return past
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(past)
+
+
+def cache_length(past):
+    """Number of positions held in a legacy cache"""
+    return past[0][0].shape[2]
+
+
+def pad_left(past, amount):
+    """Prepend zeroed positions to every layer of a legacy cache"""
+    if amount <= 0:
+        return past
+    padded = []
+    for key, value in past:
+        pad_shape = key.shape[:2] + (amount,) + key.shape[3:]
+        padding = key.new_zeros(pad_shape)
+        padded.append((torch.cat([padding, key], dim=2),
+                       torch.cat([padding, value], dim=2)))
+    return tuple(padded)
+
+
+def trim_left(past, amount):
+    """Drop the first positions from every layer of a legacy cache"""
+    if amount <= 0:
+        return past
+    return tuple((key[:, :, amount:], value[:, :, amount:]) for key, value in past)
+
+
+def select_rows(past, rows):
+    """Keep only the given batch rows of a legacy cache"""
+    index = torch.as_tensor(rows, dtype=torch.long, device=past[0][0].device)
+    return tuple((key.index_select(0, index), value.index_select(0, index))
+                 for key, value in past)
+
+
+def concat_rows(pasts):
+    """Stack legacy caches of equal length along the batch dimension"""
+    return tuple(
+        (torch.cat([p[i][0] for p in pasts], dim=0),
+         torch.cat([p[i][1] for p in pasts], dim=0))
+        for i in range(len(pasts[0]))
+    )
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Model loading for the LLM service
+
+Loads the tokenizer and model, preferring a local safetensors snapshot,
+which is memory-mapped rather than read and copied, over a download from
+the Hugging Face hub. Loading can run on a background thread so the server
+answers health checks right away and only reports ready once the model can
+serve. Each startup phase is timed and exported as a metric.
+
+Create a snapshot with:
+    python model_loader.py --model distilgpt2 --output-dir /app/model-snapshot
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+from prometheus_client import Gauge
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+# Code shared with the edge service, copied next to the app in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from llm_inference import StartupLoader, load_tokenizer
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "llm_startup_phase_seconds",
+    "Time spent in each phase of loading the model at startup",
+    ["phase"],
+)
+MODEL_READY = Gauge("llm_model_ready", "1 once the model is loaded and can serve requests")
+
+
+def is_snapshot(path):
+    """Whether path is a local directory holding a saved model"""
+    return bool(path) and os.path.isfile(os.path.join(path, "config.json"))
+
+
+def save_snapshot(model_name, output_dir):
+    """Save the tokenizer and model weights as a local safetensors snapshot"""
+    os.makedirs(output_dir, exist_ok=True)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    AutoModelForCausalLM.from_pretrained(model_name).save_pretrained(
+        output_dir, safe_serialization=True
+    )
+    logger.info(f"Saved snapshot of {model_name} to {output_dir}")
+
+
+class ModelLoader(StartupLoader):
+    """
+    Load a tokenizer and model, in the foreground or on a background thread
+
+    Args:
+        model_name: Hub name of the model, used when no snapshot is present
+        snapshot_dir: Local directory created by save_snapshot
+        on_loaded: Optional callable receiving (tokenizer, model) once both
+            are loaded, run as part of startup before the loader is ready.
+            It may return a replacement for the model, e.g. a quantized copy
+        warm_up: Optional callable run after on_loaded, before the loader is
+            ready. Its return value is kept as warmup_latency
+    """
+
+    def __init__(self, model_name, snapshot_dir=None, on_loaded=None, warm_up=None):
+        super().__init__(phase_gauge=STARTUP_PHASE_SECONDS, ready_gauge=MODEL_READY)
+        self.model_name = model_name
+        self.snapshot_dir = snapshot_dir
+        self.on_loaded = on_loaded
+        self.warm_up = warm_up
+        self.warmup_latency = None
+        self.tokenizer = None
+        self.model = None
+
+    @property
+    def source(self):
+        """Where the model is loaded from"""
+        return self.snapshot_dir if is_snapshot(self.snapshot_dir) else self.model_name
+
+    def run(self):
+        """Load the tokenizer and model, then set up and warm up"""
+        source = self.source
+        with self.phase("tokenizer"):
+            tokenizer = load_tokenizer(source)
+        with self.phase("model"):
+            model = AutoModelForCausalLM.from_pretrained(source)
+        if self.on_loaded is not None:
+            with self.phase("setup"):
+                model = self.on_loaded(tokenizer, model) or model
+        if self.warm_up is not None:
+            with self.phase("warmup"):
+                self.warmup_latency = self.warm_up()
+        self.tokenizer, self.model = tokenizer, model
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Save a local model snapshot for fast startup")
+    parser.add_argument("--model", type=str, default="distilgpt2", help="Model name or path")
+    parser.add_argument("--output-dir", type=str, required=True, help="Directory to write the snapshot to")
+
+    args = parser.parse_args()
+    save_snapshot(args.model, args.output_dir)
@@ -10,6 +10,7 @@ import logging
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from pathlib import Path
+from kv_cache import from_legacy_cache, to_legacy_cache
 
 # Configure logging
 logging.basicConfig(
@@ -88,14 +89,14 @@ def convert_to_onnx(model_name, output_dir, quantize=False):
     if quantize:
         try:
             import onnxruntime as ort
-            from onnxruntime.quantization import quantize_dynamic
+            from onnxruntime.quantization import QuantType, quantize_dynamic
             
             logger.info("Quantizing the model...")
             quantized_output_path = os.path.join(output_dir, "model_quantized.onnx")
             quantize_dynamic(
                 output_path,
                 quantized_output_path,
-                weight_type=torch.qint8
+                weight_type=QuantType.QInt8
             )
             logger.info("Model quantized successfully!")
         except ImportError:
@@ -155,6 +156,113 @@ instance_group [
     tokenizer.save_pretrained(tokenizer_path)
     logger.info(f"Tokenizer saved to: {tokenizer_path}")
 
+def convert_to_onnx_with_past(model_name, output_dir, quantize=False):
+    """
+    Export a decoder that takes and returns past key/values
+
+    The exported graph accepts the newest tokens plus the cached keys and
+    values of every layer, so each decoding step only processes one token.
+    
+    Args:
+        model_name: Name or path of the Hugging Face model
+        output_dir: Directory to save the ONNX model
+        quantize: Whether to also write an INT8 copy for the onnx backend
+    """
+    logger.info(f"Loading model for export with past key values: {model_name}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    
+    # Fix: Set padding token
+    tokenizer.pad_token = tokenizer.eos_token
+    model.config.pad_token_id = tokenizer.eos_token_id
+    
+    # Keep past key values so they become graph inputs and outputs
+    model.config.use_cache = True
+    model.eval()
+    
+    num_layers = model.config.num_hidden_layers
+    num_heads = model.config.num_attention_heads
+    head_dim = model.config.hidden_size // num_heads
+    
+    # Dummy step with a non-empty cache so no axis is traced as a constant
+    past_length = 4
+    input_ids = torch.tensor([[tokenizer.eos_token_id] * 2])
+    attention_mask = torch.ones(1, past_length + 2, dtype=torch.long)
+    position_ids = torch.arange(past_length, past_length + 2).unsqueeze(0)
+    past = [torch.zeros(1, num_heads, past_length, head_dim)
+            for _ in range(2 * num_layers)]
+    
+    past_names = []
+    present_names = []
+    for i in range(num_layers):
+        past_names += [f"past_key_values.{i}.key", f"past_key_values.{i}.value"]
+        present_names += [f"present.{i}.key", f"present.{i}.value"]
+    
+    dynamic_axes = {
+        'input_ids': {0: 'batch_size', 1: 'sequence'},
+        'attention_mask': {0: 'batch_size', 1: 'total_sequence'},
+        'position_ids': {0: 'batch_size', 1: 'sequence'},
+        'logits': {0: 'batch_size', 1: 'sequence'},
+    }
+    for name in past_names:
+        dynamic_axes[name] = {0: 'batch_size', 2: 'past_sequence'}
+    for name in present_names:
+        dynamic_axes[name] = {0: 'batch_size', 2: 'total_sequence'}
+    
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, "model_with_past.onnx")
+    logger.info(f"Exporting model with past key values to {output_path}...")
+    
+    class DecoderWithPast(torch.nn.Module):
+        """Flatten past key/values into positional inputs and outputs"""
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+        
+        def forward(self, input_ids, attention_mask, position_ids, *past_flat):
+            past_key_values = tuple((past_flat[2 * i], past_flat[2 * i + 1])
+                                    for i in range(num_layers))
+            outputs = self.model(input_ids=input_ids,
+                                 attention_mask=attention_mask,
+                                 position_ids=position_ids,
+                                 past_key_values=from_legacy_cache(past_key_values),
+                                 use_cache=True)
+            present = to_legacy_cache(outputs.past_key_values)
+            return (outputs.logits,) + tuple(t for pair in present for t in pair)
+    
+    torch.onnx.export(
+        DecoderWithPast(model),
+        (input_ids, attention_mask, position_ids, *past),
+        output_path,
+        input_names=['input_ids', 'attention_mask', 'position_ids'] + past_names,
+        output_names=['logits'] + present_names,
+        dynamic_axes=dynamic_axes,
+        do_constant_folding=True,
+        opset_version=14
+    )
+    
+    logger.info("Model with past key values exported to ONNX format successfully!")
+    
+    if quantize:
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            
+            quantized_output_path = os.path.join(output_dir, "model_with_past_quantized.onnx")
+            logger.info(f"Quantizing the model with past key values to {quantized_output_path}...")
+            quantize_dynamic(
+                output_path,
+                quantized_output_path,
+                weight_type=QuantType.QInt8
+            )
+            logger.info("Model with past key values quantized successfully!")
+        except ImportError:
+            logger.error("Warning: onnxruntime not installed. Skipping quantization.")
+    
+    # Save tokenizer alongside the model
+    tokenizer_path = os.path.join(output_dir, "tokenizer")
+    tokenizer.save_pretrained(tokenizer_path)
+    logger.info(f"Tokenizer saved to: {tokenizer_path}")
+
 def optimize_with_tensorrt(onnx_model_path, output_dir):
     """
     Optimize an ONNX model with TensorRT
@@ -201,13 +309,21 @@ def optimize_with_tensorrt(onnx_model_path, output_dir):
     except ImportError:
         logger.error("TensorRT is required for optimization. Please install TensorRT.")
 
-def create_tensorflow_lite_model(model_name, output_dir):
+def create_tensorflow_lite_model(model_name, output_dir, batch_size=1, lengths=(64, 128, 256)):
     """
-    Create a TensorFlow Lite model for edge deployment
+    Create TensorFlow Lite models for edge deployment
+    
+    One model is written per sequence length bucket, as model_{length}.tflite,
+    with a fixed [batch_size, length] input shape. The interpreter then
+    allocates its tensors once at load instead of resizing them as the
+    sequence grows, and the edge service right pads each step to the
+    smallest bucket that fits.
     
     Args:
         model_name: Name or path of the Hugging Face model
-        output_dir: Directory to save the TFLite model
+        output_dir: Directory to save the TFLite models
+        batch_size: Number of sequences decoded together
+        lengths: Sequence length buckets
     """
     try:
         import tensorflow as tf
@@ -218,34 +334,33 @@ def create_tensorflow_lite_model(model_name, output_dir):
         # Load model with TensorFlow
         tokenizer = AutoTokenizer.from_pretrained(model_name)
         model = TFAutoModelForCausalLM.from_pretrained(model_name, from_pt=True)
-        
-        # Create a concrete function
-        @tf.function(input_signature=[
-            tf.TensorSpec([1, None], tf.int32, name="input_ids"),
-            tf.TensorSpec([1, None], tf.int32, name="attention_mask")
-        ])
-        def serving_fn(input_ids, attention_mask):
-            return model(input_ids=input_ids, attention_mask=attention_mask)
-        
-        # Get the concrete function
-        concrete_func = serving_fn.get_concrete_function()
-        
-        # Convert to TensorFlow Lite model
-        converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete_func])
-        converter.optimizations = [tf.lite.Optimize.DEFAULT]
-        tflite_model = converter.convert()
-        
-        # Save the TFLite model
         os.makedirs(output_dir, exist_ok=True)
-        tflite_path = os.path.join(output_dir, "model.tflite")
-        with open(tflite_path, "wb") as f:
-            f.write(tflite_model)
+        
+        for length in lengths:
+            # Create a concrete function with a fixed input shape
+            @tf.function(input_signature=[
+                tf.TensorSpec([batch_size, length], tf.int32, name="input_ids"),
+                tf.TensorSpec([batch_size, length], tf.int32, name="attention_mask"),
+                tf.TensorSpec([batch_size, length], tf.int32, name="position_ids")
+            ])
+            def serving_fn(input_ids, attention_mask, position_ids):
+                return {"logits": model(input_ids=input_ids, attention_mask=attention_mask,
+                                        position_ids=position_ids).logits}
+            
+            # Convert to TensorFlow Lite model
+            converter = tf.lite.TFLiteConverter.from_concrete_functions([serving_fn.get_concrete_function()])
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            tflite_model = converter.convert()
+            
+            # Save the TFLite model
+            tflite_path = os.path.join(output_dir, f"model_{length}.tflite")
+            with open(tflite_path, "wb") as f:
+                f.write(tflite_model)
+            logger.info(f"TensorFlow Lite model for {batch_size}x{length} tokens saved to: {tflite_path}")
         
         # Save tokenizer for later use
         tokenizer_path = os.path.join(output_dir, "tokenizer")
         tokenizer.save_pretrained(tokenizer_path)
-        
-        logger.info(f"TensorFlow Lite model saved to: {tflite_path}")
         logger.info(f"Tokenizer saved to: {tokenizer_path}")
         
     except ImportError:
@@ -257,13 +372,20 @@ if __name__ == "__main__":
     parser.add_argument("--output-dir", type=str, default="optimized_models", help="Output directory for optimized models")
     parser.add_argument("--quantize", action="store_true", help="Quantize the ONNX model to INT8")
     parser.add_argument("--tensorrt", action="store_true", help="Optimize with TensorRT")
+    parser.add_argument("--with-past", action="store_true", help="Also export an ONNX model with past key values for incremental decoding")
     parser.add_argument("--tflite", action="store_true", help="Create TensorFlow Lite model for edge deployment")
+    parser.add_argument("--tflite-batch-size", type=int, default=1, help="Batch size of the TensorFlow Lite models")
+    parser.add_argument("--tflite-lengths", type=str, default="64,128,256", help="Comma separated sequence length buckets of the TensorFlow Lite models")
     
     args = parser.parse_args()
     
     # Convert to ONNX
     convert_to_onnx(args.model, args.output_dir, args.quantize)
     
+    # Export the incremental decoding variant if requested
+    if args.with_past:
+        convert_to_onnx_with_past(args.model, args.output_dir, args.quantize)
+    
     # Optimize with TensorRT if requested
     if args.tensorrt:
         onnx_path = os.path.join(args.output_dir, "model.onnx")
@@ -274,4 +396,6 @@ if __name__ == "__main__":
     # Create TensorFlow Lite model if requested
     if args.tflite:
         tflite_dir = os.path.join(args.output_dir, "tflite")
-        create_tensorflow_lite_model(args.model, tflite_dir) 
\ No newline at end of file
+        lengths = sorted({int(v) for v in args.tflite_lengths.split(",") if v.strip()})
+        create_tensorflow_lite_model(args.model, tflite_dir, batch_size=args.tflite_batch_size,
+                                     lengths=lengths) 
\ No newline at end of file
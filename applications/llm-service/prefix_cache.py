@@ -0,0 +1,148 @@
+"""
+Prompt-prefix key/value cache for the LLM service
+
+Keys and values computed while prefilling a prompt are kept in a trie keyed
+by token ids. Because attention is causal, the cache of a stored prompt is
+also valid for every prefix of it, so a new prompt can resume from the
+longest prefix it shares with any stored prompt and only prefill the rest.
+Entries are evicted least recently used first to stay within a byte budget.
+"""
+
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Gauge, Histogram
+
+PREFILL_TOKENS_SAVED = Histogram(
+    "llm_prefill_tokens_saved",
+    "Prompt tokens per request whose prefill was skipped using the prefix cache",
+    buckets=(0, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+PREFIX_CACHE_BYTES = Gauge(
+    "llm_prefix_cache_bytes",
+    "Bytes of key/value tensors held by the prefix cache",
+)
+
+
+class _Node:
+    __slots__ = ("children", "entry", "terminal")
+
+    def __init__(self):
+        self.children = {}
+        # Any stored entry whose tokens pass through this node
+        self.entry = None
+        # The stored entry whose tokens end at this node, if any
+        self.terminal = None
+
+
+class _Entry:
+    __slots__ = ("token_ids", "past", "nbytes")
+
+    def __init__(self, token_ids, past):
+        self.token_ids = token_ids
+        self.past = past
+        self.nbytes = sum(k.element_size() * k.nelement() + v.element_size() * v.nelement()
+                          for k, v in past)
+
+
+class PrefixCache:
+    """
+    Trie of prompt key/value caches
+
+    Args:
+        max_bytes: Budget for all stored key/value tensors
+        min_tokens: Shortest prefix worth storing or resuming from
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, min_tokens=8):
+        self.max_bytes = max_bytes
+        self.min_tokens = max(1, min_tokens)
+        self.hits = 0
+        self.misses = 0
+        self._root = _Node()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, token_ids):
+        """
+        Find the longest cached prefix of token_ids
+
+        At least one token is always left uncached so the caller still runs
+        the model to get logits for the next position.
+
+        Returns:
+            Tuple of (prefix length, legacy cache for that prefix), or
+            (0, None) when no usable prefix is stored
+        """
+        limit = len(token_ids) - 1
+        with self._lock:
+            node, depth, entry = self._root, 0, None
+            while depth < limit:
+                child = node.children.get(token_ids[depth])
+                if child is None:
+                    break
+                # Prefer a prompt ending exactly here, its cache needs no slicing
+                node, depth, entry = child, depth + 1, child.terminal or child.entry
+            if entry is None or depth < self.min_tokens:
+                self.misses += 1
+                PREFILL_TOKENS_SAVED.observe(0)
+                return 0, None
+            self.hits += 1
+            self._entries.move_to_end(entry.token_ids)
+            past = tuple((k[:, :, :depth], v[:, :, :depth]) for k, v in entry.past)
+        PREFILL_TOKENS_SAVED.observe(depth)
+        return depth, past
+
+    def insert(self, token_ids, past):
+        """
+        Store the cache of a prompt
+
+        Args:
+            token_ids: Prompt token ids
+            past: Legacy cache of batch size one covering exactly token_ids
+        """
+        token_ids = tuple(token_ids)
+        if len(token_ids) < self.min_tokens:
+            return
+        with self._lock:
+            if token_ids in self._entries:
+                self._entries.move_to_end(token_ids)
+                return
+            entry = _Entry(token_ids, past)
+            if entry.nbytes > self.max_bytes:
+                return
+
+            node = self._root
+            for token in token_ids:
+                node = node.children.setdefault(token, _Node())
+                node.entry = entry
+            node.terminal = entry
+            self._entries[token_ids] = entry
+            self._bytes += entry.nbytes
+
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries.values())))
+            PREFIX_CACHE_BYTES.set(self._bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, entry):
+        del self._entries[entry.token_ids]
+        self._bytes -= entry.nbytes
+
+        # Walk the entry's path, then repair it from the deepest node up so
+        # every node points at an entry still stored below it
+        path = [self._root]
+        for token in entry.token_ids:
+            path.append(path[-1].children[token])
+        path[-1].terminal = None
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.entry is entry:
+                node.entry = node.terminal or next(
+                    (child.entry for child in node.children.values()), None
+                )
+            if node.entry is None:
+                del path[depth - 1].children[entry.token_ids[depth - 1]]
@@ -0,0 +1,139 @@
+"""
+Request coalescing for the LLM service
+
+Concurrent callers asking for the same key share a single in-progress call
+instead of each running it, so a burst of identical prompts costs one
+generation.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from prometheus_client import Counter
+
+COALESCED_REQUESTS = Counter(
+    "llm_coalesced_requests",
+    "Requests served by waiting on an identical in-flight generation",
+)
+
+
+class CoalescedCallCancelled(Exception):
+    """Set on a shared call whose caller was cancelled, its waiters run it again"""
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None, retry_on=()):
+        """
+        Call fn unless a call for key is already running, then wait for it
+
+        Args:
+            key: Calls with equal keys are shared
+            fn: Called without arguments by the caller that runs the call
+            timeout: Longest time in seconds to wait for another caller's
+                call, None to wait until it finishes
+            retry_on: Exceptions of another caller's call that are not
+                shared, e.g. because they are about that caller's request.
+                The call is made again instead, as it is when that caller
+                was cancelled
+
+        Returns:
+            Tuple of (result, shared) where shared is True when the result
+            came from another caller's call
+
+        Raises:
+            concurrent.futures.TimeoutError: If another caller's call did
+                not finish within timeout
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        joined = False
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            if not joined:
+                # Count each waiting caller once however often it retries
+                joined = True
+                COALESCED_REQUESTS.inc()
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            try:
+                return future.result(timeout=remaining), True
+            except FutureTimeoutError:
+                raise
+            except (CoalescedCallCancelled, *retry_on):
+                continue
+
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+    async def do_async(self, key, fn, timeout=None, retry_on=()):
+        """
+        Coroutine version of do for callers running on an event loop
+
+        fn is called without arguments and must return an awaitable. Waiting
+        callers are suspended on the loop instead of blocking a thread, and
+        they share keys with callers of do.
+
+        Raises:
+            asyncio.TimeoutError: If another caller's call did not finish
+                within timeout
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        joined = False
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            if not joined:
+                # Count each waiting caller once however often it retries
+                joined = True
+                COALESCED_REQUESTS.inc()
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            try:
+                # Shielded, timing out must not cancel the shared call
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), remaining), True
+            except asyncio.TimeoutError:
+                raise
+            except (CoalescedCallCancelled, *retry_on):
+                continue
+
+        try:
+            future.set_result(await fn())
+        except asyncio.CancelledError:
+            # Don't leave the callers sharing this call waiting forever
+            future.set_exception(CoalescedCallCancelled(f"Call for {key!r} was cancelled"))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+    def _join(self, key):
+        """Future of the call running for key and whether the caller has to run it"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def in_flight(self):
+        """Number of keys with a call currently running"""
+        with self._lock:
+            return len(self._calls)
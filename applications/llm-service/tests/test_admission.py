@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the budget
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import (BudgetExceededError, RateLimitedError, RequestTooLargeError, TenantRateLimiter,
+                       TokenBudget, parse_priority_classes)
+
+def admission_order(budget, requests):
+    """Queue 60 token requests behind a full budget and return their tenants in admission order"""
+    budget.acquire(budget.max_tokens, tenant="holder")
+    admitted = []
+    
+    def acquire(tenant, priority):
+        budget.acquire(60, tenant=tenant, priority=priority)
+        admitted.append(tenant)
+    
+    waiters = []
+    for tenant, priority in requests:
+        waiters.append(threading.Thread(target=acquire, args=(tenant, priority)))
+        waiters[-1].start()
+        while len(budget._waiting) < len(waiters):
+            threading.Event().wait(0.01)
+    
+    # Only one request fits at a time, so each release admits the next one
+    budget.release(budget.max_tokens)
+    for count in range(1, len(requests) + 1):
+        while len(admitted) < count:
+            threading.Event().wait(0.01)
+        budget.release(60)
+    for waiter in waiters:
+        waiter.join(5)
+    return admitted
+
+class TestTokenBudget(unittest.TestCase):
+    def test_rejects_requests_larger_than_the_budget(self):
+        """Test that a request that can never fit is rejected without waiting"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5)
+        
+        with self.assertRaises(RequestTooLargeError):
+            budget.acquire(101)
+        self.assertEqual(budget.in_use, 0)
+        
+    def test_rejects_when_budget_does_not_free_up(self):
+        """Test that a request waits at most max_wait_seconds for budget"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=0.05)
+        budget.acquire(80)
+        
+        with self.assertRaises(BudgetExceededError):
+            budget.acquire(30)
+        budget.acquire(20)
+        self.assertEqual(budget.in_use, 100)
+        
+    def test_waiting_request_is_admitted_on_release(self):
+        """Test that a queued request is admitted once tokens are released"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5)
+        budget.acquire(80)
+        admitted = threading.Event()
+        
+        def acquire():
+            budget.acquire(50)
+            admitted.set()
+        
+        waiter = threading.Thread(target=acquire)
+        waiter.start()
+        self.assertFalse(admitted.wait(0.05))
+        budget.release(80)
+        
+        self.assertTrue(admitted.wait(5))
+        waiter.join()
+        self.assertEqual(budget.in_use, 50)
+        
+    def test_small_requests_do_not_overtake_a_waiting_one(self):
+        """Test that budget is handed out in arrival order"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5)
+        budget.acquire(60)
+        waiter = threading.Thread(target=budget.acquire, args=(90,))
+        waiter.start()
+        while not budget._waiting:
+            threading.Event().wait(0.01)
+        
+        budget.max_wait = 0.05
+        with self.assertRaises(BudgetExceededError):
+            budget.acquire(10)
+        budget.release(60)
+        waiter.join(5)
+        self.assertEqual(budget.in_use, 90)
+
+    def test_tenants_are_served_fairly(self):
+        """Test that a tenant's burst does not queue ahead of other tenants"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5)
+        requests = [("flood", None)] * 3 + [("quiet", None)]
+        
+        self.assertEqual(admission_order(budget, requests), ["flood", "quiet", "flood", "flood"])
+        
+    def test_priority_classes_weight_the_order(self):
+        """Test that requests of a heavier class get their turn sooner"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5,
+                             priority_classes={"interactive": 4, "batch": 1}, default_priority="batch")
+        requests = [("a", "batch")] * 2 + [("b", "interactive")] * 2
+        
+        self.assertEqual(admission_order(budget, requests), ["b", "b", "a", "a"])
+        with self.assertRaises(ValueError):
+            budget.acquire(10, priority="urgent")
+        
+    def test_async_waiter_is_admitted_on_release(self):
+        """Test that a coroutine waits on the loop and is woken by a release from another thread"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=5)
+        budget.acquire(80)
+        
+        async def run():
+            waiter = asyncio.ensure_future(budget.acquire_async(50))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            threading.Timer(0.01, budget.release, args=(80,)).start()
+            await asyncio.wait_for(waiter, 5)
+        
+        asyncio.run(run())
+        self.assertEqual(budget.in_use, 50)
+        self.assertEqual(budget._waiting, [])
+        
+    def test_async_waiter_times_out(self):
+        """Test that a coroutine waits at most max_wait_seconds for budget"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=0.05)
+        budget.acquire(80)
+        
+        with self.assertRaises(BudgetExceededError):
+            asyncio.run(budget.acquire_async(30))
+        self.assertEqual(budget._waiting, [])
+        
+    def test_rejected_request_keeps_no_finish_time(self):
+        """Test that a request that gave up does not push back its tenant's next one"""
+        budget = TokenBudget(max_tokens=100, max_wait_seconds=0.05)
+        budget.acquire(80, tenant="a")
+        finish_time = budget._finish_times["a"]
+        
+        with self.assertRaises(BudgetExceededError):
+            budget.acquire(30, tenant="a")
+        with self.assertRaises(BudgetExceededError):
+            asyncio.run(budget.acquire_async(30, tenant="b"))
+        self.assertEqual(budget._finish_times, {"a": finish_time})
+        
+    def test_parse_priority_classes(self):
+        """Test that weights default to 1 and must be positive"""
+        self.assertEqual(parse_priority_classes("interactive:4, batch"), {"interactive": 4.0, "batch": 1.0})
+        with self.assertRaises(ValueError):
+            parse_priority_classes("batch:0")
+
+class TestTenantRateLimiter(unittest.TestCase):
+    def test_limits_each_tenant_separately(self):
+        """Test that a tenant over its rate is rejected with a Retry-After hint"""
+        limiter = TenantRateLimiter(tokens_per_second=10, burst_tokens=50)
+        limiter.acquire("a", 40)
+        
+        with self.assertRaises(RateLimitedError) as raised:
+            limiter.acquire("a", 20)
+        self.assertEqual(raised.exception.retry_after, 1)
+        limiter.acquire("b", 50)
+        
+    def test_large_request_leaves_bucket_in_debt(self):
+        """Test that a request larger than the bucket runs once and is paid back"""
+        limiter = TenantRateLimiter(tokens_per_second=10, burst_tokens=50)
+        limiter.acquire("a", 200)
+        
+        with self.assertRaises(RateLimitedError) as raised:
+            limiter.acquire("a", 1)
+        self.assertGreater(raised.exception.retry_after, 10)
+        
+    def test_refund_returns_tokens_up_to_the_burst(self):
+        """Test that refunded tokens can be spent again but do not overfill the bucket"""
+        limiter = TenantRateLimiter(tokens_per_second=10, burst_tokens=50)
+        limiter.acquire("a", 40)
+        limiter.refund("a", 40)
+        limiter.acquire("a", 50)
+        limiter.refund("a", 500)
+        limiter.acquire("a", 50)
+        
+        with self.assertRaises(RateLimitedError):
+            limiter.acquire("a", 10)
+
+if __name__ == '__main__':
+    unittest.main()
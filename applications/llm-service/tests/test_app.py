@@ -7,7 +7,10 @@ import os
 # Add the parent directory to the path so we can import the app
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
+from app import app, max_new_tokens_limit, max_prompt_tokens, plan_generation
+from admission import BudgetExceededError, TenantRateLimiter
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from executor import QueueFullError
 
 class TestLLMService(unittest.TestCase):
     def setUp(self):
@@ -22,6 +25,34 @@ class TestLLMService(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['status'], 'healthy')
         
+    def test_readiness_check(self):
+        """Test the readiness endpoint reports startup phase timings"""
+        response = self.app.get('/ready')
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'ready')
+        self.assertIn('model', data['startup_phases'])
+        self.assertIn('warmup', data['startup_phases'])
+        self.assertIn('16', data['warmup_latency'])
+        
+    @patch('app.model_loader')
+    def test_generate_while_loading(self, mock_loader):
+        """Test that requests are refused until the model has loaded"""
+        mock_loader.ready = False
+        mock_loader.status = "starting"
+        mock_loader.timings = {}
+        mock_loader.warmup_latency = None
+        
+        health = self.app.get('/health')
+        response = self.app.post('/generate', json={'prompt': 'Hello, how are you?'})
+        
+        self.assertEqual(health.status_code, 200)
+        self.assertEqual(json.loads(health.data)['status'], 'starting')
+        self.assertEqual(self.app.get('/ready').status_code, 503)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data)['model_status'], 'starting')
+        
     def test_model_info(self):
         """Test the model info endpoint"""
         response = self.app.get('/model-info')
@@ -60,6 +91,165 @@ class TestLLMService(unittest.TestCase):
         self.assertIn('model', data)
         self.assertEqual(data['status'], 'success')
         
+    @patch('app.model')
+    @patch('app.tokenizer')
+    def test_generate_caches_seeded_requests(self, mock_tokenizer, mock_model):
+        """Test that only requests pinning a seed are served from the cache"""
+        mock_tokenizer.return_value = {
+            "input_ids": MagicMock(),
+            "attention_mask": MagicMock()
+        }
+        mock_model.generate.return_value = [MagicMock()]
+        mock_tokenizer.decode.return_value = "This is a generated response."
+        
+        request_data = {
+            'prompt': 'Is this cached?',
+            'max_length': 50
+        }
+        self.app.post('/generate', json=request_data)
+        response = self.app.post('/generate', json=request_data)
+        self.assertFalse(json.loads(response.data)['cached'])
+        
+        request_data['seed'] = 42
+        self.app.post('/generate', json=request_data)
+        response = self.app.post('/generate', json=request_data)
+        self.assertTrue(json.loads(response.data)['cached'])
+        
+    @patch('app.inference_executor')
+    def test_generate_queue_full(self, mock_executor):
+        """Test that a full inference queue answers 429 with Retry-After"""
+        mock_executor.submit.side_effect = QueueFullError("Inference queue is full")
+        
+        response = self.app.post('/generate', json={'prompt': 'Hello, how are you?'})
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(data['status'], 'error')
+        
+    def test_generate_rejects_oversized_prompt(self):
+        """Test that a prompt over the token limit is rejected, not truncated"""
+        response = self.app.post('/generate', json={'prompt': 'test ' * 5000, 'max_length': 100})
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('the limit is', data['error'])
+        
+    @patch('app.token_budget.acquire')
+    def test_generate_budget_exhausted(self, mock_acquire):
+        """Test that a request finding no token budget answers 429"""
+        mock_acquire.side_effect = BudgetExceededError("Token budget is exhausted")
+        
+        response = self.app.post('/generate', json={'prompt': 'Hello', 'max_new_tokens': 10})
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        
+    @patch('app.tenant_rate_limiter', TenantRateLimiter(tokens_per_second=1, burst_tokens=100))
+    @patch('app.token_budget.acquire')
+    def test_generate_tenant_rate_limited(self, mock_acquire):
+        """Test that a tenant over its token rate answers 429 while others are admitted"""
+        import app as service
+        
+        mock_acquire.side_effect = BudgetExceededError("Token budget is exhausted")
+        request_data = {'prompt': 'Hello', 'max_new_tokens': 60}
+        
+        # Tokens of requests the budget turns away are refunded
+        first = self.app.post('/generate', json=request_data, headers={'X-API-Key': 'flood'})
+        second = self.app.post('/generate', json=request_data, headers={'X-API-Key': 'flood'})
+        service.tenant_rate_limiter.acquire('key:flood', 100)
+        limited = self.app.post('/generate', json=request_data, headers={'X-API-Key': 'flood'})
+        other = self.app.post('/generate', json=request_data, headers={'X-API-Key': 'other'})
+        
+        self.assertEqual([first.headers['Retry-After'], second.headers['Retry-After']], ['1', '1'])
+        self.assertEqual(limited.status_code, 429)
+        self.assertGreater(int(limited.headers['Retry-After']), 1)
+        self.assertEqual(other.headers['Retry-After'], '1')
+        self.assertEqual([c.kwargs['tenant'] for c in mock_acquire.call_args_list],
+                         ['key:flood', 'key:flood', 'key:other'])
+        
+    def test_generate_unknown_priority(self):
+        """Test that an unknown priority class is rejected"""
+        response = self.app.post('/generate', json={'prompt': 'Hello'}, headers={'X-Priority': 'urgent'})
+        
+        self.assertEqual(response.status_code, 400)
+        
+    def test_seeded_output_does_not_depend_on_batching(self):
+        """Test that a seeded request gives the same text alone and next to another one"""
+        import app as service
+        
+        alone = service.batch_scheduler.generate('Hello', max_new_tokens=8, seed=3, timeout=30)
+        futures = [service.batch_scheduler.submit('Hello', max_new_tokens=8, seed=3) for _ in range(2)]
+        
+        self.assertEqual([f.result(timeout=30) for f in futures], [alone, alone])
+        
+    def test_generate_max_new_tokens(self):
+        """Test that max_new_tokens is charged on top of the whole prompt"""
+        prompt = 'one two three four five six seven eight'
+        params, cost = plan_generation({'prompt': prompt, 'max_length': None,
+                                        'max_new_tokens': 4, 'seed': None})
+        prompt_tokens = cost - 4
+        legacy_params, legacy_cost = plan_generation({'prompt': prompt, 'max_length': prompt_tokens + 3,
+                                                      'max_new_tokens': None, 'seed': None})
+        
+        self.assertEqual(params, {'max_new_tokens': 4})
+        self.assertEqual(legacy_params, {'max_new_tokens': 3})
+        self.assertEqual(legacy_cost, prompt_tokens + 3)
+        response = self.app.post('/generate', json={'prompt': prompt, 'max_new_tokens': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['generated_text'].startswith(prompt))
+        
+    def test_max_length_is_capped_by_max_new_tokens(self):
+        """Test that a short prompt with a long max_length generates at most MAX_NEW_TOKENS"""
+        params, cost = plan_generation({'prompt': 'Hi', 'max_length': 1024,
+                                        'max_new_tokens': None, 'seed': None})
+        
+        self.assertEqual(params, {'max_new_tokens': max_new_tokens_limit})
+        self.assertLessEqual(cost, max_prompt_tokens + max_new_tokens_limit)
+        
+    @patch('app.circuit_breaker')
+    def test_generate_circuit_open(self, mock_breaker):
+        """Test that an open circuit answers 503 with the breaker's Retry-After"""
+        mock_breaker.call.side_effect = CircuitOpenError("Service temporarily unavailable", 7)
+        mock_breaker.state = "open"
+        
+        response = self.app.post('/generate', json={'prompt': 'Hello', 'max_new_tokens': 10})
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '7')
+        self.assertTrue(data['circuit_open'])
+        self.assertEqual(data['circuit_state'], 'open')
+        
+    @patch('app.model')
+    def test_generate_deadline_exceeded(self, mock_model):
+        """Test that a request past its deadline answers 504 without generating"""
+        response = self.app.post('/generate', json={'prompt': 'Hello', 'max_new_tokens': 10},
+                                 headers={'X-Request-Timeout': '0.001'})
+        
+        self.assertEqual(response.status_code, 504)
+        mock_model.generate.assert_not_called()
+        
+        response = self.app.post('/generate', json={'prompt': 'Hello'},
+                                 headers={'X-Request-Timeout': 'soon'})
+        self.assertEqual(response.status_code, 400)
+        
+    @patch('app.model')
+    def test_only_server_deadlines_count_against_the_circuit(self, mock_model):
+        """Test that missing the default deadline is a failure, unlike a timeout the client picked"""
+        import app as service
+        
+        breaker = CircuitBreaker(failure_threshold=5, ignored_exceptions=service.circuit_breaker.ignored_exceptions)
+        with patch('app.circuit_breaker', breaker):
+            client = self.app.post('/generate', json={'prompt': 'Hello', 'max_new_tokens': 10},
+                                   headers={'X-Request-Timeout': '0.001'})
+            self.assertEqual(breaker.failures, 0)
+            with patch('app.default_request_timeout', 0.001):
+                server = self.app.post('/generate', json={'prompt': 'Hello', 'max_new_tokens': 10})
+        
+        self.assertEqual([client.status_code, server.status_code], [504, 504])
+        self.assertEqual(breaker.failures, 1)
+        
     def test_generate_text_missing_prompt(self):
         """Test the text generation endpoint with missing prompt"""
         # Test request with missing prompt
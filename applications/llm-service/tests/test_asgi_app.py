@@ -0,0 +1,157 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asgi_app import app
+from executor import QueueFullError
+from admission import RequestTooLargeError
+
+def call(method, path, body=None, headers=None, disconnect=False):
+    """
+    Run one request through the ASGI app and return (status, headers, body)
+
+    The client stays connected until the response is complete, unless
+    disconnect is set, then it goes away right after sending the body.
+    """
+    scope = {"type": "http", "method": method, "path": path,
+             "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+    request = json.dumps(body).encode() if body is not None else b""
+    received = [{"type": "http.request", "body": request, "more_body": False}]
+    sent = []
+
+    async def run():
+        complete = asyncio.Event()
+
+        async def receive():
+            if received:
+                return received.pop(0)
+            if not disconnect:
+                await complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                complete.set()
+
+        await app(scope, receive, send)
+
+    asyncio.run(run())
+    start = sent[0]
+    headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+class TestAsgiLLMService(unittest.TestCase):
+    def test_health_check(self):
+        """Test the health check endpoint"""
+        status, _, body = call("GET", "/health")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['status'], 'healthy')
+
+    def test_unknown_route(self):
+        """Test that unknown paths and methods are rejected"""
+        self.assertEqual(call("GET", "/missing")[0], 404)
+        self.assertEqual(call("GET", "/generate")[0], 405)
+
+    @patch('app.model')
+    @patch('app.tokenizer')
+    def test_generate_text(self, mock_tokenizer, mock_model):
+        """Test the text generation endpoint"""
+        mock_tokenizer.return_value = {
+            "input_ids": MagicMock(),
+            "attention_mask": MagicMock()
+        }
+        mock_model.generate.return_value = [MagicMock()]
+        mock_tokenizer.decode.return_value = "This is a generated response."
+
+        status, _, body = call("POST", "/generate", {'prompt': 'Hello, how are you?'})
+        data = json.loads(body)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['generated_text'], 'This is a generated response.')
+        self.assertEqual(data['status'], 'success')
+
+    @patch('app.model')
+    @patch('app.tokenizer')
+    def test_generate_stream(self, mock_tokenizer, mock_model):
+        """Test that a streamed request ends with the full text as an event"""
+        mock_tokenizer.return_value = {
+            "input_ids": MagicMock(),
+            "attention_mask": MagicMock()
+        }
+        mock_model.generate.return_value = [MagicMock()]
+        mock_tokenizer.decode.return_value = "This is a streamed response."
+
+        status, headers, body = call("POST", "/generate",
+                                     {'prompt': 'Stream this', 'stream': True})
+        events = [json.loads(line[len("data: "):])
+                  for line in body.decode().split("\n\n") if line]
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'text/event-stream')
+        self.assertTrue(events[-1]['done'])
+        self.assertEqual(events[-1]['generated_text'], 'This is a streamed response.')
+
+    @patch('app.inference_executor')
+    def test_generate_queue_full(self, mock_executor):
+        """Test that a full inference queue answers 429 with Retry-After"""
+        mock_executor.submit.side_effect = QueueFullError("Inference queue is full")
+
+        status, headers, _ = call("POST", "/generate", {'prompt': 'Hello, how are you?'})
+
+        self.assertEqual(status, 429)
+        self.assertEqual(headers['retry-after'], '1')
+
+    @patch('app.token_budget.acquire_async')
+    def test_generate_larger_than_budget(self, mock_acquire):
+        """Test that a request larger than the whole token budget answers 413"""
+        mock_acquire.side_effect = RequestTooLargeError("Request needs 20 tokens, the budget is 10")
+
+        status, _, body = call("POST", "/generate", {'prompt': 'Hello', 'max_new_tokens': 10})
+
+        self.assertEqual(status, 413)
+        self.assertEqual(json.loads(body)['status'], 'error')
+
+    @patch('app.model')
+    def test_generate_client_disconnect(self, mock_model):
+        """Test that a client disconnecting cancels its generation"""
+        status, _, _ = call("POST", "/generate", {'prompt': 'Hello', 'max_new_tokens': 10},
+                            disconnect=True)
+
+        self.assertEqual(status, 504)
+        mock_model.generate.assert_not_called()
+
+    @patch('app.batch_scheduler', None)
+    @patch('app.inference_executor')
+    def test_shutdown_before_model_loaded(self, mock_executor):
+        """Test that lifespan shutdown completes when the model never loaded"""
+        received = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+        
+        async def receive():
+            return received.pop(0)
+        
+        async def send(message):
+            sent.append(message["type"])
+        
+        asyncio.run(app({"type": "lifespan"}, receive, send))
+        
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        mock_executor.shutdown.assert_called_once()
+
+    def test_generate_text_missing_prompt(self):
+        """Test the text generation endpoint with missing prompt"""
+        status, _, body = call("POST", "/generate", {'max_length': 50})
+
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)['status'], 'error')
+
+if __name__ == '__main__':
+    unittest.main()
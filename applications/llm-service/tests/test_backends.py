@@ -0,0 +1,52 @@
+import copy
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoModelForCausalLM
+from backends import conv1d_to_linear, load_backend
+
+class TestBackends(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = AutoModelForCausalLM.from_pretrained("distilgpt2")
+        cls.input_ids = torch.tensor([[5, 17, 42, 8, 99]])
+        cls.attention_mask = torch.ones_like(cls.input_ids)
+        with torch.no_grad():
+            cls.logits = cls.model(input_ids=cls.input_ids, attention_mask=cls.attention_mask).logits
+
+    def logits_of(self, model):
+        with torch.no_grad():
+            return model(input_ids=self.input_ids, attention_mask=self.attention_mask).logits
+
+    def test_conv1d_to_linear_keeps_outputs(self):
+        """Test that replacing Conv1D with Linear does not change the logits"""
+        model = conv1d_to_linear(copy.deepcopy(self.model))
+
+        self.assertIsInstance(model.transformer.h[0].attn.c_attn, torch.nn.Linear)
+        self.assertTrue(torch.allclose(self.logits_of(model), self.logits, atol=1e-5))
+
+    def test_int8_backend_stays_close(self):
+        """Test that the INT8 backend quantizes the projections and stays close to FP32"""
+        model = load_backend("torch-int8", copy.deepcopy(self.model))
+        logits = self.logits_of(model)
+
+        self.assertIn("quantized", type(model.transformer.h[0].mlp.c_fc).__module__)
+        # Compare next-token distributions rather than raw logits, whose
+        # scale depends on the model
+        divergence = torch.nn.functional.kl_div(logits.log_softmax(-1), self.logits.log_softmax(-1),
+                                                log_target=True, reduction="none").sum(-1)
+        self.assertLess(divergence.max().item(), 0.01)
+        self.assertEqual(logits[0, -1].argmax().item(), self.logits[0, -1].argmax().item())
+
+    def test_unknown_backend(self):
+        """Test that an unknown backend name is rejected"""
+        with self.assertRaises(ValueError):
+            load_backend("tpu", self.model)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import threading
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the scheduler
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import BatchScheduler
+from deadlines import Deadline, RequestCancelled
+
+class TestBatchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def run_batch(self, prompts, **params):
+        with self.lock:
+            self.calls.append((list(prompts), params))
+        return [f"{prompt}!" for prompt in prompts]
+
+    def test_concurrent_requests_share_one_batch(self):
+        """Test that requests queued within the wait window are batched"""
+        scheduler = BatchScheduler(self.run_batch, max_batch_size=4, max_wait_ms=200)
+        futures = [scheduler.submit(f"p{i}", max_length=20) for i in range(4)]
+        results = [f.result(timeout=5) for f in futures]
+        scheduler.stop()
+
+        self.assertEqual(results, ["p0!", "p1!", "p2!", "p3!"])
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][1], {"max_length": 20})
+
+    def test_batches_respect_max_size(self):
+        """Test that a full queue is split into batches of max_batch_size"""
+        scheduler = BatchScheduler(self.run_batch, max_batch_size=2, max_wait_ms=200)
+        futures = [scheduler.submit(f"p{i}", max_length=20) for i in range(5)]
+        for f in futures:
+            f.result(timeout=5)
+        scheduler.stop()
+
+        self.assertTrue(all(len(prompts) <= 2 for prompts, _ in self.calls))
+        self.assertEqual(sum(len(prompts) for prompts, _ in self.calls), 5)
+
+    def test_different_params_are_not_mixed(self):
+        """Test that requests with different parameters run separately"""
+        scheduler = BatchScheduler(self.run_batch, max_batch_size=8, max_wait_ms=50)
+        a = scheduler.submit("a", max_length=20)
+        b = scheduler.submit("b", max_length=40)
+        self.assertEqual(a.result(timeout=5), "a!")
+        self.assertEqual(b.result(timeout=5), "b!")
+        scheduler.stop()
+
+        self.assertEqual(sorted(p["max_length"] for _, p in self.calls), [20, 40])
+
+    def test_errors_are_fanned_out(self):
+        """Test that a failing batch fails every waiting request"""
+        def failing_batch(prompts, **params):
+            raise ValueError("boom")
+
+        scheduler = BatchScheduler(failing_batch, max_batch_size=2, max_wait_ms=50)
+        futures = [scheduler.submit(p, max_length=20) for p in ("a", "b")]
+        for f in futures:
+            with self.assertRaises(ValueError):
+                f.result(timeout=5)
+        scheduler.stop()
+
+    def test_unbatched_params_run_alone(self):
+        """Test that requests setting an unbatched parameter never share a batch"""
+        scheduler = BatchScheduler(self.run_batch, max_batch_size=4, max_wait_ms=50,
+                                   unbatched_params=("seed",))
+        futures = [scheduler.submit(p, max_length=20, seed=1) for p in ("a", "b")]
+        futures += [scheduler.submit(p, max_length=20) for p in ("c", "d")]
+        for f in futures:
+            f.result(timeout=5)
+        scheduler.stop()
+
+        self.assertEqual(sorted(prompts for prompts, _ in self.calls), [["a"], ["b"], ["c", "d"]])
+
+    def test_expired_requests_are_dropped(self):
+        """Test that a request past its deadline fails without running"""
+        scheduler = BatchScheduler(self.run_batch, max_batch_size=4, max_wait_ms=50)
+        cancelled = Deadline()
+        cancelled.cancel()
+        expired = scheduler.submit("a", deadline=cancelled, max_length=20)
+        live = scheduler.submit("b", deadline=Deadline(30), max_length=20)
+
+        with self.assertRaises(RequestCancelled):
+            expired.result(timeout=5)
+        self.assertEqual(live.result(timeout=5), "b!")
+        scheduler.stop()
+
+        self.assertEqual([prompts for prompts, _ in self.calls], [["b"]])
+        self.assertEqual(len(self.calls[0][1]["deadlines"]), 1)
+
+class TestBatchStreamer(unittest.TestCase):
+    def test_rows_stop_at_budget_and_eos(self):
+        """Test that each row is forwarded until its budget or EOS"""
+        import torch
+        from batching import _BatchStreamer
+
+        received = [[], []]
+        streamer = _BatchStreamer([received[0].append, received[1].append], eos_token_id=0)
+        streamer.limit([1, 3])
+        streamer.put(torch.tensor([[5, 6], [7, 8]]))
+        for step in ([1, 2], [3, 0], [4, 9]):
+            streamer.put(torch.tensor(step))
+        streamer.end()
+
+        self.assertEqual(received, [[1], [2, 0]])
+
+class TestDeadlineStoppingCriteria(unittest.TestCase):
+    def test_only_expired_rows_stop(self):
+        """Test that rows stop once their deadline passes or is cancelled"""
+        import torch
+        from deadlines import deadline_stopping_criteria
+
+        cancelled = Deadline()
+        cancelled.cancel()
+        criteria = deadline_stopping_criteria([None, Deadline(30), cancelled, Deadline(0)])
+
+        self.assertIsNone(deadline_stopping_criteria([None, None]))
+        self.assertEqual(criteria[0](torch.zeros(4, 2, dtype=torch.long), None).tolist(),
+                         [False, False, True, True])
+
+if __name__ == '__main__':
+    unittest.main()
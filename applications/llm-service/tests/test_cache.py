@@ -0,0 +1,131 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the path so we can import the cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ResponseCache, SQLiteCacheBackend, TieredCache, make_cache_key
+
+class TestResponseCache(unittest.TestCase):
+    def test_get_and_set(self):
+        """Test that stored values are returned and missing keys give None"""
+        cache = ResponseCache()
+        cache.set("a", "one")
+        
+        self.assertEqual(cache.get("a"), "one")
+        self.assertIsNone(cache.get("b"))
+        
+    def test_evicts_least_recently_used(self):
+        """Test that reading an entry protects it from eviction"""
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", "one")
+        cache.set("b", "two")
+        cache.get("a")
+        cache.set("c", "three")
+        
+        self.assertEqual(cache.get("a"), "one")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "three")
+        
+    def test_byte_budget(self):
+        """Test that entries are evicted once the byte budget is exceeded"""
+        cache = ResponseCache(max_bytes=20)
+        cache.set("a", "x" * 9)
+        cache.set("b", "y" * 9)
+        cache.set("c", "z" * 9)
+        
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+        
+    def test_oversized_value_not_cached(self):
+        """Test that a value larger than the whole budget is skipped"""
+        cache = ResponseCache(max_bytes=10)
+        cache.set("a", "x" * 100)
+        
+        self.assertEqual(len(cache), 0)
+        
+    def test_ttl_expiry(self):
+        """Test that entries expire after the time to live"""
+        cache = ResponseCache(ttl_seconds=10)
+        with patch("cache.time.monotonic", return_value=100.0):
+            cache.set("a", "one")
+        with patch("cache.time.monotonic", return_value=105.0):
+            self.assertEqual(cache.get("a"), "one")
+        with patch("cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+class TestTieredCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "responses.db")
+        
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        
+    def test_replicas_share_entries(self):
+        """Test that an entry written by one replica is read by another"""
+        first = TieredCache(ResponseCache(), SQLiteCacheBackend(self.path))
+        second = TieredCache(ResponseCache(), SQLiteCacheBackend(self.path))
+        first.set("key", "value")
+        
+        self.assertIsNone(second.local.get("key"))
+        self.assertEqual(second.get("key"), "value")
+        self.assertEqual(second.local.get("key"), "value")
+        
+    def test_shared_entries_expire(self):
+        """Test that the shared tier honours the local time to live"""
+        cache = TieredCache(ResponseCache(ttl_seconds=10), SQLiteCacheBackend(self.path))
+        with patch("cache.time.time", return_value=1000.0):
+            cache.set("key", "value")
+        cache.clear()
+        with patch("cache.time.time", return_value=1005.0):
+            self.assertEqual(cache.get("key"), "value")
+        cache.clear()
+        with patch("cache.time.time", return_value=1011.0):
+            self.assertIsNone(cache.get("key"))
+        
+    def test_sqlite_connects_per_process(self):
+        """Test that the SQLite tier connects on first use and again after a fork"""
+        shared = SQLiteCacheBackend(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        
+        shared.set("key", "value")
+        parent_conn = shared._conn
+        with patch("cache.os.getpid", return_value=os.getpid() + 1):
+            self.assertEqual(shared.get("key"), "value")
+            self.assertIsNot(shared._conn, parent_conn)
+        
+    def test_shared_failures_are_misses(self):
+        """Test that an unavailable shared tier does not raise"""
+        shared = MagicMock()
+        shared.get.side_effect = ConnectionError("down")
+        shared.set.side_effect = ConnectionError("down")
+        cache = TieredCache(ResponseCache(), shared)
+        
+        cache.set("key", "value")
+        cache.clear()
+        self.assertIsNone(cache.get("key"))
+
+class TestMakeCacheKey(unittest.TestCase):
+    def test_key_is_stable(self):
+        """Test that parameter order and Unicode form do not change the key"""
+        a = make_cache_key("distilgpt2", "caf\u00e9", {"max_length": 50, "seed": 1})
+        b = make_cache_key("distilgpt2", "cafe\u0301", {"seed": 1, "max_length": 50})
+        
+        self.assertEqual(a, b)
+        self.assertEqual(len(a), 64)
+        
+    def test_key_depends_on_inputs(self):
+        """Test that model, prompt and parameters all change the key"""
+        base = make_cache_key("distilgpt2", "hello", {"max_length": 50})
+        
+        self.assertNotEqual(base, make_cache_key("gpt2", "hello", {"max_length": 50}))
+        self.assertNotEqual(base, make_cache_key("distilgpt2", "hello!", {"max_length": 50}))
+        self.assertNotEqual(base, make_cache_key("distilgpt2", "hello", {"max_length": 60}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import unittest
+import sys
+import os
+from concurrent.futures import Future
+
+# Add the parent directory to the path so we can import the breaker
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+class TestCircuitBreaker(unittest.TestCase):
+    def fail_call(self, breaker):
+        with self.assertRaises(RuntimeError):
+            with breaker.call():
+                raise RuntimeError("boom")
+        
+    def test_opens_after_consecutive_failures(self):
+        """Test that the breaker opens after the threshold and hints when to retry"""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.fail_call(breaker)
+        self.fail_call(breaker)
+        with breaker.call():
+            pass
+        for _ in range(3):
+            self.fail_call(breaker)
+        
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.allow()
+        self.assertEqual(raised.exception.retry_after, 30)
+        self.assertEqual(breaker.in_flight, 0)
+        
+    def test_half_open_probe(self):
+        """Test that one probe is let through and decides whether the breaker closes"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        self.fail_call(breaker)
+        time.sleep(0.06)
+        
+        probe = breaker.allow()
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+        probe.failure()
+        self.assertEqual(breaker.state, "open")
+        
+        time.sleep(0.06)
+        with breaker.call():
+            pass
+        self.assertEqual(breaker.state, "closed")
+        
+    def test_opens_when_p95_latency_exceeds_slo(self):
+        """Test that slow successful calls open the breaker once enough are seen"""
+        breaker = CircuitBreaker(latency_slo=0.01, min_samples=5, window_size=10)
+        for _ in range(4):
+            call = breaker.allow()
+            call.started_at -= 1
+            call.success()
+        self.assertEqual(breaker.state, "closed")
+        
+        call = breaker.allow()
+        call.started_at -= 1
+        call.success()
+        self.assertEqual(breaker.state, "open")
+        self.assertGreater(breaker.p95_latency(), 0.99)
+        
+    def test_sheds_calls_over_in_flight_limit(self):
+        """Test that calls beyond max_in_flight are refused without opening"""
+        breaker = CircuitBreaker(max_in_flight=2)
+        calls = [breaker.allow(), breaker.allow()]
+        
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.allow()
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.assertEqual(breaker.state, "closed")
+        calls[0].release()
+        breaker.allow()
+        
+    def test_ignored_exceptions_and_tracked_futures(self):
+        """Test that ignored exceptions don't count and tracked futures decide the outcome"""
+        breaker = CircuitBreaker(failure_threshold=1, ignored_exceptions=(KeyError,))
+        with self.assertRaises(KeyError):
+            with breaker.call():
+                raise KeyError("queue full")
+        self.assertEqual(breaker.state, "closed")
+        
+        future = Future()
+        with breaker.call() as call:
+            call.track(future)
+        self.assertEqual(breaker.in_flight, 1)
+        future.set_exception(RuntimeError("boom"))
+        self.assertEqual(breaker.in_flight, 0)
+        self.assertEqual(breaker.state, "open")
+
+if __name__ == '__main__':
+    unittest.main()
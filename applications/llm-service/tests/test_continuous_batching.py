@@ -0,0 +1,124 @@
+import unittest
+import sys
+import os
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+# Add the parent directory to the path so we can import the engine
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from continuous_batching import ContinuousBatchingEngine
+from deadlines import Deadline, RequestCancelled
+from llm_inference import PromptEncoder
+
+class CharTokenizer:
+    """Minimal tokenizer mapping characters to ids, with id 0 as EOS"""
+    eos_token_id = 0
+    pad_token_id = 0
+
+    def __call__(self, text, truncation=False, max_length=None):
+        if isinstance(text, list):
+            return {"input_ids": [self(t, truncation, max_length)["input_ids"] for t in text]}
+        ids = [ord(c) % 63 + 1 for c in text]
+        if truncation and max_length is not None:
+            ids = ids[:max_length]
+        return {"input_ids": ids}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return ",".join(str(i) for i in ids if not (skip_special_tokens and i == 0))
+
+class TestContinuousBatchingEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        config = GPT2Config(vocab_size=64, n_positions=128, n_embd=16,
+                            n_layer=2, n_head=2, eos_token_id=0, bos_token_id=0)
+        cls.model = GPT2LMHeadModel(config).eval()
+        cls.tokenizer = CharTokenizer()
+
+    def reference(self, prompt, max_length):
+        ids = torch.tensor([self.tokenizer(prompt)["input_ids"]])
+        output = self.model.generate(ids, attention_mask=torch.ones_like(ids),
+                                     max_length=max_length, do_sample=False,
+                                     pad_token_id=0)
+        return self.tokenizer.decode(output[0].tolist(), skip_special_tokens=True)
+
+    def test_greedy_matches_generate(self):
+        """Test that mixed-length sequences decode as they would alone"""
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, max_batch_size=2,
+                                          do_sample=False, no_repeat_ngram_size=0)
+        requests = [("hello", 12), ("a much longer prompt", 30), ("xyz", 20), ("q", 8)]
+        futures = [engine.submit(prompt, max_length=length) for prompt, length in requests]
+        results = [f.result(timeout=30) for f in futures]
+        engine.stop()
+
+        for (prompt, length), result in zip(requests, results):
+            self.assertEqual(result, self.reference(prompt, length))
+
+    def test_prompt_longer_than_max_length(self):
+        """Test that a prompt filling max_length is returned without decoding"""
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, do_sample=False)
+        result = engine.generate("abcdef", max_length=4, timeout=30)
+        engine.stop()
+
+        self.assertEqual(result, self.tokenizer.decode(self.tokenizer("abcd")["input_ids"]))
+
+    def test_max_new_tokens_keeps_whole_prompt(self):
+        """Test that max_new_tokens generates after the untruncated prompt"""
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, max_batch_size=2,
+                                          do_sample=False, no_repeat_ngram_size=0)
+        futures = [engine.submit("abcdef", max_new_tokens=5), engine.submit("abcdef", max_length=4)]
+        results = [f.result(timeout=30) for f in futures]
+        engine.stop()
+
+        self.assertEqual(results[0], self.reference("abcdef", 11))
+        self.assertEqual(results[1], self.tokenizer.decode(self.tokenizer("abcd")["input_ids"]))
+
+    def test_cancelled_sequence_is_dropped(self):
+        """Test that a cancelled sequence fails while the others finish"""
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, max_batch_size=2,
+                                          do_sample=False, no_repeat_ngram_size=0)
+        deadline = Deadline()
+        cancelled = engine.submit("abc", max_new_tokens=50, deadline=deadline,
+                                  on_token=lambda _: deadline.cancel())
+        other = engine.submit("hello", max_length=12)
+
+        with self.assertRaises(RequestCancelled):
+            cancelled.result(timeout=30)
+        self.assertEqual(other.result(timeout=30), self.reference("hello", 12))
+        engine.stop()
+
+    def test_encoder_error_fails_admitted_requests_only(self):
+        """Test that an admission that raises fails its requests and the engine keeps serving"""
+        class FailingEncoder(PromptEncoder):
+            fail = True
+            
+            def encode_batch(self, prompts, max_length=None):
+                if self.fail:
+                    self.fail = False
+                    raise RuntimeError("tokenizer failed")
+                return super().encode_batch(prompts, max_length)
+        
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, do_sample=False,
+                                          no_repeat_ngram_size=0, encoder=FailingEncoder(self.tokenizer))
+        with self.assertRaises(RuntimeError):
+            engine.generate("hello", max_length=12, timeout=30)
+        result = engine.generate("hello", max_length=12, timeout=30)
+        engine.stop()
+        
+        self.assertEqual(result, self.reference("hello", 12))
+
+    def test_no_repeat_ngram(self):
+        """Test that sampled sequences never repeat a bigram"""
+        engine = ContinuousBatchingEngine(self.model, self.tokenizer, max_batch_size=4,
+                                          no_repeat_ngram_size=2)
+        result = engine.generate("ab", max_length=40, timeout=30)
+        engine.stop()
+
+        ids = result.split(",")
+        bigrams = list(zip(ids, ids[1:]))
+        self.assertEqual(len(bigrams), len(set(bigrams)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the executor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executor import InferenceExecutor, QueueFullError
+
+class TestInferenceExecutor(unittest.TestCase):
+    def test_runs_tasks(self):
+        """Test that submitted tasks run and return their results"""
+        executor = InferenceExecutor(max_workers=2, max_queue_size=4)
+        futures = [executor.submit(pow, i, 2) for i in range(4)]
+        
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 1, 4, 9])
+        executor.shutdown()
+        
+    def test_rejects_when_queue_is_full(self):
+        """Test that a full queue raises instead of blocking"""
+        executor = InferenceExecutor(max_workers=1, max_queue_size=1)
+        release = threading.Event()
+        started = threading.Event()
+        
+        def blocking_task():
+            started.set()
+            release.wait(5)
+            return "done"
+        
+        running = executor.submit(blocking_task)
+        started.wait(5)
+        queued = executor.submit(blocking_task)
+        with self.assertRaises(QueueFullError):
+            executor.submit(blocking_task)
+        
+        release.set()
+        self.assertEqual(running.result(timeout=5), "done")
+        self.assertEqual(queued.result(timeout=5), "done")
+        executor.shutdown()
+        
+    def test_task_errors_are_returned(self):
+        """Test that exceptions raised by a task surface on its future"""
+        executor = InferenceExecutor(max_workers=1)
+        future = executor.submit(int, "not a number")
+        
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+        executor.shutdown()
+        
+    def test_rejects_after_shutdown(self):
+        """Test that no work is accepted once the pool is shut down"""
+        executor = InferenceExecutor(max_workers=1)
+        executor.submit(int, "1").result(timeout=5)
+        executor.shutdown()
+        
+        with self.assertRaises(QueueFullError):
+            executor.submit(int, "1")
+
+if __name__ == '__main__':
+    unittest.main()
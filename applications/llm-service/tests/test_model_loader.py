@@ -0,0 +1,50 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the path so we can import the loader
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_loader import ModelLoader, is_snapshot, save_snapshot
+
+class TestModelLoader(unittest.TestCase):
+    def test_background_load_from_snapshot(self):
+        """Test that a snapshot is loaded in the background and setup runs"""
+        loaded = []
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            save_snapshot("distilgpt2", snapshot_dir)
+            self.assertTrue(is_snapshot(snapshot_dir))
+            
+            loader = ModelLoader("distilgpt2", snapshot_dir=snapshot_dir,
+                                 on_loaded=lambda tokenizer, model: loaded.append(model),
+                                 warm_up=lambda: {16: 0.5})
+            self.assertEqual(loader.source, snapshot_dir)
+            loader.start()
+            
+            self.assertTrue(loader.wait(timeout=60))
+        self.assertEqual(loaded, [loader.model])
+        self.assertEqual(set(loader.timings), {"tokenizer", "model", "setup", "warmup", "total"})
+        self.assertEqual(loader.warmup_latency, {16: 0.5})
+        
+    def test_missing_snapshot_falls_back_to_model_name(self):
+        """Test that the hub name is used when the snapshot directory is empty"""
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            loader = ModelLoader("distilgpt2", snapshot_dir=snapshot_dir)
+            self.assertEqual(loader.source, "distilgpt2")
+        
+    def test_failed_load(self):
+        """Test that a failing load marks the loader failed"""
+        def failing_setup(tokenizer, model):
+            raise RuntimeError("boom")
+        
+        loader = ModelLoader("distilgpt2", on_loaded=failing_setup)
+        loader.start()
+        
+        self.assertFalse(loader.wait(timeout=60))
+        self.assertEqual(loader.status, "failed")
+        self.assertEqual(loader.error, "boom")
+        self.assertIsNone(loader.model)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import sys
+import os
+
+import torch
+
+# Add the parent directory to the path so we can import the cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from continuous_batching import ContinuousBatchingEngine
+from prefix_cache import PrefixCache
+from test_continuous_batching import CharTokenizer
+
+def make_past(token_ids, layers=2):
+    """Legacy cache whose values encode the token at each position"""
+    values = torch.tensor(token_ids, dtype=torch.float32).view(1, 1, -1, 1)
+    return tuple((values.clone(), values.clone()) for _ in range(layers))
+
+class TestPrefixCache(unittest.TestCase):
+    def test_longest_shared_prefix(self):
+        """Test that lookups resume from the longest stored prefix"""
+        cache = PrefixCache(min_tokens=2)
+        cache.insert([1, 2, 3, 4, 5], make_past([1, 2, 3, 4, 5]))
+        
+        length, past = cache.lookup([1, 2, 3, 9, 9])
+        self.assertEqual(length, 3)
+        self.assertEqual(past[0][0].flatten().tolist(), [1, 2, 3])
+        
+    def test_leaves_one_token_to_prefill(self):
+        """Test that an exact match still leaves the last token uncached"""
+        cache = PrefixCache(min_tokens=2)
+        cache.insert([1, 2, 3], make_past([1, 2, 3]))
+        
+        length, _ = cache.lookup([1, 2, 3])
+        self.assertEqual(length, 2)
+        
+    def test_short_prefixes_are_ignored(self):
+        """Test that matches below min_tokens are not used"""
+        cache = PrefixCache(min_tokens=4)
+        cache.insert([1, 2, 3, 4, 5], make_past([1, 2, 3, 4, 5]))
+        
+        self.assertEqual(cache.lookup([1, 2, 3, 7, 8]), (0, None))
+        self.assertEqual(cache.lookup([7, 8, 9, 10]), (0, None))
+        
+    def test_evicts_least_recently_used_within_budget(self):
+        """Test that the byte budget evicts the least recently used prompt"""
+        entry_bytes = 2 * 2 * 4 * 4
+        cache = PrefixCache(max_bytes=2 * entry_bytes, min_tokens=2)
+        cache.insert([1, 2, 3, 4], make_past([1, 2, 3, 4]))
+        cache.insert([5, 6, 7, 8], make_past([5, 6, 7, 8]))
+        cache.lookup([1, 2, 3, 9])
+        cache.insert([1, 2, 7, 7], make_past([1, 2, 7, 7]))
+        
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup([5, 6, 7, 9]), (0, None))
+        self.assertEqual(cache.lookup([1, 2, 3, 9])[0], 3)
+        self.assertEqual(cache.lookup([1, 2, 7, 7, 1])[0], 4)
+        
+    def test_eviction_keeps_shorter_entries_on_path(self):
+        """Test that evicting a long prompt keeps a stored prefix of it usable"""
+        entry_bytes = 2 * 2 * 4 * 3
+        cache = PrefixCache(max_bytes=entry_bytes * 3, min_tokens=2)
+        cache.insert([1, 2, 3], make_past([1, 2, 3]))
+        cache.insert([1, 2, 3, 4, 5, 6], make_past([1, 2, 3, 4, 5, 6]))
+        cache.lookup([1, 2, 3, 9])
+        cache.insert([7, 8, 9], make_past([7, 8, 9]))
+        
+        self.assertEqual(len(cache), 2)
+        length, past = cache.lookup([1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(length, 3)
+        self.assertEqual(past[0][0].flatten().tolist(), [1, 2, 3])
+
+class TestEnginePrefixReuse(unittest.TestCase):
+    def test_cached_prefix_gives_the_same_output(self):
+        """Test that a prompt resuming from a cached prefix decodes as model.generate does"""
+        from transformers import GPT2Config, GPT2LMHeadModel
+        
+        torch.manual_seed(0)
+        config = GPT2Config(vocab_size=64, n_positions=128, n_embd=16,
+                            n_layer=2, n_head=2, eos_token_id=0, bos_token_id=0)
+        model = GPT2LMHeadModel(config).eval()
+        tokenizer = CharTokenizer()
+        cache = PrefixCache(min_tokens=4)
+        engine = ContinuousBatchingEngine(model, tokenizer, do_sample=False,
+                                          no_repeat_ngram_size=0, prefix_cache=cache)
+        
+        engine.generate("the quick brown fox", max_length=30, timeout=30)
+        hits_before = cache.hits
+        result = engine.generate("the quick brown cat", max_length=30, timeout=30)
+        engine.stop()
+        
+        ids = torch.tensor([tokenizer("the quick brown cat")["input_ids"]])
+        expected = model.generate(ids, attention_mask=torch.ones_like(ids), max_length=30,
+                                  do_sample=False, pad_token_id=0)
+        self.assertEqual(cache.hits, hits_before + 1)
+        self.assertEqual(result, tokenizer.decode(expected[0].tolist(), skip_special_tokens=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from singleflight import COALESCED_REQUESTS, SingleFlight
+
+class Cancelled(Exception):
+    """Failure of one caller's request that is not shared"""
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_result(self):
+        """Test that callers with the same key wait on the first call"""
+        group = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        
+        def slow_call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+        
+        results = []
+        def caller():
+            results.append(group.do("key", slow_call))
+        
+        coalesced_before = COALESCED_REQUESTS._value.get()
+        leader = threading.Thread(target=caller)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=caller) for _ in range(3)]
+        for t in followers:
+            t.start()
+        
+        # Release the leader once every follower is waiting on it
+        deadline = time.time() + 5
+        while COALESCED_REQUESTS._value.get() - coalesced_before < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("result", False)] + [("result", True)] * 3)
+        self.assertEqual(group.in_flight(), 0)
+        
+    def test_different_keys_run_separately(self):
+        """Test that calls for different keys are not shared"""
+        group = SingleFlight()
+        
+        self.assertEqual(group.do("a", lambda: 1), (1, False))
+        self.assertEqual(group.do("b", lambda: 2), (2, False))
+        
+    def test_errors_are_shared(self):
+        """Test that a failing call raises for the caller and clears the key"""
+        group = SingleFlight()
+        
+        def failing_call():
+            raise ValueError("boom")
+        
+        with self.assertRaises(ValueError):
+            group.do("key", failing_call)
+        self.assertEqual(group.in_flight(), 0)
+        
+    def test_async_callers_share_one_result(self):
+        """Test that coroutines with the same key await the first call"""
+        group = SingleFlight()
+        calls = []
+        
+        async def slow_call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+        
+        async def run():
+            return await asyncio.gather(*(group.do_async("key", slow_call) for _ in range(4)))
+        
+        results = asyncio.run(run())
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("result", False)] + [("result", True)] * 3)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_waiting_caller_times_out_alone(self):
+        """Test that a caller stops waiting at its timeout while the call finishes"""
+        group = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        
+        def slow_call():
+            started.set()
+            release.wait(5)
+            return "result"
+        
+        results = []
+        leader = threading.Thread(target=lambda: results.append(group.do("key", slow_call)))
+        leader.start()
+        started.wait(5)
+        
+        start = time.monotonic()
+        with self.assertRaises(FutureTimeoutError):
+            group.do("key", lambda: "unused", timeout=0.05)
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        leader.join(5)
+        self.assertEqual(results, [("result", False)])
+        
+    def test_cancelled_call_is_retried_by_waiting_callers(self):
+        """Test that a call failing with a retry_on exception is run again for the callers waiting on it"""
+        group = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        
+        def cancelled_call():
+            started.set()
+            release.wait(5)
+            raise Cancelled()
+        
+        errors = []
+        def lead():
+            try:
+                group.do("key", cancelled_call, retry_on=(Cancelled,))
+            except Cancelled as e:
+                errors.append(e)
+        
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        coalesced_before = COALESCED_REQUESTS._value.get()
+        results = []
+        follower = threading.Thread(target=lambda: results.append(
+            group.do("key", lambda: "own result", timeout=5, retry_on=(Cancelled,))))
+        follower.start()
+        while COALESCED_REQUESTS._value.get() == coalesced_before:
+            time.sleep(0.01)
+        release.set()
+        for t in (leader, follower):
+            t.join(5)
+        
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(results, [("own result", False)])
+        self.assertEqual(group.in_flight(), 0)
+        self.assertEqual(COALESCED_REQUESTS._value.get(), coalesced_before + 1)
+        
+    def test_async_cancelled_call_is_retried_by_waiting_callers(self):
+        """Test that callers waiting on a cancelled coroutine's call run it again and are counted once"""
+        group = SingleFlight()
+        coalesced_before = COALESCED_REQUESTS._value.get()
+        
+        async def slow_call():
+            await asyncio.sleep(5)
+            return "unused"
+        
+        async def own_call():
+            await asyncio.sleep(0.01)
+            return "own result"
+        
+        async def run():
+            leader = asyncio.ensure_future(group.do_async("key", slow_call))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(group.do_async("key", own_call, timeout=5)) for _ in range(2)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.gather(*followers)
+        
+        results = asyncio.run(run())
+        
+        self.assertEqual(sorted(results), [("own result", False), ("own result", True)])
+        self.assertEqual(group.in_flight(), 0)
+        self.assertEqual(COALESCED_REQUESTS._value.get(), coalesced_before + 2)
+        
+    def test_async_waiting_caller_times_out_alone(self):
+        """Test that a coroutine stops waiting at its timeout without cancelling the call"""
+        group = SingleFlight()
+        
+        async def slow_call():
+            await asyncio.sleep(0.2)
+            return "result"
+        
+        async def run():
+            leader = asyncio.ensure_future(group.do_async("key", slow_call))
+            await asyncio.sleep(0)
+            with self.assertRaises(asyncio.TimeoutError):
+                await group.do_async("key", slow_call, timeout=0.01)
+            return await leader
+        
+        self.assertEqual(asyncio.run(run()), ("result", False))
+
+if __name__ == '__main__':
+    unittest.main()
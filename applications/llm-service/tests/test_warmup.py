@@ -0,0 +1,40 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoTokenizer
+from warmup import WARMUP_SECONDS, parse_buckets, warm_up, warmup_prompt
+
+class TestWarmUp(unittest.TestCase):
+    def test_parse_buckets(self):
+        """Test that buckets are parsed, deduplicated and sorted"""
+        self.assertEqual(parse_buckets("64, 16,,64"), [16, 64])
+        self.assertEqual(parse_buckets(""), [])
+        
+    def test_each_bucket_is_generated_and_timed(self):
+        """Test that one generation runs per bucket that fits the model"""
+        tokenizer = AutoTokenizer.from_pretrained("distilgpt2")
+        calls = []
+        
+        def generate(prompt, max_length):
+            calls.append((len(tokenizer(prompt)["input_ids"]), max_length))
+        
+        latencies = warm_up(generate, tokenizer, [8, 32, 100], new_tokens=4, max_positions=64)
+        
+        self.assertEqual([max_length for _, max_length in calls], [12, 36])
+        self.assertEqual(sorted(latencies), [8, 32])
+        self.assertEqual(WARMUP_SECONDS.labels(bucket="8")._value.get(), latencies[8])
+        
+    def test_prompt_length(self):
+        """Test that warm-up prompts have about the requested length"""
+        tokenizer = AutoTokenizer.from_pretrained("distilgpt2")
+        
+        for length in (8, 64):
+            tokens = len(tokenizer(warmup_prompt(tokenizer, length))["input_ids"])
+            self.assertLessEqual(abs(tokens - length), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Startup warm-up for the LLM service
+
+The first requests after a start pay for cold kernels, a growing allocator
+and, with torch.compile, compilation for each new input shape. Warm-up runs
+one generation per prompt length bucket before the service reports ready,
+so that cost is paid before traffic arrives, and records how long each
+bucket took.
+"""
+
+import logging
+import time
+
+import torch
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SECONDS = Gauge(
+    "llm_warmup_seconds",
+    "Latency of the warm-up generation for each prompt length bucket",
+    ["bucket"],
+)
+
+WARMUP_TEXT = "The quick brown fox jumps over the lazy dog while the service warms up. "
+
+
+def parse_buckets(value):
+    """Parse a comma separated list of prompt lengths in tokens"""
+    return sorted({int(v) for v in (value or "").split(",") if v.strip()})
+
+
+def warmup_prompt(tokenizer, length):
+    """Build a representative prompt of about length tokens"""
+    ids = tokenizer(WARMUP_TEXT)["input_ids"]
+    ids = (ids * (length // max(1, len(ids)) + 1))[:length]
+    return tokenizer.decode(ids)
+
+
+def compile_model(model, mode):
+    """
+    Compile the model's forward pass
+
+    Args:
+        model: Model whose forward is replaced by a compiled version
+        mode: "none" to leave the model as is, or "compile" for torch.compile
+
+    Returns:
+        Whether the model was compiled
+    """
+    mode = (mode or "none").lower()
+    if mode == "none":
+        return False
+    if mode != "compile":
+        raise ValueError(f"Unknown model compile mode: {mode}")
+    if not hasattr(torch, "compile"):
+        logger.warning("torch.compile requires torch 2.0 or later, serving the model uncompiled")
+        return False
+    # Dynamic shapes so every prompt length doesn't trigger a recompile
+    model.forward = torch.compile(model.forward, dynamic=True)
+    return True
+
+
+def warm_up(generate, tokenizer, buckets, new_tokens=16, max_positions=None):
+    """
+    Run one generation per prompt length bucket
+
+    Args:
+        generate: Callable taking a prompt and max_length keyword
+        tokenizer: Tokenizer used to build the prompts
+        buckets: Prompt lengths in tokens
+        new_tokens: Tokens generated after each prompt
+        max_positions: Longest sequence the model supports, longer buckets
+            are skipped
+
+    Returns:
+        Dict of bucket to warm-up latency in seconds
+    """
+    latencies = {}
+    for bucket in buckets:
+        if max_positions and bucket + new_tokens > max_positions:
+            logger.warning(f"Skipping warm-up bucket {bucket}, the model supports {max_positions} positions")
+            continue
+        prompt = warmup_prompt(tokenizer, bucket)
+        start_time = time.perf_counter()
+        generate(prompt, max_length=bucket + new_tokens)
+        latencies[bucket] = time.perf_counter() - start_time
+        WARMUP_SECONDS.labels(bucket=str(bucket)).set(latencies[bucket])
+        logger.info(f"Warm-up for {bucket} prompt tokens took {latencies[bucket]:.3f}s")
+    return latencies
@@ -15,10 +15,10 @@ logging.basicConfig(
 )
 
 def check_health(url, max_retries=10, retry_interval=3):
-    """Check if a service is healthy"""
+    """Check if a service is healthy and has finished loading its model"""
     for i in range(max_retries):
         try:
-            response = requests.get(f"{url}/health", timeout=5)
+            response = requests.get(f"{url}/ready", timeout=5)
             if response.status_code == 200:
                 return True
         except: